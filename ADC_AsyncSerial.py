@@ -0,0 +1,292 @@
+## @package ADC_AsyncSerial
+#
+# Purpose: asyncio serial transport for the Sampling Engine test
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  AsyncSerialConnecter offers the open/send/read/close surface of ADC_Test.SerialConnecter as coroutines. The ports
+#  are configured through pyserial and then switched to non-blocking file descriptors watched by the event loop, so
+#  the controller and DUT can be read at the same time and every read has its own deadline instead of the fixed
+#  10 s serial timeout. Any path pyserial can open works, including the slave side of os.openpty().
+#
+#  The event loop reader API needs selectable descriptors, so this transport is for POSIX hosts.
+
+import asyncio
+import logging
+import os
+import time
+
+import serial
+
+from ADC_FrameParser import ParseLine, ReportAssembler
+from ADC_Pipeline import EncodeSetpoint
+
+
+## Documentation for the AsyncLineReader class.
+#
+#  This class buffers the bytes of one non-blocking descriptor and hands them out line by line
+class AsyncLineReader(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param fd Non-blocking file descriptor to read.
+    #  @param loop Event loop the descriptor is registered with.
+    def __init__(self, fd, loop):
+        self.fd      = fd
+        self.loop    = loop
+        self.buffer  = bytearray()
+        self.waiter  = None
+        self.eof     = False
+        loop.add_reader(fd, self._OnReadable)
+
+    ## Documentation for _OnReadable method.
+    #  @param self The object pointer.
+    def _OnReadable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            #A pty reports EIO once the other side has closed
+            data = b''
+        if not data:
+            self.eof = True
+            self.loop.remove_reader(self.fd)
+        self.buffer += data
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    ## Documentation for ReadLine method.
+    #
+    # Returns the next line including its '\n'. Raises asyncio.TimeoutError if no complete line arrives before the
+    # deadline, and returns whatever is left (possibly b'') once the port is closed.
+    #  @param self The object pointer.
+    #  @param timeout Seconds to wait for the line, None waits forever.
+    async def ReadLine(self, timeout=None):
+        deadline = None if timeout is None else self.loop.time() + timeout
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                data = bytes(self.buffer[:end+1])
+                del self.buffer[:end+1]
+                return data
+            if self.eof:
+                data = bytes(self.buffer)
+                del self.buffer[:]
+                return data
+            self.waiter = self.loop.create_future()
+            try:
+                if deadline is None:
+                    await self.waiter
+                else:
+                    remaining = deadline - self.loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    await asyncio.wait_for(self.waiter, remaining)
+            finally:
+                self.waiter = None
+
+    ## Documentation for Close method.
+    #  @param self The object pointer.
+    def Close(self):
+        if not self.eof:
+            self.loop.remove_reader(self.fd)
+            self.eof = True
+
+
+## Documentation for the AsyncSerialConnecter class.
+#
+#  This class defines the methods used to talk to the controller and DUT from an asyncio event loop
+class AsyncSerialConnecter(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param readTimeout Default deadline in seconds for each line read.
+    #  @param verbose Print every serial Tx/Rx to stdout.
+    def __init__(self, uCPort, uCBaud, dutPort, dutBaud, readTimeout=10, verbose=True):
+        self.uCPort      = uCPort
+        self.uCBaud      = uCBaud
+        self.dutPort     = dutPort
+        self.dutBaud     = dutBaud
+        self.readTimeout = readTimeout
+        self.verbose     = verbose
+        print ("AsyncSerialConnecter Initialised")
+
+    ## Documentation for _Open method.
+    #
+    # Opens and configures a port through pyserial and returns it with a line reader on its descriptor.
+    #  @param self The object pointer.
+    def _Open(self, port, baud):
+        ser = serial.Serial(port, baud, timeout=0)
+        os.set_blocking(ser.fileno(), False)
+        return ser, AsyncLineReader(ser.fileno(), asyncio.get_running_loop())
+
+    ## Documentation for _Write method.
+    #
+    # Writes all of data to a non-blocking descriptor, waiting for the loop to report it writable when full.
+    @staticmethod
+    async def _Write(fd, data):
+        loop = asyncio.get_running_loop()
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                writable = loop.create_future()
+                loop.add_writer(fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(fd)
+
+    ## Documentation for _Encode method.
+    @staticmethod
+    def _Encode(command):
+        if isinstance(command, str):
+            command = command.encode('ascii')
+        return command
+
+    ## Documentation for openSerialPortCON method.
+    #  @param self The object pointer.
+    async def openSerialPortCON(self):
+        self.ser1, self.reader1 = self._Open(self.uCPort, self.uCBaud)
+        print ("Controller Serial Port: Open")
+
+    ## Documentation for openSerialPortDUT method.
+    #  @param self The object pointer.
+    async def openSerialPortDUT(self):
+        self.ser2, self.reader2 = self._Open(self.dutPort, self.dutBaud)
+        print ("DUT Serial Port: Open")
+
+    ## Documentation for SendSerialCON method.
+    #  @param self The object pointer.
+    async def SendSerialCON(self, command, getline=False):
+        if self.verbose:
+            print ("Controller Serial Port Tx: ", command)
+        await self._Write(self.ser1.fileno(), self._Encode(command))
+        data = ''
+        if getline:
+            data = await self.ReadSerialPortLineCON()
+        return data
+
+    ## Documentation for SendSerialDUT method.
+    #  @param self The object pointer.
+    async def SendSerialDUT(self, command, getline=False):
+        if self.verbose:
+            print ("DUT Serial Port Tx: ", command)
+        await self._Write(self.ser2.fileno(), self._Encode(command))
+        data = ''
+        if getline:
+            data = await self.ReadSerialPortLineDUT()
+        return data
+
+    ## Documentation for ReadSerialPortLineCON method.
+    #  @param self The object pointer.
+    #  @param timeout Deadline for this read in seconds, defaults to readTimeout.
+    async def ReadSerialPortLineCON(self, timeout=None):
+        data = await self.reader1.ReadLine(self.readTimeout if timeout is None else timeout)
+        if self.verbose:
+            print ("Controller Serial Port Rx: ", data)
+        return data
+
+    ## Documentation for ReadSerialPortLineDUT method.
+    #  @param self The object pointer.
+    #  @param timeout Deadline for this read in seconds, defaults to readTimeout.
+    async def ReadSerialPortLineDUT(self, timeout=None):
+        data = await self.reader2.ReadLine(self.readTimeout if timeout is None else timeout)
+        if self.verbose:
+            print ("DUT Serial Port Rx: ", data)
+        return data
+
+    ## Documentation for CloseSerialPortCON method.
+    #  @param self The object pointer.
+    async def CloseSerialPortCON(self):
+        self.reader1.Close()
+        self.ser1.close()
+        print ("Controller Serial Port: Closed")
+
+    ## Documentation for CloseSerialPortDUT method.
+    #  @param self The object pointer.
+    async def CloseSerialPortDUT(self):
+        self.reader2.Close()
+        self.ser2.close()
+        print ("DUT Serial Port: Closed")
+
+
+## Documentation for a function.
+#
+# asyncio version of ADC_Test.LoopAndLog. Instead of sleeping a fixed interval after every test it waits for the
+# next set of DUT lines, each read bounded by the connector's deadline. The controller acknowledgement is read
+# concurrently with the first test's DUT lines. The lines are placed by their channel number and read up to the end
+# of each report, like SerialConnecter.ReadReportDUT. A read that reaches its deadline ends the report, like the
+# blocking reads: a missing DUT line fails its channel in that test and the run goes on.
+#  @param connector An AsyncSerialConnecter.
+#  @param evaluator A SamplingTest used to evaluate each set of DUT lines, one line per channel.
+#  @param limits (mean, min, max) windows as returned by ExpectedValueEngine.Limits.
+#  @param store Optional open ResultsStore, the readings of every test are appended to it.
+async def LoopAndLogAsync(connector, evaluator, fAmp, freq, limits, maxTests, store=None):
+
+    CHANNELS = evaluator.channels
+    PassCounter = [0]*CHANNELS
+    Timeouts = [0]
+
+    async def ReadLine(read, name):
+        try:
+            return await read()
+        except asyncio.TimeoutError:
+            Timeouts[0] += 1
+            print ("%s Serial Port Rx: timeout" % name)
+            return b''
+
+    async def ReadDUTLines():
+        return [await ReadLine(connector.ReadSerialPortLineDUT, 'DUT') for channel in range(CHANNELS)]
+
+    report = ReportAssembler()
+
+    async def ReadDUTReport(frames):
+        complete = report.Start(frames)
+        while not complete:
+            line = await ReadLine(connector.ReadSerialPortLineDUT, 'DUT')
+            if not line:
+                break
+            complete = report.Add(frames, ParseLine(line))
+        return frames
+
+    await asyncio.gather(connector.openSerialPortCON(), connector.openSerialPortDUT())
+    try:
+        #Wait for the DUT, it sends one line of data for each channel
+        await ReadDUTLines()
+        print ("The DUT is Ready")
+
+        MESSAGE_PING = EncodeSetpoint(fAmp, freq)
+        await connector.SendSerialCON(MESSAGE_PING)
+        #Check that the command ran while the DUT is already measuring
+        result = evaluator.pool.Next()
+        ack, _ = await asyncio.gather(ReadLine(connector.ReadSerialPortLineCON, 'Controller'), ReadDUTReport(result.frames))
+
+        startTime = time.monotonic()
+        for testCounter in range(1, maxTests+1):
+            if connector.verbose:
+                print ("Test Number :",testCounter)
+            if testCounter > 1:
+                result = evaluator.pool.Next()
+                await ReadDUTReport(result.frames)
+            EngineResults = evaluator.EvaluateFrames(result.frames, limits, result)
+            if store is not None:
+                evaluator.StoreResults(store, testCounter)
+            for channel in range(CHANNELS):
+                if EngineResults[channel] == True:
+                    PassCounter[channel] += 1
+                    logging.info('Test %d,Passed,%d', testCounter, 100.0 * PassCounter[channel] / testCounter)
+                else:
+                    logging.info('Test %d, Failed,%d', testCounter, 100.0 * PassCounter[channel] / testCounter)
+        elapsed = time.monotonic() - startTime
+        print ("%d tests in %.2f s, %d reads timed out" % (maxTests, elapsed, Timeouts[0]))
+    finally:
+        await asyncio.gather(connector.CloseSerialPortCON(), connector.CloseSerialPortDUT())
+        logging.info('Finished')
+
+    return PassCounter
@@ -0,0 +1,499 @@
+## @package ADC_Benchmark
+#
+# Purpose: Benchmark suite for the RunTest hot path
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  Drives every stage of a test without hardware. FakeSerial objects stand in for serial.Serial and replay
+#  recorded DUT lines (--lines, one DUT line per text line) or lines simulated by ADC_Simulator. The stages are:
+#
+#    expected    ExpectedValueEngine.Limits as RunTest calls it, served from the cache
+#    expected_uncached  the DAC sine model computed from scratch
+#    parse       FrameParser.Feed of one test's DUT lines
+#    evaluate    SamplingTest.EvaluateFrames
+#    runtest     SamplingTest.RunTest reading through SerialConnecter.ReadFrameDUT
+#    loopandlog  one iteration of LoopAndLog, including its counters and logging
+#    timed_section  an ADC_Instrument timed section around a call that does nothing
+#
+#  --startup RUNS adds the start up stages, each timed over RUNS fresh interpreters:
+#
+#    python_startup  an interpreter that does nothing, the floor of the other three
+#    import_adc_test  import ADC_Test
+#    startup_help    ADC_Test.py --help
+#    startup_dryrun  ADC_Test.py --dry-run of a single test point
+#
+#  Each stage reports latency percentiles and iterations/sec. --save writes the results as a JSON baseline and
+#  --compare checks a run against a saved baseline, exiting with status 1 when the median latency of a stage grew
+#  by more than --tolerance.
+#
+#  --memory traces the evaluate, runtest and loopandlog stages with tracemalloc instead of timing them. Each stage
+#  reports the memory allocated and freed again within an iteration, and the growth of the traced memory over all
+#  the iterations after a warm-up. A long run checks that memory stays bounded, e.g.
+#
+#    python ADC_Benchmark.py --memory -n 1000000 --maxgrowth 65536
+#
+#  exits with status 1 when a stage grew by more than 64 KiB over a million iterations.
+
+import argparse
+import array
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import ADC_Test
+from ADC_Expected import ExpectedValueEngine, CalculateExpectedADC
+from ADC_FrameParser import FrameParser
+from ADC_Instrument import Instrumentation
+from ADC_ResultsLog import ResultsSink
+from ADC_Scheduler import AdaptiveScheduler
+from ADC_Simulator import DUTSimulator
+
+
+## Documentation for the FakeSerial class.
+#
+#  Stand-in for serial.Serial that replays a list of lines forever and swallows writes
+class FakeSerial(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param lines List of bytes lines, each ending in '\n'.
+    def __init__(self, lines, timeout=10):
+        self.lines   = lines
+        self.index   = 0
+        self.timeout = timeout
+        self.written = 0
+
+    ## Documentation for in_waiting property.
+    #
+    # One line is delivered per read, like a DUT that reports line by line.
+    @property
+    def in_waiting(self):
+        return len(self.lines[self.index])
+
+    ## Documentation for readline method.
+    #  @param self The object pointer.
+    def readline(self):
+        line = self.lines[self.index]
+        self.index = (self.index + 1) % len(self.lines)
+        return line
+
+    ## Documentation for readinto method.
+    #  @param self The object pointer.
+    def readinto(self, buffer):
+        line = self.readline()
+        buffer[:len(line)] = line
+        return len(line)
+
+    ## Documentation for write method.
+    #  @param self The object pointer.
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+    ## Documentation for close method.
+    #  @param self The object pointer.
+    def close(self):
+        pass
+
+
+## Documentation for the FakePorts class.
+#
+#  openPort callable for SerialConnecter: the port named 'CON' acknowledges every command, any other port replays
+#  the DUT lines
+class FakePorts(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self, dutLines):
+        self.dutLines = dutLines
+
+    ## Documentation for __call__ method.
+    #  @param self The object pointer.
+    def __call__(self, port, baud, timeout):
+        if port == 'CON':
+            return FakeSerial([b'OK\r\n'], timeout)
+        return FakeSerial(self.dutLines, timeout)
+
+
+## Documentation for the TimingScheduler class.
+#
+#  Adaptive scheduler that records the duration of every LoopAndLog iteration
+class TimingScheduler(AdaptiveScheduler):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self):
+        AdaptiveScheduler.__init__(self, 0.0, 1.0)
+        self.latencies = []
+        self._last = None
+
+    ## Documentation for Start method.
+    #  @param self The object pointer.
+    def Start(self):
+        AdaptiveScheduler.Start(self)
+        self._last = time.perf_counter_ns()
+
+    ## Documentation for Wait method.
+    #  @param self The object pointer.
+    def Wait(self):
+        now = time.perf_counter_ns()
+        self.latencies.append(now - self._last)
+        self._last = now
+        self.tests += 1
+
+
+## Documentation for a function.
+#
+# Returns the simulated DUT lines of tests test sets
+def SimulatedLines(tests, channels, fAmp):
+    simulator = DUTSimulator(noise=3.0, channels=channels, seed=0)
+    simulator.fAmp = fAmp
+    return [simulator.Reading(channel).encode('ascii') for _ in range(tests) for channel in range(1, channels+1)]
+
+
+## Documentation for a function.
+#
+# Reads recorded DUT lines from a text file, blank lines are skipped
+def RecordedLines(filename):
+    with open(filename, 'rb') as linesFile:
+        return [line.rstrip(b'\r\n') + b'\r\n' for line in linesFile if line.strip()]
+
+
+## Documentation for a function.
+#
+# Calls func iterations times, after a short untimed warm-up, and returns the latency of every call in nanoseconds.
+# Calls too short for the clock are timed batch at a time and the batch average is recorded for each of them.
+def TimeCalls(func, iterations, batch=1):
+    clock = time.perf_counter_ns
+    for index in range(iterations//10):
+        func()
+    latencies = []
+    calls = range(batch)
+    for index in range(max(1, iterations//batch)):
+        startTime = clock()
+        for call in calls:
+            func()
+        latencies += [(clock() - startTime)//batch]*batch
+    return latencies
+
+
+## Documentation for a function.
+#
+# Summarises a list of nanosecond latencies as percentiles in microseconds and iterations/sec
+def Summarise(latencies):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    def Percentile(fraction):
+        return ordered[min(count-1, int(fraction*count))]/1000.0
+    total = sum(ordered)
+    return {'iterations': count,
+            'p50_us': Percentile(0.50), 'p90_us': Percentile(0.90), 'p99_us': Percentile(0.99),
+            'max_us': ordered[-1]/1000.0,
+            'per_sec': count*1e9/total if total else 0.0}
+
+
+## Documentation for a function.
+#
+# Points the ADC_Test module globals at fake ports, as main() would after parsing the arguments
+def SetupTestModule(dutLines, channels, fAmp, freq, maxTests):
+    ADC_Test.args = argparse.Namespace(maxtest=maxTests, interval=None, adaptive=True, minperiod=0.0, timeout=1.0,
+                                       earlystop=None, drift=None)
+    ADC_Test.DUT_PORT, ADC_Test.DUT_BAUD = 'DUT', 115200
+    ADC_Test.uC_PORT, ADC_Test.uC_BAUD = 'CON', 9600
+    ADC_Test.fAMP, ADC_Test.FREQ = fAmp, freq
+    ADC_Test.myExpected = ExpectedValueEngine()
+    ADC_Test.myConnector = ADC_Test.SerialConnecter(verbose=False, openPort=FakePorts(dutLines))
+    ADC_Test.mySamplingTest = ADC_Test.SamplingTest(verbose=False, channels=channels)
+    ADC_Test.myStore = None
+
+
+## Documentation for a function.
+#
+# Runs every stage and returns {stage: summary}
+def RunBenchmarks(dutLines, channels, iterations, fAmp=0.3, freq=50):
+
+    results = {}
+    engine = ExpectedValueEngine()
+    results['expected'] = Summarise(TimeCalls(lambda: engine.Limits(fAmp), iterations, batch=100))
+    results['expected_uncached'] = Summarise(TimeCalls(
+        lambda: CalculateExpectedADC(fAmp, engine.fOffsetDC, engine.fVrefDAC, engine.fGain, engine.BitRes, engine.iMaxSamples),
+        iterations))
+
+    testSets = [b''.join(dutLines[index:index+channels]) for index in range(0, len(dutLines) - channels + 1, channels)]
+    parser = FrameParser()
+    feed = itertools.cycle(testSets)
+    results['parse'] = Summarise(TimeCalls(lambda: parser.Feed(next(feed)), iterations))
+
+    SetupTestModule(dutLines, channels, fAmp, freq, iterations)
+    samplingTest = ADC_Test.mySamplingTest
+    limits = engine.Limits(fAmp)
+    frames = FrameParser().Feed(testSets[0])
+    results['evaluate'] = Summarise(TimeCalls(lambda: samplingTest.EvaluateFrames(frames, limits), iterations))
+
+    ADC_Test.myConnector.openSerialPortDUT()
+    results['runtest'] = Summarise(TimeCalls(samplingTest.RunTest, iterations))
+    ADC_Test.myConnector.CloseSerialPortDUT()
+
+    #LoopAndLog logs through the batched results sink, as it does under main()
+    SetupTestModule(dutLines, channels, fAmp, freq, iterations)
+    scheduler = TimingScheduler()
+    ADC_Test.mySamplingTest.CreateScheduler = lambda: scheduler
+    sink = ResultsSink(os.devnull).Start()
+    try:
+        ADC_Test.LoopAndLog()
+    finally:
+        sink.Stop()
+    results['loopandlog'] = Summarise(scheduler.latencies)
+
+    stats = Instrumentation()
+    section = argparse.Namespace(Noop=lambda: None)
+    stats.Wrap(section, 'Noop')
+    results['timed_section'] = Summarise(TimeCalls(section.Noop, iterations, batch=100))
+
+    return results
+
+
+## Documentation for the MemoryScheduler class.
+#
+#  Adaptive scheduler that records the traced memory peak of every LoopAndLog iteration
+class MemoryScheduler(AdaptiveScheduler):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param warmup Iterations run before the growth is measured.
+    #  @param iterations Iterations measured after the warm-up.
+    def __init__(self, warmup, iterations):
+        AdaptiveScheduler.__init__(self, 0.0, 1.0)
+        self.warmup = warmup
+        #Preallocated, so recording a peak allocates nothing
+        self.peaks = array.array('q', bytes(8*iterations))
+        self.start = None
+        self.current = None
+
+    ## Documentation for Start method.
+    #  @param self The object pointer.
+    def Start(self):
+        AdaptiveScheduler.Start(self)
+        tracemalloc.reset_peak()
+        self.current = tracemalloc.get_traced_memory()[0]
+
+    ## Documentation for Wait method.
+    #  @param self The object pointer.
+    def Wait(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.tests += 1
+        if self.tests == self.warmup:
+            self.start = current
+        elif self.tests > self.warmup:
+            self.peaks[self.tests - self.warmup - 1] = peak - self.current
+        self.current = current
+        tracemalloc.reset_peak()
+
+
+## Documentation for a function.
+#
+# Calls func iterations times under tracemalloc, after warmup untraced calls. Returns the transient peak of every
+# call in bytes, the memory allocated above what was traced before the call, and the growth of the traced memory
+# over all the calls. The peak is only sampled on one call in every step, resetting it costs as much as the call.
+def TraceCalls(func, iterations, warmup=1000, samples=10000):
+    for index in range(warmup):
+        func()
+    step = max(1, iterations//samples)
+    #Preallocated, so recording a peak allocates nothing
+    peaks = array.array('q', bytes(8*len(range(0, iterations, step))))
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        for index in range(iterations):
+            if index % step:
+                func()
+                continue
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            func()
+            peaks[index//step] = tracemalloc.get_traced_memory()[1] - current
+        growth = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    return peaks, growth
+
+
+## Documentation for a function.
+#
+# Summarises the transient peaks and growth of a traced stage in bytes
+def SummariseMemory(peaks, growth, iterations):
+    ordered = sorted(peaks)
+    return {'iterations': iterations, 'peak_p50_b': ordered[len(ordered)//2], 'peak_max_b': ordered[-1],
+            'growth_b': growth, 'growth_per_iter_b': float(growth)/iterations}
+
+
+## Documentation for a function.
+#
+# Traces the evaluate, runtest and loopandlog stages and returns {stage: summary}
+def RunMemoryBenchmarks(dutLines, channels, iterations, fAmp=0.3, freq=50, warmup=1000):
+
+    results = {}
+    engine = ExpectedValueEngine()
+    limits = engine.Limits(fAmp)
+    SetupTestModule(dutLines, channels, fAmp, freq, iterations)
+    samplingTest = ADC_Test.mySamplingTest
+    frames = FrameParser().Feed(b''.join(dutLines[:channels]))
+    peaks, growth = TraceCalls(lambda: samplingTest.EvaluateFrames(frames, limits), iterations, warmup)
+    results['evaluate'] = SummariseMemory(peaks, growth, iterations)
+
+    ADC_Test.myConnector.openSerialPortDUT()
+    peaks, growth = TraceCalls(samplingTest.RunTest, iterations, warmup)
+    results['runtest'] = SummariseMemory(peaks, growth, iterations)
+    ADC_Test.myConnector.CloseSerialPortDUT()
+
+    #LoopAndLog logs through the batched results sink. Its queue is bounded but holds a varying number of records,
+    #so the growth is measured once Stop has drained it
+    SetupTestModule(dutLines, channels, fAmp, freq, iterations + warmup)
+    scheduler = MemoryScheduler(warmup, iterations)
+    ADC_Test.mySamplingTest.CreateScheduler = lambda: scheduler
+    sink = ResultsSink(os.devnull).Start()
+    tracemalloc.start()
+    try:
+        ADC_Test.LoopAndLog()
+        sink.Stop()
+        growth = tracemalloc.get_traced_memory()[0] - scheduler.start
+    finally:
+        tracemalloc.stop()
+        sink.Stop()
+    results['loopandlog'] = SummariseMemory(scheduler.peaks, growth, iterations)
+
+    return results
+
+
+## Documentation for a function.
+#
+# Prints the traced stage summaries as a table
+def PrintMemoryResults(results):
+    print ("%-18s %12s %14s %12s %12s" % ("stage", "iterations", "peak p50 B", "peak max B", "growth B"))
+    for stage, summary in results.items():
+        print ("%-18s %12d %14d %12d %12d" % (stage, summary['iterations'], summary['peak_p50_b'],
+                                               summary['peak_max_b'], summary['growth_b']))
+
+
+#Modules ADC_Test only imports once a test runs, --help and --dry-run must start without them
+DEFERRED_MODULES = ['numpy', 'serial', 'logging', 'ADC_ResultsLog']
+
+
+## Documentation for a function.
+#
+# Times fresh interpreters running the ADC_Test start up paths and returns {stage: summary}. Also prints the
+# DEFERRED_MODULES that a plain import of ADC_Test loads anyway.
+def RunStartupBenchmarks(runs):
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(directory, 'ADC_Test.py')
+    commands = [('python_startup',  ['-c', 'pass']),
+                ('import_adc_test', ['-c', 'import ADC_Test']),
+                ('startup_help',    [script, '--help']),
+                ('startup_dryrun',  [script, 'DUT', '115200', 'CON', '9600', '0.3', '50', '--dry-run'])]
+
+    results = {}
+    for stage, arguments in commands:
+        latencies = []
+        for run in range(runs + 1):
+            startTime = time.perf_counter_ns()
+            subprocess.run([sys.executable] + arguments, cwd=directory, stdout=subprocess.DEVNULL, check=True)
+            latencies.append(time.perf_counter_ns() - startTime)
+        #The first run also writes the bytecode caches
+        results[stage] = Summarise(latencies[1:])
+
+    loaded = subprocess.run([sys.executable, '-c', 'import sys, ADC_Test; print(" ".join(sorted(sys.modules)))'],
+                            cwd=directory, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout.split()
+    eager = [module for module in DEFERRED_MODULES if module in loaded]
+    if eager:
+        print ("import ADC_Test loads " + ", ".join(eager))
+    return results
+
+
+## Documentation for a function.
+#
+# Prints the stage summaries as a table
+def PrintResults(results):
+    print ("%-18s %10s %10s %10s %10s %12s" % ("stage", "p50 us", "p90 us", "p99 us", "max us", "iter/sec"))
+    for stage, summary in results.items():
+        print ("%-18s %10.2f %10.2f %10.2f %10.2f %12.0f" % (stage, summary['p50_us'], summary['p90_us'],
+                                                               summary['p99_us'], summary['max_us'], summary['per_sec']))
+
+
+## Documentation for a function.
+#
+# Compares results with a saved baseline. The median latency is compared, it is far less sensitive to scheduler
+# noise than the mean. Returns the list of stages whose median grew by more than tolerance (a fraction) and by more
+# than floor microseconds, so sub-microsecond stages do not trip on clock jitter.
+def CompareResults(results, baseline, tolerance, floor=1.0):
+    regressions = []
+    print ("%-18s %12s %12s %8s" % ("stage", "base p50 us", "p50 us", "change"))
+    for stage, summary in results.items():
+        if stage not in baseline['stages']:
+            continue
+        before = baseline['stages'][stage]['p50_us']
+        change = summary['p50_us']/before - 1.0 if before else 0.0
+        flag = ''
+        if change > tolerance and summary['p50_us'] - before > floor:
+            regressions.append(stage)
+            flag = '  REGRESSION'
+        print ("%-18s %12.2f %12.2f %+7.1f%%%s" % (stage, before, summary['p50_us'], 100.0*change, flag))
+    return regressions
+
+
+## Documentation for a function.
+#
+# Parses the arguments, runs the benchmarks and saves or compares the baseline
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmarks the RunTest hot path with fake serial ports")
+    parser.add_argument("-n", "--iterations", type=int, default=20000, help="Iterations per stage, default 20000")
+    parser.add_argument("-c", "--channels", type=int, default=2, help=      "Number of ADC channels, default 2")
+    parser.add_argument("--lines", type=str, help=                          "Text file of recorded DUT lines to replay instead of simulated ones")
+    parser.add_argument("--save", type=str, help=                           "Save the results as a JSON baseline")
+    parser.add_argument("--compare", type=str, help=                        "Compare the results with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help=      "Allowed growth of the median latency against the baseline, default 0.15")
+    parser.add_argument("--floor", type=float, default=1.0, help=          "Smallest median growth in microseconds counted as a regression, default 1.0")
+    parser.add_argument("--startup", type=int, metavar="RUNS", help=         "Also time the ADC_Test start up over RUNS fresh interpreters per stage")
+    parser.add_argument("--memory", action="store_true", help=              "Trace the memory of the test stages with tracemalloc instead of timing them")
+    parser.add_argument("--maxgrowth", type=int, metavar="BYTES", help=      "With --memory, exit with status 1 when a stage grew by more than BYTES")
+    args = parser.parse_args()
+
+    if args.lines:
+        dutLines = RecordedLines(args.lines)
+    else:
+        dutLines = SimulatedLines(1000, args.channels, 0.3)
+
+    if args.memory:
+        results = RunMemoryBenchmarks(dutLines, args.channels, args.iterations)
+        PrintMemoryResults(results)
+        if args.maxgrowth is not None and any(summary['growth_b'] > args.maxgrowth for summary in results.values()):
+            sys.exit(1)
+        return
+
+    results = RunBenchmarks(dutLines, args.channels, args.iterations)
+    if args.startup:
+        results.update(RunStartupBenchmarks(args.startup))
+    PrintResults(results)
+
+    if args.save:
+        with open(args.save, 'w') as baselineFile:
+            json.dump({'python': platform.python_version(), 'channels': args.channels,
+                       'iterations': args.iterations, 'stages': results}, baselineFile, indent=2)
+        print ("Baseline saved to " + args.save)
+
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            baseline = json.load(baselineFile)
+        if CompareResults(results, baseline, args.tolerance, args.floor):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+## @package ADC_Calibration
+#
+# Purpose: Per-board gain and offset calibration of the expected ADC counts
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  ExpectedValueEngine uses the nominal ADC gain, bit resolution and DAC reference of the design, so the gain and
+#  offset error of every board eat into the pass window. A calibration run sets a few controller amplitudes, reads
+#  the DUT at each of them and fits
+#
+#    measured = gain*expected + offset
+#
+#  for every channel over the mean, min and max readings by least squares, all channels in one numpy lstsq call.
+#  The pass window of every channel and reading is then the engine tolerance narrowed to SIGMA_WINDOW times the RMS
+#  residual of the fit, but never below MIN_TOLERANCE counts.
+#
+#  Calibrations are kept in a JSON file keyed by board, the DUT port or a serial number:
+#
+#    {"version": 1, "boards": {"<board>": {"gain": [...], "offset": [...], "tolerance": [[...]], ...}}}
+
+import functools
+import json
+import math
+import os
+import time
+
+
+CALIBRATION_FILE = 'ADC_Calibration.json'
+CALIBRATION_VERSION = 1
+#Windows are SIGMA_WINDOW residual RMS wide either side of the calibrated value, at least MIN_TOLERANCE counts
+SIGMA_WINDOW  = 4.0
+MIN_TOLERANCE = 3
+
+
+## Documentation for a function.
+#
+# Returns points evenly spaced amplitudes from ampMin to ampMax, rounded like the sweep grid
+def CalibrationAmplitudes(points, ampMin, ampMax):
+    step = (ampMax - ampMin)/max(points - 1, 1)
+    return [round(ampMin + index*step, 4) for index in range(points)]
+
+
+## Documentation for a function.
+#
+# Fits measured = gain*expected + offset per channel. expected has shape (tests, 3), the nominal mean/min/max
+# counts of every test, measured has shape (tests, channels, 3). Returns (gain, offset, residual) as arrays of
+# shape (channels,), (channels,) and (channels, 3), the last being the RMS residual of every reading.
+def FitGainOffset(expected, measured):
+
+    import numpy as np
+
+    expected = np.asarray(expected, dtype=np.float64)
+    measured = np.asarray(measured, dtype=np.float64)
+    tests, channels = measured.shape[0], measured.shape[1]
+
+    #One row per test and reading, one right hand side per channel
+    x = expected.reshape(-1)
+    y = measured.transpose(0, 2, 1).reshape(-1, channels)
+    design = np.column_stack((x, np.ones_like(x)))
+    solution, _, rank, _ = np.linalg.lstsq(design, y, rcond=None)
+    if rank < 2:
+        raise ValueError('The calibration needs readings at two or more amplitudes')
+
+    residual = (y - design.dot(solution)).reshape(tests, 3, channels)
+    rms = np.sqrt((residual**2).mean(axis=0)).T
+    return solution[0], solution[1], rms
+
+
+## Documentation for the BoardCalibration class.
+#
+#  This class holds the fitted gain, offset and pass windows of every channel of one board
+class BoardCalibration(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param gain Gain of every channel.
+    #  @param offset Offset of every channel in ADC counts.
+    #  @param tolerance Pass window of the mean, min and max of every channel, shape (channels, 3).
+    #  @param residual RMS fit residual of the mean, min and max of every channel, shape (channels, 3).
+    def __init__(self, gain, offset, tolerance, residual=None, amplitudes=None, frequency=None, tests=0, timestamp=None):
+        self.gain       = [float(value) for value in gain]
+        self.offset     = [float(value) for value in offset]
+        self.tolerance  = [[int(value) for value in row] for row in tolerance]
+        self.residual   = [[float(value) for value in row] for row in residual] if residual is not None else None
+        self.amplitudes = list(amplitudes) if amplitudes is not None else []
+        self.frequency  = frequency
+        self.tests      = tests
+        self.timestamp  = timestamp if timestamp is not None else time.time()
+
+    ## Documentation for Fit method.
+    #
+    # Fits a BoardCalibration to the readings of a calibration run, see FitGainOffset. The windows are never wider
+    # than maxTolerance, the uncalibrated window.
+    @classmethod
+    def Fit(cls, expected, measured, maxTolerance, amplitudes=None, frequency=None):
+        gain, offset, residual = FitGainOffset(expected, measured)
+        tolerance = [[min(maxTolerance, max(MIN_TOLERANCE, int(math.ceil(SIGMA_WINDOW*rms)))) for rms in row]
+                     for row in residual.tolist()]
+        return cls(gain.tolist(), offset.tolist(), tolerance, residual.tolist(), amplitudes, frequency, len(measured))
+
+    ## Documentation for Channels method.
+    #  @param self The object pointer.
+    def Channels(self):
+        return len(self.gain)
+
+    ## Documentation for Limits method.
+    #
+    # Returns the per-channel windows for the nominal ExpectedADC counts of a wave, shape (channels, 3, 2) as
+    # SamplingTest.SetLimits takes them.
+    #  @param self The object pointer.
+    def Limits(self, expected):
+        limits = []
+        for gain, offset, tolerance in zip(self.gain, self.offset, self.tolerance):
+            centres = [int(round(gain*value + offset)) for value in expected]
+            limits.append(tuple((centre - tol, centre + tol) for centre, tol in zip(centres, tolerance)))
+        return tuple(limits)
+
+    ## Documentation for ToDict method.
+    #  @param self The object pointer.
+    def ToDict(self):
+        return {'gain': self.gain, 'offset': self.offset, 'tolerance': self.tolerance, 'residual': self.residual,
+                'amplitudes': self.amplitudes, 'frequency': self.frequency, 'tests': self.tests, 'timestamp': self.timestamp}
+
+    ## Documentation for FromDict method.
+    @classmethod
+    def FromDict(cls, values):
+        return cls(values['gain'], values['offset'], values['tolerance'], values.get('residual'), values.get('amplitudes'),
+                   values.get('frequency'), values.get('tests', 0), values.get('timestamp'))
+
+
+## Documentation for the CalibrationCache class.
+#
+#  This class reads and writes the calibration file, one BoardCalibration per board
+class CalibrationCache(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param filename Calibration file, it does not need to exist yet.
+    def __init__(self, filename=CALIBRATION_FILE):
+        self.filename = filename
+        self.boards = {}
+        if os.path.exists(filename):
+            with open(filename) as calibrationFile:
+                contents = json.load(calibrationFile)
+            if contents.get('version') != CALIBRATION_VERSION:
+                raise ValueError('%s is not a version %d calibration file' % (filename, CALIBRATION_VERSION))
+            self.boards = dict((board, BoardCalibration.FromDict(values)) for board, values in contents['boards'].items())
+
+    ## Documentation for Get method.
+    #
+    # Returns the BoardCalibration of a board, or None if it has not been calibrated.
+    #  @param self The object pointer.
+    def Get(self, board):
+        return self.boards.get(board)
+
+    ## Documentation for Put method.
+    #  @param self The object pointer.
+    def Put(self, board, calibration):
+        self.boards[board] = calibration
+
+    ## Documentation for Save method.
+    #
+    # Writes the file through a temporary file, so an interrupted save keeps the previous calibrations.
+    #  @param self The object pointer.
+    def Save(self):
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w') as calibrationFile:
+            json.dump({'version': CALIBRATION_VERSION,
+                       'boards': dict((board, calibration.ToDict()) for board, calibration in self.boards.items())},
+                      calibrationFile, indent=2, sort_keys=True)
+        os.replace(temporary, self.filename)
+
+
+## Documentation for the CalibratedExpected class.
+#
+#  This class serves the calibrated pass windows of one board in place of an ExpectedValueEngine
+class CalibratedExpected(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param engine ExpectedValueEngine providing the nominal counts.
+    #  @param calibration BoardCalibration of the board under test.
+    #  @param cacheSize Maximum number of amplitudes kept in the LRU cache.
+    def __init__(self, engine, calibration, cacheSize=128):
+        self.engine      = engine
+        self.calibration = calibration
+        self.tolerance   = engine.tolerance
+        self.frequencyAware = engine.frequencyAware
+        self._cached = functools.lru_cache(maxsize=cacheSize)(self._Limits)
+
+    ## Documentation for _Limits method.
+    #  @param self The object pointer.
+    def _Limits(self, fAmp, freq):
+        return self.calibration.Limits(self.engine.Calculate(fAmp, freq))
+
+    ## Documentation for Calculate method.
+    #
+    # Returns the nominal ExpectedADC counts, uncalibrated.
+    #  @param self The object pointer.
+    def Calculate(self, fAmp, freq=None):
+        return self.engine.Calculate(fAmp, freq)
+
+    ## Documentation for Limits method.
+    #
+    # Returns the calibrated windows of every channel for a wave of amplitude fAmp and frequency freq. The same
+    # tuple is returned for the same wave, so SamplingTest.SetLimits only converts it once.
+    #  @param self The object pointer.
+    def Limits(self, fAmp, freq=None):
+        return self._cached(fAmp, freq)
+
+    ## Documentation for CacheHits method.
+    #  @param self The object pointer.
+    def CacheHits(self):
+        return self._cached.cache_info().hits
+
+    ## Documentation for CacheMisses method.
+    #  @param self The object pointer.
+    def CacheMisses(self):
+        return self._cached.cache_info().misses
@@ -0,0 +1,279 @@
+## @package ADC_Capture
+#
+# Purpose: Streaming statistics for raw ADC sample blocks captured from the DUT
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  In capture mode the DUT is sent 'RAW,<blockSize>\r' and from then on streams its raw ADC samples instead of the
+#  mean/min/max reports, one line per block and channel:
+#
+#    RAW,<channel>,<sample 1>,<sample 2>,...,<sample blockSize>
+#
+#  'RAW,0\r' switches the DUT back to its normal reports. The host never keeps the samples themselves:
+#    RunningStats  Welford mean and variance, merged block by block, plus min and max. The RMS follows from them.
+#    SpectrumRing  the last ringSize samples of a channel. SNR and THD come from a numpy FFT of the ring through
+#                  a 4-term Blackman-Harris window, whose -92 dB sidelobes keep the leakage of a tone that does not
+#                  sit on an FFT bin out of the noise floor.
+#  Both have a fixed size, so the memory use of a capture does not grow with its length. The bins within the main
+#  lobe of DC are not counted as noise, so the ring has to hold enough periods to keep the fundamental clear of
+#  them, MinimumRingSize gives the smallest ring for a stimulus frequency.
+
+import math
+
+import numpy as np
+
+
+RAW_HEADER = b'RAW'
+#Half width in bins of the main lobe of the Blackman-Harris window
+LOBE = 4
+
+
+## Documentation for a function.
+#
+# Parses one raw block line. Returns (channel, samples) with the samples as an int64 array, or None for any other
+# line.
+def ParseRawBlock(line):
+    fields = line.strip().split(b',')
+    if len(fields) < 3 or fields[0] != RAW_HEADER:
+        return None
+    try:
+        return int(fields[1]), np.array(fields[2:], dtype=np.int64)
+    except ValueError:
+        return None
+
+
+## Documentation for a function.
+#
+# Returns the smallest spectrum ring for a tone of frequency Hz, its main lobe then starts after the one of DC
+def MinimumRingSize(frequency, sampleRate):
+    return int(math.ceil((2*LOBE + 1)*sampleRate/float(frequency)))
+
+
+## Documentation for a function.
+#
+# Returns the 4-term Blackman-Harris window of size samples
+def BlackmanHarris(size):
+    phase = 2*np.pi*np.arange(size)/(size - 1)
+    return 0.35875 - 0.48829*np.cos(phase) + 0.14128*np.cos(2*phase) - 0.01168*np.cos(3*phase)
+
+
+## Documentation for the RawBlockReader class.
+#
+#  This class splits the DUT byte stream into raw blocks. Lines longer than maxLineLength are dropped, so a
+#  stream without newlines cannot grow the buffer.
+class RawBlockReader(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param maxLineLength Longest accepted line in bytes.
+    #  @param chunkSize Largest single read from the port.
+    def __init__(self, maxLineLength=65536, chunkSize=16384):
+        self.maxLineLength = maxLineLength
+        self.buffer  = bytearray()
+        self.chunk   = bytearray(chunkSize)
+        self.chunkView = memoryview(self.chunk)
+        self.blocks  = 0
+        self.skipped = 0
+
+    ## Documentation for Feed method.
+    #
+    # Adds received bytes and returns the list of complete (channel, samples) blocks. Lines that are not raw blocks
+    # are counted in skipped, e.g. the last mean/min/max reports sent before the DUT switched modes.
+    #  @param self The object pointer.
+    def Feed(self, data):
+        self.buffer += data
+        end = self.buffer.rfind(b'\n')
+        if end < 0:
+            if len(self.buffer) > self.maxLineLength:
+                self.skipped += 1
+                del self.buffer[:]
+            return []
+        lines = bytes(self.buffer[:end]).split(b'\n')
+        del self.buffer[:end+1]
+        blocks = []
+        for line in lines:
+            block = ParseRawBlock(line) if len(line) <= self.maxLineLength else None
+            if block is None:
+                self.skipped += 1
+            else:
+                blocks.append(block)
+        self.blocks += len(blocks)
+        return blocks
+
+    ## Documentation for ReadFrom method.
+    #
+    # Reads whatever the serial port has buffered, waiting at most the port timeout for the first byte.
+    #  @param self The object pointer.
+    def ReadFrom(self, ser):
+        size = min(max(ser.in_waiting, 1), len(self.chunk))
+        count = ser.readinto(self.chunkView[:size])
+        if not count:
+            return []
+        return self.Feed(self.chunkView[:count])
+
+
+## Documentation for the RunningStats class.
+#
+#  This class accumulates mean, variance, min and max of a sample stream in constant memory
+class RunningStats(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self):
+        self.count = 0
+        self.mean  = 0.0
+        self.m2    = 0.0
+        self.min   = None
+        self.max   = None
+
+    ## Documentation for Update method.
+    #
+    # Merges one block into the running values with the pairwise form of Welford's update, which stays accurate
+    # over billions of samples where a plain sum of squares would not.
+    #  @param self The object pointer.
+    def Update(self, samples):
+        blockCount = len(samples)
+        if blockCount == 0:
+            return
+        blockMean = samples.mean()
+        deviation = samples - blockMean
+        blockM2 = float(np.dot(deviation, deviation))
+        count = self.count + blockCount
+        delta = blockMean - self.mean
+        self.mean += delta*blockCount/count
+        self.m2 += blockM2 + delta*delta*self.count*blockCount/count
+        self.count = count
+        blockMin, blockMax = int(samples.min()), int(samples.max())
+        self.min = blockMin if self.min is None else min(self.min, blockMin)
+        self.max = blockMax if self.max is None else max(self.max, blockMax)
+
+    ## Documentation for Variance method.
+    #  @param self The object pointer.
+    def Variance(self):
+        return self.m2/self.count if self.count else 0.0
+
+    ## Documentation for RMS method.
+    #
+    # RMS of the samples including their DC level. The AC RMS is the standard deviation, sqrt(Variance()).
+    #  @param self The object pointer.
+    def RMS(self):
+        return math.sqrt(self.Variance() + self.mean*self.mean)
+
+
+## Documentation for the SpectrumRing class.
+#
+#  This class keeps the last samples of a channel and analyses their spectrum
+class SpectrumRing(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param size Number of samples in the ring, the FFT length.
+    #  @param sampleRate DUT sample rate in Hz.
+    #  @param harmonics Number of harmonics of the fundamental counted as distortion.
+    def __init__(self, size, sampleRate, harmonics=5):
+        self.size       = size
+        self.sampleRate = sampleRate
+        self.harmonics  = harmonics
+        self.buffer     = np.zeros(size)
+        self.window     = BlackmanHarris(size)
+        self.index      = 0
+        self.filled     = 0
+
+    ## Documentation for Extend method.
+    #  @param self The object pointer.
+    def Extend(self, samples):
+        samples = samples[-self.size:]
+        count = len(samples)
+        first = min(count, self.size - self.index)
+        self.buffer[self.index:self.index+first] = samples[:first]
+        self.buffer[:count-first] = samples[first:]
+        self.index = (self.index + count) % self.size
+        self.filled = min(self.filled + count, self.size)
+
+    ## Documentation for Analyse method.
+    #
+    # Returns a dict with the fundamental frequency, SNR and THD in dB and THD in percent, or None until the ring
+    # has been filled once. Every tone is measured over the main lobe of the window, +-4 bins. Harmonics above
+    # half the sample rate are folded back to where they alias to. A fundamental whose main lobe reaches into the
+    # one of DC cannot be measured, the ring is shorter than MinimumRingSize, and None is returned as well.
+    #  @param self The object pointer.
+    def Analyse(self):
+        if self.filled < self.size:
+            return None
+        samples = np.concatenate((self.buffer[self.index:], self.buffer[:self.index]))
+        power = np.abs(np.fft.rfft((samples - samples.mean())*self.window))**2
+        bins = len(power)
+
+        #Everything within the main lobe of DC is leakage of the offset, not noise
+        used = np.zeros(bins, dtype=bool)
+        used[:LOBE+1] = True
+        fundamental = int(np.argmax(np.where(used, 0.0, power)))
+        if fundamental <= 2*LOBE:
+            return None
+
+        def Tone(centre):
+            low, high = max(centre - LOBE, 0), min(centre + LOBE + 1, bins)
+            toneBins = ~used[low:high]
+            tone = float(power[low:high][toneBins].sum())
+            used[low:high] = True
+            return tone
+
+        signal = Tone(fundamental)
+        distortion = 0.0
+        for harmonic in range(2, self.harmonics+2):
+            centre = (harmonic*fundamental) % self.size
+            if centre >= bins:
+                centre = self.size - centre
+            distortion += Tone(centre)
+        noise = float(power[~used].sum())
+
+        return {'fundamental_hz': fundamental*self.sampleRate/float(self.size),
+                'snr_db': 10*math.log10(signal/noise) if signal > 0 and noise > 0 else float('inf'),
+                'thd_db': 10*math.log10(distortion/signal) if signal > 0 and distortion > 0 else float('-inf'),
+                'thd_pct': 100.0*math.sqrt(distortion/signal) if signal > 0 else 0.0}
+
+
+## Documentation for the CaptureAnalyser class.
+#
+#  This class keeps the running statistics and spectrum ring of every DUT channel
+class CaptureAnalyser(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param channels Number of ADC channels, numbered from 1 like the DUT reports them.
+    #  @param sampleRate DUT sample rate in Hz.
+    #  @param ringSize Samples per channel kept for the spectrum.
+    def __init__(self, channels, sampleRate, ringSize=4096):
+        self.channels = channels
+        self.stats = [RunningStats() for channel in range(channels)]
+        self.rings = [SpectrumRing(ringSize, sampleRate) for channel in range(channels)]
+        self.blocks = [0]*channels
+        self.unknownChannel = 0
+
+    ## Documentation for Feed method.
+    #  @param self The object pointer.
+    #  @param channel Channel as reported by the DUT, from 1.
+    def Feed(self, channel, samples):
+        if not 1 <= channel <= self.channels:
+            self.unknownChannel += 1
+            return
+        self.stats[channel-1].Update(samples)
+        self.rings[channel-1].Extend(samples)
+        self.blocks[channel-1] += 1
+
+    ## Documentation for Report method.
+    #
+    # Returns the statistics of one channel so far, the spectral values are None until its ring is full.
+    #  @param self The object pointer.
+    def Report(self, channel):
+        stats = self.stats[channel-1]
+        report = {'channel': channel, 'blocks': self.blocks[channel-1], 'samples': stats.count,
+                  'mean': stats.mean, 'min': stats.min, 'max': stats.max,
+                  'std': math.sqrt(stats.Variance()), 'rms': stats.RMS(),
+                  'fundamental_hz': None, 'snr_db': None, 'thd_db': None, 'thd_pct': None}
+        spectrum = self.rings[channel-1].Analyse()
+        if spectrum is not None:
+            report.update(spectrum)
+        return report
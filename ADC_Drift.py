@@ -0,0 +1,193 @@
+## @package ADC_Drift
+#
+# Purpose: Rolling window statistics and CUSUM drift detection of the DUT readings of every channel
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The pass rate LoopAndLog reports counts every test since the start, so a board that starts to degrade after
+#  hours of good results barely moves it. The DriftMonitor keeps the last window tests of every channel in a fixed
+#  size ring buffer, the readings and pass bits of all channels in one numpy array. Running sums and sums of squares
+#  are updated as a test enters and the oldest leaves, so the rolling mean, standard deviation and pass rate cost
+#  the same whatever the window size.
+#
+#  Once the window has filled the first time its mean and standard deviation are taken as the reference of the
+#  board. Every later reading is standardised against them and fed to a two sided CUSUM per channel and metric:
+#
+#    high = max(0, high + z - slack)      low = max(0, low - z - slack)
+#
+#  and the fail bits to a one sided CUSUM above the reference fail rate plus half of rateShift. A sum above the
+#  threshold raises an alarm, which stays raised until its sum has gone back to zero, so a shift is reported once.
+#  With the default slack 0.5 and threshold 8 a shift of one standard deviation is found after about 16 tests,
+#  while a steady board raises a false alarm about once every 9000 tests per metric with a window of 500 tests. A
+#  shorter window gives a less accurate reference and more false alarms, about one every 1600 tests at 100.
+
+import numpy as np
+
+
+#Metrics of the readings, in the order of TestResult.readings, and the pass rate
+DRIFT_METRICS = ('mean', 'min', 'max', 'pass rate')
+#Reference standard deviation of the readings is at least this many counts, a quiet DUT often reports constant values
+MIN_SIGMA = 1.0
+
+
+## Documentation for the RollingWindow class.
+#
+#  This class is a ring buffer of the last size tests of every channel, with their running sums
+class RollingWindow(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param size Number of tests kept per channel.
+    #  @param channels Number of ADC channels.
+    def __init__(self, size, channels):
+        self.size     = size
+        self.channels = channels
+        self.readings = np.zeros((size, channels, 3), dtype=np.int64)
+        self.valid    = np.zeros((size, channels), dtype=bool)
+        self.passed   = np.zeros((size, channels), dtype=bool)
+        self.sums     = np.zeros((channels, 3), dtype=np.int64)
+        self.squares  = np.zeros((channels, 3), dtype=np.int64)
+        self.counts   = np.zeros(channels, dtype=np.int64)
+        self.passes   = np.zeros(channels, dtype=np.int64)
+        self.filled   = 0
+        self.index    = 0
+
+    ## Documentation for Update method.
+    #
+    # Adds one test, dropping the oldest once the window is full. Readings of a channel without a frame are not
+    # counted in its mean and standard deviation, only as a fail.
+    #  @param self The object pointer.
+    #  @param readings Readings of the test, shape (channels, 3).
+    #  @param present Whether every channel reported a frame.
+    #  @param passed Pass result of every channel.
+    def Update(self, readings, present, passed):
+        row = self.index
+        if self.filled == self.size:
+            old = self.readings[row]
+            self.sums    -= old
+            self.squares -= old*old
+            self.counts  -= self.valid[row]
+            self.passes  -= self.passed[row]
+        else:
+            self.filled += 1
+
+        new = self.readings[row]
+        np.multiply(readings, present[:, np.newaxis], out=new)
+        self.valid[row]  = present
+        self.passed[row] = passed
+        self.sums    += new
+        self.squares += new*new
+        self.counts  += present
+        self.passes  += passed
+        self.index = (row + 1) % self.size
+
+    ## Documentation for Mean method.
+    #
+    # Rolling mean of the mean, min and max readings, shape (channels, 3).
+    #  @param self The object pointer.
+    def Mean(self):
+        return self.sums / np.maximum(self.counts, 1)[:, np.newaxis]
+
+    ## Documentation for Std method.
+    #
+    # Rolling sample standard deviation of the mean, min and max readings, shape (channels, 3).
+    #  @param self The object pointer.
+    def Std(self):
+        counts = self.counts[:, np.newaxis]
+        variance = (self.squares - self.sums*self.sums / np.maximum(counts, 1)) / np.maximum(counts - 1, 1)
+        return np.sqrt(np.maximum(variance, 0.0))
+
+    ## Documentation for PassRate method.
+    #
+    # Rolling pass rate of every channel in percent.
+    #  @param self The object pointer.
+    def PassRate(self):
+        return 100.0 * self.passes / max(self.filled, 1)
+
+
+## Documentation for the DriftMonitor class.
+#
+#  This class keeps the rolling window of every channel and runs the CUSUM drift detector on it
+class DriftMonitor(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param channels Number of ADC channels.
+    #  @param window Number of tests in the rolling window, also the number of tests the reference is taken over.
+    #  @param threshold CUSUM decision threshold in standard deviations.
+    #  @param slack Shift in standard deviations the CUSUM lets pass, half the shift it is tuned to find.
+    #  @param rateShift Rise of the fail rate in percent the pass rate CUSUM is tuned to find.
+    def __init__(self, channels, window=500, threshold=8.0, slack=0.5, rateShift=10.0):
+        self.window    = RollingWindow(window, channels)
+        self.channels  = channels
+        self.threshold = threshold
+        self.slack     = slack
+        self.rateSlack = None
+        self.reference = None
+        self.sigma     = None
+        self.tests     = 0
+        self.rateShift = rateShift / 100.0
+        #CUSUM sums and alarm states, one column per reading metric and a last column for the fail rate
+        self.high    = np.zeros((channels, 4))
+        self.low     = np.zeros((channels, 3))
+        self.alarmed = np.zeros((channels, 4), dtype=bool)
+
+    ## Documentation for Update method.
+    #
+    # Adds one test and returns the alarms it raised as a list of (channel, metric, direction) with channel
+    # counted from 0, metric one of DRIFT_METRICS and direction 'high' or 'low'. A fail rate alarm is always 'high'.
+    #  @param self The object pointer.
+    def Update(self, readings, present, passed):
+        passed = np.asarray(passed, dtype=bool)
+        self.window.Update(readings, present, passed)
+        self.tests += 1
+        if self.reference is None:
+            if self.window.filled == self.window.size:
+                self._SetReference()
+            return []
+
+        z = (readings - self.reference) / self.sigma
+        mask = present[:, np.newaxis]
+        high = self.high[:, :3]
+        np.copyto(high, np.maximum(0.0, high + z - self.slack), where=mask)
+        np.copyto(self.low, np.maximum(0.0, self.low - z - self.slack), where=mask)
+        self.high[:, 3] = np.maximum(0.0, self.high[:, 3] + ~passed - self.rateSlack)
+
+        #An alarm stays raised until its sum is back at zero
+        over = self.high > self.threshold
+        over[:, :3] |= self.low > self.threshold
+        active = self.high > 0
+        active[:, :3] |= self.low > 0
+        raised = over & ~self.alarmed
+        self.alarmed = over | (self.alarmed & active)
+        if not raised.any():
+            return []
+        return [(int(channel), DRIFT_METRICS[metric], 'low' if metric < 3 and self.low[channel, metric] > self.threshold else 'high')
+                for channel, metric in zip(*np.nonzero(raised))]
+
+    ## Documentation for _SetReference method.
+    #
+    # Takes the current window as the reference of the board.
+    #  @param self The object pointer.
+    def _SetReference(self):
+        self.reference = self.window.Mean()
+        self.sigma = np.maximum(self.window.Std(), MIN_SIGMA)
+        failRate = 1.0 - self.window.PassRate() / 100.0
+        self.rateSlack = np.minimum(failRate + self.rateShift/2, 1.0)
+
+    ## Documentation for Ready method.
+    #
+    # Whether the reference has been taken and drift is being detected.
+    #  @param self The object pointer.
+    def Ready(self):
+        return self.reference is not None
+
+    ## Documentation for Summary method.
+    #
+    # Returns (mean, std, passRate) of the rolling window of one channel, mean and std as (mean, min, max) tuples.
+    #  @param self The object pointer.
+    def Summary(self, channel):
+        return (tuple(self.window.Mean()[channel].tolist()), tuple(self.window.Std()[channel].tolist()),
+                float(self.window.PassRate()[channel]))
@@ -0,0 +1,157 @@
+## @package ADC_EarlyStop
+#
+# Purpose: Sequential stopping rules deciding a channel's pass rate before the maximum number of tests
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  A channel is accepted once its pass rate is shown to be above the acceptance threshold and rejected once it is
+#  shown to be below it. Two rules are available:
+#
+#    sprt    Wald's sequential probability ratio test of pass rate threshold+margin against threshold-margin.
+#            The error rates hold however often the result is looked at, so this is the default.
+#    wilson  Stops as soon as the Wilson score interval of the pass rate lies entirely above or below the threshold.
+#            Simple to read, but checking after every test makes it stop early on chance runs more often than
+#            the confidence suggests, hence the minimum number of tests.
+#
+#  Both report the Wilson interval of the pass rate at the point they stopped.
+
+import math
+import statistics
+
+
+ACCEPTED = 'Accepted'
+REJECTED = 'Rejected'
+
+
+## Documentation for a function.
+#
+# Returns the two sided Wilson score interval (low, high) of a pass rate, as fractions
+def WilsonInterval(passed, tests, confidence=0.95):
+    if tests == 0:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence/2)
+    rate = float(passed)/tests
+    denominator = 1 + z*z/tests
+    centre = (rate + z*z/(2*tests))/denominator
+    spread = z*math.sqrt(rate*(1 - rate)/tests + z*z/(4*tests*tests))/denominator
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+## Documentation for the SequentialStop class.
+#
+#  Base class of the stopping rules, it counts the results of one channel
+class SequentialStop(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param threshold Acceptance threshold of the pass rate, as a fraction.
+    #  @param confidence Confidence of the decision and of the reported interval.
+    #  @param minTests No decision is taken before this many tests.
+    def __init__(self, threshold, confidence=0.95, minTests=1):
+        if not 0 < threshold < 1:
+            raise ValueError('The pass rate threshold must be between 0 and 1, not %r' % threshold)
+        if not 0 < confidence < 1:
+            raise ValueError('The confidence must be between 0 and 1, not %r' % confidence)
+        self.threshold  = threshold
+        self.confidence = confidence
+        self.minTests   = minTests
+        self.tests      = 0
+        self.passed     = 0
+        self.decision   = None
+
+    ## Documentation for Update method.
+    #
+    # Adds the result of one test and returns ACCEPTED, REJECTED or None while undecided. Results after the
+    # decision are ignored.
+    #  @param self The object pointer.
+    def Update(self, passed):
+        if self.decision is not None:
+            return self.decision
+        self.tests += 1
+        if passed:
+            self.passed += 1
+        if self.tests >= self.minTests:
+            self.decision = self._Decide(passed)
+        return self.decision
+
+    ## Documentation for Interval method.
+    #
+    # Wilson interval of the pass rate so far, as percentages.
+    #  @param self The object pointer.
+    def Interval(self):
+        low, high = WilsonInterval(self.passed, self.tests, self.confidence)
+        return 100.0*low, 100.0*high
+
+    ## Documentation for PassRate method.
+    #  @param self The object pointer.
+    def PassRate(self):
+        return 100.0*self.passed/self.tests if self.tests else 0.0
+
+
+## Documentation for the WilsonStop class.
+#
+#  This class stops when the Wilson interval clears the threshold
+class WilsonStop(SequentialStop):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self, threshold, confidence=0.95, minTests=10):
+        SequentialStop.__init__(self, threshold, confidence, minTests)
+
+    ## Documentation for _Decide method.
+    #  @param self The object pointer.
+    def _Decide(self, passed):
+        low, high = WilsonInterval(self.passed, self.tests, self.confidence)
+        if low > self.threshold:
+            return ACCEPTED
+        if high < self.threshold:
+            return REJECTED
+        return None
+
+
+## Documentation for the SPRTStop class.
+#
+#  This class runs Wald's SPRT on the pass rate, with equal error rates of 1-confidence
+class SPRTStop(SequentialStop):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param margin Half width of the indifference region around the threshold, as a fraction.
+    def __init__(self, threshold, confidence=0.95, margin=0.025, minTests=1):
+        SequentialStop.__init__(self, threshold, confidence, minTests)
+        if margin <= 0:
+            raise ValueError('The margin must be above 0, not %r' % margin)
+        rateGood = min(threshold + margin, 1 - 1e-6)
+        rateBad  = max(threshold - margin, 1e-6)
+        error = 1 - confidence
+        #Log likelihood ratio steps of one pass and one fail, and the decision bounds
+        self.passStep = math.log(rateGood/rateBad)
+        self.failStep = math.log((1 - rateGood)/(1 - rateBad))
+        self.upper = math.log((1 - error)/error)
+        self.lower = math.log(error/(1 - error))
+        self.ratio = 0.0
+
+    ## Documentation for _Decide method.
+    #  @param self The object pointer.
+    def _Decide(self, passed):
+        self.ratio = self.passed*self.passStep + (self.tests - self.passed)*self.failStep
+        if self.ratio >= self.upper:
+            return ACCEPTED
+        if self.ratio <= self.lower:
+            return REJECTED
+        return None
+
+
+## Documentation for a function.
+#
+# Returns a new stopping rule for one channel
+#  @param method 'sprt' or 'wilson'.
+#  @param threshold Acceptance threshold of the pass rate in percent.
+def CreateStopRule(method, threshold, confidence=0.95, margin=2.5):
+    if method == 'wilson':
+        return WilsonStop(threshold/100.0, confidence)
+    if method == 'sprt':
+        return SPRTStop(threshold/100.0, confidence, margin/100.0)
+    raise ValueError('Unknown stopping rule %r' % method)
@@ -0,0 +1,119 @@
+## @package ADC_Expected
+#
+# Purpose: Calculates the ADC counts the DUT is expected to report for a given controller sine wave
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The controller generates its sine wave from a fixed table of DAC samples. The expected mean, minimum and maximum
+#  ADC counts only depend on the wave amplitude and the DAC/ADC configuration, which do not change within a run.
+#  The ExpectedValueEngine computes them once per configuration and keeps the results in an LRU cache, so that
+#  repeated calls from SamplingTest.RunTest cost a dictionary lookup instead of rebuilding the DAC table.
+#  ADC_FrequencyModel adds the anti-alias filter and sampling of the DUT, which make the counts depend on frequency.
+
+import collections
+import functools
+import math
+
+
+#DUT ADC Configuration
+ADC_GAIN        = 0.17    #Gain value of the ADC = 1/6
+ADC_BIT_RES     = 0.59    #Bit resolution of the DUT ADC in mV = 0.59
+#Controller DAC Configuration
+DAC_VREF        = 3300    #Voltage reference used in the controller DAC in mV
+DAC_OFFSET_DC   = 0.43    #DC offset value in terms of Controller DAC output
+DAC_MAX_SAMPLES = 100     #Number of samples used by DAC
+#Pass/fail window either side of the expected ADC count
+ADC_TOLERANCE   = 20
+
+#Expected ADC counts for one wave configuration
+ExpectedADC = collections.namedtuple('ExpectedADC', ['mean', 'peakMin', 'peakMax'])
+
+
+## Documentation for a function.
+#
+# Computes the expected ADC counts for one full DAC/ADC configuration. Kept free of any state so that its
+# result can be cached on the complete argument tuple.
+def CalculateExpectedADC(fAmp, fOffsetDC, fVrefDAC, fGain, BitRes, iMaxSamples):
+
+    #Calculate the expected Mean ADC Value
+    fDACValSum = 0
+    for iSampleDAC in range(1, iMaxSamples):
+        fDacVal = fAmp*math.sin(iSampleDAC*((2*math.pi)/iMaxSamples)) + fOffsetDC
+        fDACValSum += fDacVal
+
+    fDACValMean = fDACValSum/iMaxSamples                #Quotient of the sum of DAC samples in DAC units and the number of samples
+    fVoltMean = fDACValMean*fVrefDAC                    #Convert DAC values to voltage in mV
+    iADCmean  = int(fVoltMean*fGain/BitRes)             #Convert the mean value in voltage to DUT comparable ADC value
+
+    #Calculate the expected Min ADC Value, the lowest DAC sample sits at three quarters of the table
+    fDacVal = fAmp*math.sin((iMaxSamples*3//4)*((2*math.pi)/iMaxSamples)) + fOffsetDC
+    fVoltPkMin = fDacVal*fVrefDAC
+    iADCpeakMin = int(fVoltPkMin*fGain/BitRes)
+
+    #Calculate the expected Max ADC Value, the highest DAC sample sits at a quarter of the table
+    fDacVal = fAmp*math.sin((iMaxSamples//4)*((2*math.pi)/iMaxSamples)) + fOffsetDC
+    fVoltPkMax = fDacVal*fVrefDAC
+    iADCpeakMax = int(fVoltPkMax*fGain/BitRes)
+
+    return ExpectedADC(iADCmean, iADCpeakMin, iADCpeakMax)
+
+
+## Documentation for the ExpectedValueEngine class.
+#
+#  This class holds the DAC/ADC configuration of a test setup and serves cached expected ADC counts for it
+class ExpectedValueEngine(object):
+
+    #The DAC table model is the same at every frequency
+    frequencyAware = False
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param cacheSize Maximum number of configurations kept in the LRU cache.
+    def __init__(self, fOffsetDC=DAC_OFFSET_DC, fVrefDAC=DAC_VREF, fGain=ADC_GAIN, BitRes=ADC_BIT_RES,
+                 iMaxSamples=DAC_MAX_SAMPLES, tolerance=ADC_TOLERANCE, cacheSize=128):
+        self.fOffsetDC   = fOffsetDC
+        self.fVrefDAC    = fVrefDAC
+        self.fGain       = fGain
+        self.BitRes      = BitRes
+        self.iMaxSamples = iMaxSamples
+        self.tolerance   = tolerance
+        self._cached = functools.lru_cache(maxsize=cacheSize)(CalculateExpectedADC)
+
+    ## Documentation for Calculate method.
+    #
+    # Returns the ExpectedADC counts for a wave of amplitude fAmp. The cache is keyed on the amplitude together
+    # with the full DAC/ADC configuration, so changing any of them on the engine gives a fresh result.
+    #  @param self The object pointer.
+    #  @param fAmp Peak amplitude of the sine wave in terms of controller DAC output.
+    #  @param freq Frequency of the wave in Hz, not used by the DAC table model.
+    def Calculate(self, fAmp, freq=None):
+        return self._cached(fAmp, self.fOffsetDC, self.fVrefDAC, self.fGain, self.BitRes, self.iMaxSamples)
+
+    ## Documentation for Limits method.
+    #
+    # Returns the (Min, Max) pass window for the mean, minimum and maximum ADC counts of a wave of amplitude fAmp
+    # and frequency freq.
+    #  @param self The object pointer.
+    def Limits(self, fAmp, freq=None):
+        expected = self.Calculate(fAmp, freq)
+        tol = self.tolerance
+        return ((expected.mean - tol, expected.mean + tol),
+                (expected.peakMin - tol, expected.peakMin + tol),
+                (expected.peakMax - tol, expected.peakMax + tol))
+
+    ## Documentation for CacheHits method.
+    #  @param self The object pointer.
+    def CacheHits(self):
+        return self._cached.cache_info().hits
+
+    ## Documentation for CacheMisses method.
+    #  @param self The object pointer.
+    def CacheMisses(self):
+        return self._cached.cache_info().misses
+
+    ## Documentation for ClearCache method.
+    #  @param self The object pointer.
+    def ClearCache(self):
+        self._cached.cache_clear()
@@ -0,0 +1,259 @@
+## @package ADC_Farm
+#
+# Purpose: Shards test jobs across a farm of controller/DUT stations, one worker process per controller
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  ADC_Test keeps its controller and DUT in module globals, so one process can only drive one station. The
+#  FarmCoordinator starts one worker process per station. Every worker keeps its station open in a SessionDaemon
+#  session, whose globals are private to the process. A job is one (amplitude, frequency, tests) run.
+#
+#  Jobs wait on one shared queue, sorted by setpoint, and every worker takes the next job as soon as it is free.
+#  Faster stations take more jobs, and the session only reconfigures its controller when the setpoint changes.
+#  Results come back to the coordinator on a result queue. A station that fails a job retires. Its job goes back on
+#  the queue for the remaining stations, and is recorded as failed once maxAttempts stations have tried it. Every
+#  station logs to SamplingEngine_Results_<station>.log.
+#
+#    python ADC_Farm.py --station /dev/ttyUSB0,115200,/dev/ttyUSB1,9600 --station /dev/ttyUSB2,115200,/dev/ttyUSB3,9600
+#                       --job 0.3,50,100 --job 0.2,10,100
+#    python ADC_Farm.py --simulate 4 --sweep -m 50
+#  --simulate runs the farm against simulated stations on pseudo-terminals. The run exits with status 1 when any
+#  test or job failed.
+
+import argparse
+import collections
+import multiprocessing
+import queue
+import re
+import sys
+import time
+
+
+#One test run, attempt counts the stations that have tried it
+FarmJob = collections.namedtuple('FarmJob', ['jobId', 'fAmp', 'freq', 'tests', 'attempt'])
+#Ports of one station, a controller and the DUT it stimulates
+FarmStation = collections.namedtuple('FarmStation', ['name', 'dutPort', 'dutBaud', 'uCPort', 'uCBaud'])
+#Outcome of one job, reply is the SessionDaemon.Run reply dict or None with error set
+FarmResult = collections.namedtuple('FarmResult', ['job', 'station', 'reply', 'error'])
+
+
+## Documentation for a function.
+#
+# Parses a station given as 'dutPort,dutBaud,uCPort,uCBaud'
+def ParseStation(text):
+    fields = text.split(',')
+    if len(fields) != 4:
+        raise ValueError('Station %r is not dutPort,dutBaud,uCPort,uCBaud' % text)
+    return FarmStation(re.sub(r'[^A-Za-z0-9]+', '_', fields[0]).strip('_'), fields[0], int(fields[1]), fields[2], int(fields[3]))
+
+
+## Documentation for a function.
+#
+# Parses a job given as 'amplitude,frequency,tests'
+def ParseJob(text, jobId):
+    fields = text.split(',')
+    if len(fields) != 3:
+        raise ValueError('Job %r is not amplitude,frequency,tests' % text)
+    return FarmJob(jobId, float(fields[0]), int(fields[1]), int(fields[2]), 0)
+
+
+## Documentation for a function.
+#
+# Worker process of one station. Serves jobs from jobQueue until it takes a None, and puts a message on
+# resultQueue for every job: ('result', station, job, reply) or ('failed', station, job, error). Ends with
+# ('done', station, None, None), also when the station fails.
+def RunStation(station, jobQueue, resultQueue, channels, timeout, flushInterval):
+
+    from ADC_ResultsLog import ResultsSink
+    from ADC_SessionDaemon import SessionDaemon
+
+    sink = ResultsSink('SamplingEngine_Results_%s.log' % station.name, flushInterval).Start()
+    session = SessionDaemon(station.dutPort, station.dutBaud, station.uCPort, station.uCBaud, channels, timeout)
+    try:
+        while True:
+            job = jobQueue.get()
+            if job is None:
+                break
+            reply = session.Handle({'command': 'run', 'amplitude': job.fAmp, 'frequency': job.freq, 'tests': job.tests})
+            if 'error' in reply:
+                resultQueue.put(('failed', station.name, job, reply['error']))
+                break
+            resultQueue.put(('result', station.name, job, reply))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            session.Close()
+        finally:
+            sink.Stop()
+            resultQueue.put(('done', station.name, None, None))
+
+
+## Documentation for the FarmCoordinator class.
+#
+#  This class starts the station workers, hands out the jobs and collects the results
+class FarmCoordinator(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param stations List of FarmStation, one worker process is started per station.
+    #  @param channels Number of ADC channels reported by every DUT.
+    #  @param timeout Seconds to wait for each DUT frame.
+    #  @param maxAttempts Number of stations a job is tried on before it is recorded as failed.
+    def __init__(self, stations, channels=2, timeout=10, maxAttempts=2, flushInterval=1.0):
+        self.stations    = list(stations)
+        self.channels    = channels
+        self.timeout     = timeout
+        self.maxAttempts = maxAttempts
+        self.flushInterval = flushInterval
+        self.results     = []
+        self.failed      = []
+        self.elapsed     = 0.0
+        #Threads of the simulated stations in the parent must not be forked
+        self._context    = multiprocessing.get_context('spawn')
+
+    ## Documentation for Run method.
+    #
+    # Runs every job on the farm and returns the list of FarmResult in job order, failed jobs included.
+    #  @param self The object pointer.
+    def Run(self, jobs):
+        jobQueue = self._context.Queue()
+        resultQueue = self._context.Queue()
+        #Jobs of one setpoint follow each other, so a free station often finds its controller already configured
+        for job in sorted(jobs, key=lambda job: (job.fAmp, job.freq, job.jobId)):
+            jobQueue.put(job)
+
+        workers = dict((station.name, self._context.Process(target=RunStation, name='Station ' + station.name,
+                                                            args=(station, jobQueue, resultQueue, self.channels,
+                                                                  self.timeout, self.flushInterval)))
+                       for station in self.stations)
+        startTime = time.monotonic()
+        for worker in workers.values():
+            worker.start()
+
+        outstanding = len(jobs)
+        running = set(workers)
+        try:
+            while running:
+                if outstanding == 0:
+                    for name in running:
+                        jobQueue.put(None)
+                    outstanding = -1
+                try:
+                    kind, name, job, payload = resultQueue.get(timeout=1.0)
+                except queue.Empty:
+                    #A worker that died without a word, e.g. killed, takes no more jobs
+                    for name in [name for name in running if not workers[name].is_alive()]:
+                        running.discard(name)
+                    continue
+                if kind == 'result':
+                    self.results.append(FarmResult(job, name, payload, None))
+                    outstanding -= 1
+                elif kind == 'failed':
+                    print ("Station %s failed on job %d: %s" % (name, job.jobId, payload))
+                    if job.attempt + 1 < self.maxAttempts and len(running) > 1:
+                        jobQueue.put(job._replace(attempt=job.attempt + 1))
+                    else:
+                        self.failed.append(FarmResult(job, name, None, payload))
+                        outstanding -= 1
+                elif kind == 'done':
+                    running.discard(name)
+        finally:
+            self.elapsed = time.monotonic() - startTime
+            for worker in workers.values():
+                worker.join(5)
+                if worker.is_alive():
+                    worker.terminate()
+
+        #Jobs left on the queue when every station had failed
+        finished = set(result.job.jobId for result in self.results + self.failed)
+        for job in jobs:
+            if job.jobId not in finished:
+                self.failed.append(FarmResult(job, None, None, 'No station left'))
+        return sorted(self.results + self.failed, key=lambda result: result.job.jobId)
+
+    ## Documentation for TestsPerSecond method.
+    #
+    # Returns the number of completed tests per second across the whole farm, worker start up included.
+    #  @param self The object pointer.
+    def TestsPerSecond(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return sum(result.reply['tests'] for result in self.results) / self.elapsed
+
+
+## Documentation for a function.
+#
+# Parses the arguments, runs the jobs on the farm and prints the result of every job
+def main():
+
+    parser = argparse.ArgumentParser(description="Shards test jobs across several controller/DUT stations, one worker process per\n"
+                                                 "controller. Each station is logged to SamplingEngine_Results_<station>.log")
+    parser.add_argument("--station", action="append", default=[], help="Station as dutPort,dutBaud,uCPort,uCBaud, repeat for every controller")
+    parser.add_argument("--simulate", type=int, default=0, help=          "Add SIMULATE simulated stations on pseudo-terminals")
+    parser.add_argument("--rate", type=float, default=500, help=          "DUT reports per second of the simulated stations, default 500")
+    parser.add_argument("--job", action="append", default=[], help=       "Job as amplitude,frequency,tests, repeat for every job")
+    parser.add_argument("-s", "--sweep", action="store_true", help=       "Add one job per point of an amplitude x frequency grid")
+    parser.add_argument("--ampsteps", type=int, default=10, help=         "Number of amplitude points in a sweep, default 10")
+    parser.add_argument("--freqsteps", type=int, default=10, help=        "Number of frequency points in a sweep, default 10")
+    parser.add_argument("-m", "--maxtest", type=int, default=20, help=    "Tests per sweep job, default 20")
+    parser.add_argument("-c", "--channels", type=int, default=2, help=    "Number of ADC channels reported by each DUT, default 2")
+    parser.add_argument("-t", "--timeout", type=float, default=10, help=  "Seconds to wait for each DUT frame, default 10")
+    parser.add_argument("--attempts", type=int, default=2, help=          "Stations a job is tried on before it fails, default 2")
+    args = parser.parse_args()
+
+    try:
+        stations = [ParseStation(text) for text in args.station]
+        jobs = [ParseJob(text, jobId) for jobId, text in enumerate(args.job, 1)]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.sweep:
+        from ADC_Test import Amplitudes, Frequencies
+        from ADC_Sweep import SweepPlanner
+        amplitudes, frequencies = SweepPlanner().Grid(Amplitudes.Min.value, Amplitudes.Max.value, args.ampsteps,
+                                                      Frequencies.Min.value, Frequencies.Max.value, args.freqsteps)
+        points = [(fAmp, freq) for fAmp in amplitudes.tolist() for freq in frequencies.tolist()]
+        jobs += [FarmJob(len(jobs) + index, fAmp, freq, args.maxtest, 0) for index, (fAmp, freq) in enumerate(points, 1)]
+    if not jobs:
+        parser.error("No jobs, give --job or --sweep")
+
+    simulators = []
+    if args.simulate:
+        from ADC_Simulator import DUTSimulator
+        for index in range(args.simulate):
+            simulator = DUTSimulator(args.rate, channels=args.channels)
+            dutPort, controllerPort = simulator.Start()
+            simulators.append(simulator)
+            stations.append(FarmStation('sim%d' % (index+1), dutPort, 115200, controllerPort, 9600))
+    if not stations:
+        parser.error("No stations, give --station or --simulate")
+
+    print ("%d jobs on %d stations" % (len(jobs), len(stations)))
+    coordinator = FarmCoordinator(stations, args.channels, args.timeout, args.attempts)
+    try:
+        results = coordinator.Run(jobs)
+    finally:
+        for simulator in simulators:
+            simulator.Stop()
+
+    allPassed = True
+    for result in results:
+        job = result.job
+        if result.reply is None:
+            allPassed = False
+            print ("Job %d amplitude %s frequency %d: failed (%s)" % (job.jobId, job.fAmp, job.freq, result.error))
+            continue
+        if any(passed < job.tests for passed in result.reply['passed']):
+            allPassed = False
+        print ("Job %d amplitude %s frequency %d on %s: " % (job.jobId, job.fAmp, job.freq, result.station) +
+               ", ".join("Channel %d %.1f%%" % (channel+1, rate) for channel, rate in enumerate(result.reply['pass_rate'])))
+    configured = sum(1 for result in results if result.reply is not None and result.reply['configured'])
+    print ("%d jobs, %d failed, %d controller reconfigurations, %.1f s" % (len(results), len(coordinator.failed), configured, coordinator.elapsed))
+    print ("Throughput: %.1f tests/sec across %d stations" % (coordinator.TestsPerSecond(), len(stations)))
+    if not allPassed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
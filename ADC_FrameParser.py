@@ -0,0 +1,287 @@
+## @package ADC_FrameParser
+#
+# Purpose: Incremental parser for the 'header,channel,mean,min,max' lines reported by the DUT
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The FrameParser is fed raw bytes as they come off the DUT port. They are appended to one reusable bytearray and
+#  all complete lines are validated in one pass with a compiled pattern, then converted with a single split over the
+#  block, so there is no per-line split, decode or rstrip. Every complete line yields a typed DUTFrame record. Lines
+#  that do not match are counted in malformed instead of raising, and a line longer than maxLineLength is dropped so
+#  the buffer stays bounded on a noisy port.
+#
+#  The DUT reports its channels in order, one line each. A ReportAssembler places the frames of one report by their
+#  channel number and finds where the report ends, so a lost or corrupted line costs one report instead of shifting
+#  every later frame onto the wrong channel.
+#
+#  Run this module directly for a lines/sec microbenchmark against the split based parsing it replaces.
+
+import collections
+import itertools
+import os
+import re
+import threading
+import time
+
+
+#One DUT report line
+DUTFrame = collections.namedtuple('DUTFrame', ['header', 'channel', 'mean', 'min', 'max'])
+
+_FRAME_PATTERN = re.compile(rb'[ \t]*([^,\r\n]*),[ \t]*(-?\d+),[ \t]*(-?\d+),[ \t]*(-?\d+),[ \t]*(-?\d+)[ \t\r]*\n')
+#A run of strictly formatted lines, checked in one pass before taking the fast path
+_BLOCK_PATTERN = re.compile(rb'(?:[\x20-\x2b\x2d-\x7e]*,-?\d+,-?\d+,-?\d+,-?\d+\r?\n)*')
+
+
+## Documentation for a function.
+#
+# Parses one complete DUT line (str or bytes) and returns a DUTFrame, or None if the line is malformed.
+def ParseLine(line):
+    if isinstance(line, str):
+        line = line.encode('ascii', 'replace')
+    if not line.endswith(b'\n'):
+        line += b'\n'
+    match = _FRAME_PATTERN.fullmatch(line)
+    if match is None:
+        return None
+    return DUTFrame(match.group(1).decode('ascii', 'replace'), int(match.group(2)), int(match.group(3)),
+                    int(match.group(4)), int(match.group(5)))
+
+
+## Documentation for the FrameParser class.
+#
+#  This class turns a stream of DUT bytes into DUTFrame records
+class FrameParser(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param maxLineLength Longest line kept in the buffer, longer lines are dropped and counted as malformed.
+    #  @param chunkSize Size of the reusable receive buffer used by ReadFrom.
+    def __init__(self, maxLineLength=256, chunkSize=4096):
+        self.maxLineLength = maxLineLength
+        self.buffer      = bytearray()
+        self.chunk       = bytearray(chunkSize)
+        self.chunkView   = memoryview(self.chunk)
+        self.frames      = 0
+        self.malformed   = 0
+        self._discarding = False
+
+    ## Documentation for Feed method.
+    #
+    # Appends data to the buffer and returns the list of DUTFrame records completed by it.
+    # When every complete line in the buffer is well formed, which is the normal case, the lines are converted with
+    # one split over the whole block. Otherwise each line is matched in place and the bad ones are counted.
+    #  @param self The object pointer.
+    #  @param data bytes, bytearray or memoryview received from the DUT.
+    def Feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        end = buffer.rfind(b'\n') + 1
+        if end:
+            start = 0
+            if self._discarding:
+                #Drop the tail of an overlong line
+                start = buffer.find(b'\n') + 1
+                self._discarding = False
+            if _BLOCK_PATTERN.fullmatch(buffer, start, end) is not None:
+                self._ParseBlock(buffer, start, end, frames)
+            else:
+                self._ParseLines(buffer, start, end, frames)
+            del buffer[:end]
+        if len(buffer) > self.maxLineLength:
+            del buffer[:]
+            if not self._discarding:
+                self.malformed += 1
+                self._discarding = True
+        self.frames += len(frames)
+        return frames
+
+    ## Documentation for _ParseBlock method.
+    #
+    # Fast path for a block of well formed lines: one split for the whole block, then every column is converted by
+    # a C level map and the records are built without a Python call per line.
+    #  @param self The object pointer.
+    def _ParseBlock(self, buffer, start, end, frames):
+        fields = bytes(buffer[start:end]).replace(b'\r', b'').replace(b'\n', b',').split(b',')
+        del fields[-1]
+        frames.extend(map(tuple.__new__, itertools.repeat(DUTFrame),
+                          zip(map(bytes.decode, fields[0::5]), map(int, fields[1::5]), map(int, fields[2::5]),
+                              map(int, fields[3::5]), map(int, fields[4::5]))))
+
+    ## Documentation for _ParseLines method.
+    #
+    # Slow path, matches every line in place and counts the malformed ones.
+    #  @param self The object pointer.
+    def _ParseLines(self, buffer, start, end, frames):
+        match = _FRAME_PATTERN.match
+        pos = start
+        while pos < end:
+            lineEnd = buffer.find(b'\n', pos) + 1
+            found = match(buffer, pos, lineEnd)
+            if found is not None and found.end() == lineEnd:
+                frames.append(DUTFrame(found.group(1).decode('ascii', 'replace'), int(found.group(2)), int(found.group(3)),
+                                       int(found.group(4)), int(found.group(5))))
+            else:
+                self.malformed += 1
+            pos = lineEnd
+
+    ## Documentation for ReadFrom method.
+    #
+    # Reads whatever the port has waiting (at least one byte, bounded by the port timeout) into the reusable chunk
+    # buffer and returns the completed frames. Returns an empty list on timeout.
+    #  @param self The object pointer.
+    #  @param ser An open serial.Serial or compatible object.
+    def ReadFrom(self, ser):
+        size = min(max(ser.in_waiting, 1), len(self.chunk))
+        count = ser.readinto(self.chunkView[:size])
+        if not count:
+            return []
+        return self.Feed(self.chunkView[:count])
+
+    ## Documentation for Reset method.
+    #  @param self The object pointer.
+    def Reset(self):
+        del self.buffer[:]
+        self._discarding = False
+
+
+## Documentation for the ReportAssembler class.
+#
+#  This class places the frames of one DUT report by channel and finds the end of the report
+class ReportAssembler(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self):
+        self.pending   = None
+        self.misplaced = 0
+        self._slots    = 0
+        self._last     = 0
+        self._lines    = 0
+
+    ## Documentation for Start method.
+    #
+    # Clears frames, one slot per channel, for the next report. Returns True if the report is already complete,
+    # which happens when the frame that ended the previous report was the only one of this report.
+    #  @param self The object pointer.
+    #  @param frames List with one entry per channel, filled by Add.
+    def Start(self, frames):
+        self._slots = len(frames)
+        for index in range(self._slots):
+            frames[index] = None
+        self._last  = 0
+        self._lines = 0
+        pending = self.pending
+        self.pending = None
+        return pending is not None and self.Add(frames, pending)
+
+    ## Documentation for Add method.
+    #
+    # Places one frame read for the report at frames[frame.channel-1] and returns True once the report is complete.
+    # A frame whose channel is not above the last one placed starts the next report, it is kept as pending and
+    # placed by the next Start. A frame with a channel out of range, or None for a malformed line, counts as one of
+    # the lines of the report and leaves its channel missing.
+    #  @param self The object pointer.
+    def Add(self, frames, frame):
+        if frame is not None and 1 <= frame.channel <= self._slots:
+            if frame.channel <= self._last:
+                self.pending = frame
+                return True
+            frames[frame.channel-1] = frame
+            self._last = frame.channel
+        elif frame is not None:
+            self.misplaced += 1
+        self._lines += 1
+        return self._last == self._slots or self._lines >= self._slots
+
+    ## Documentation for Reset method.
+    #
+    # Drops the pending frame, after the input was flushed.
+    #  @param self The object pointer.
+    def Reset(self):
+        self.pending = None
+
+
+## Documentation for a function.
+#
+# Microbenchmark comparing the FrameParser with the parsing RunTest did before it: readline, decode, rstrip, split
+# and int() on every field. The first pass parses in memory only, the second reads the lines through a pseudo
+# terminal with serial.Serial.readline against FrameParser.ReadFrom.
+def Benchmark(lines=200000, chunkSize=4096):
+
+    line = b'ADC,1,404,123,694\r\n'
+    stream = line*lines
+    chunks = [stream[i:i+chunkSize] for i in range(0, len(stream), chunkSize)]
+
+    parser = FrameParser()
+    startTime = time.perf_counter()
+    for chunk in chunks:
+        parser.Feed(chunk)
+    parserTime = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    for received_data in stream.splitlines():
+        _SplitParse(received_data)
+    splitTime = time.perf_counter() - startTime
+
+    print ("In memory, FrameParser: %d frames, %d malformed, %.0f lines/sec" % (parser.frames, parser.malformed, lines/parserTime))
+    print ("In memory, split():     %.0f lines/sec" % (lines/splitTime))
+
+    if hasattr(os, 'openpty'):
+        serialLines = lines//20
+        print ("Serial pty, FrameParser.ReadFrom: %.0f lines/sec" % _PtyBenchmark(line, serialLines, True))
+        print ("Serial pty, readline + split():   %.0f lines/sec" % _PtyBenchmark(line, serialLines, False))
+
+## Documentation for a function.
+#
+# Parses one line the way RunTest did before the FrameParser
+def _SplitParse(received_data):
+    Header,ADC_Channel,ADC_Mean,ADC_Min,ADC_Max=received_data.decode('ascii').rstrip().split(",")
+    ADC_Max = ADC_Max.rstrip()
+    return Header, int(ADC_Channel), int(ADC_Mean), int(ADC_Min), int(ADC_Max)
+
+## Documentation for a function.
+#
+# Writes lines into a pseudo terminal from a thread and returns the lines/sec achieved by the reader
+def _PtyBenchmark(line, lines, useParser):
+
+    import serial
+
+    master, slave = os.openpty()
+    ser = serial.Serial(os.ttyname(slave), 115200, timeout=1)
+    writer = threading.Thread(target=_PtyWriter, args=(master, line, lines))
+    startTime = time.perf_counter()
+    writer.start()
+    received = 0
+    if useParser:
+        parser = FrameParser()
+        while received < lines:
+            frames = parser.ReadFrom(ser)
+            if not frames and not ser.in_waiting and not writer.is_alive():
+                break
+            received += len(frames)
+    else:
+        while received < lines:
+            received_data = ser.readline()
+            if not received_data:
+                break
+            _SplitParse(received_data)
+            received += 1
+    elapsed = time.perf_counter() - startTime
+    writer.join()
+    ser.close()
+    os.close(master)
+    os.close(slave)
+    return received/elapsed
+
+## Documentation for a function.
+def _PtyWriter(master, line, lines):
+    block = line*256
+    for _ in range(lines//256):
+        os.write(master, block)
+    os.write(master, line*(lines % 256))
+
+if __name__ == "__main__":
+    Benchmark()
@@ -0,0 +1,146 @@
+## @package ADC_FrequencyModel
+#
+# Purpose: Frequency aware expected ADC counts, modelling the DAC staircase, the DUT anti-alias filter and its sampling
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  ExpectedValueEngine reads the expected counts straight off the controller DAC table, so they are the same at
+#  every frequency. On a board the staircase of DAC samples passes the anti-alias filter of the DUT, which takes
+#  off more of the peaks the closer the wave gets to the cut off, and is then sampled at the DUT sample rate, which
+#  only rarely lands on the very peak of the filtered wave. The FrequencyModelEngine models both:
+#
+#    1. One period of the DAC staircase on a time base of oversample points per DAC sample.
+#    2. The filter applied as a Butterworth response to every harmonic of the period, rfft -> H(f) -> irfft, which
+#       gives the exact steady state of the periodic wave.
+#    3. The DUT window of samples taken at the sample rate from several start phases. The mean, and the average
+#       over phases of the lowest and highest sample, are the expected mean, min and max.
+#
+#  The filter is linear, so the unit amplitude wave is modelled once per frequency and every amplitude is scaled from
+#  it. Results are cached per (amplitude, frequency) and DAC/ADC/DUT configuration. Far below the cut off the model
+#  agrees with ExpectedValueEngine on min and max, its mean is about 1% higher as it averages all DAC samples.
+
+import functools
+
+import numpy as np
+
+from ADC_Expected import ExpectedADC, ExpectedValueEngine, CalculateExpectedADC
+
+
+#DUT sampling Configuration
+DUT_SAMPLE_RATE   = 10000   #ADC samples per second and channel
+DUT_FILTER_CUTOFF = 1000    #-3 dB frequency of the anti-alias filter in Hz
+DUT_FILTER_ORDER  = 1       #Order of the Butterworth anti-alias filter
+#Model resolution
+MODEL_OVERSAMPLE  = 64      #Time base points per DAC sample
+MODEL_PHASES      = 16      #Start phases of the DUT window averaged over
+
+
+## Documentation for a function.
+#
+# Returns the complex response of a Butterworth low pass filter at the given frequencies
+def ButterworthResponse(frequencies, cutoff, order):
+    s = 1j*np.asarray(frequencies, dtype=float)/cutoff
+    poles = np.exp(1j*np.pi*(2*np.arange(1, order+1) + order - 1)/(2*order))
+    return np.prod(-poles/(s[..., np.newaxis] - poles), axis=-1)
+
+
+## Documentation for the FrequencyModelEngine class.
+#
+#  This class serves cached expected ADC counts of a wave of given amplitude and frequency as the DUT samples it
+class FrequencyModelEngine(ExpectedValueEngine):
+
+    frequencyAware = True
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param sampleRate DUT samples per second and channel.
+    #  @param cutoff -3 dB frequency of the DUT anti-alias filter in Hz.
+    #  @param filterOrder Order of the Butterworth anti-alias filter.
+    #  @param window DUT samples per report, one second of samples when None.
+    #  @param config DAC/ADC configuration and tolerance, as taken by ExpectedValueEngine.
+    def __init__(self, sampleRate=DUT_SAMPLE_RATE, cutoff=DUT_FILTER_CUTOFF, filterOrder=DUT_FILTER_ORDER, window=None,
+                 phases=MODEL_PHASES, oversample=MODEL_OVERSAMPLE, cacheSize=128, **config):
+        ExpectedValueEngine.__init__(self, cacheSize=cacheSize, **config)
+        self.sampleRate  = sampleRate
+        self.cutoff      = cutoff
+        self.filterOrder = filterOrder
+        self.window      = window if window else int(sampleRate)
+        self.phases      = phases
+        self.oversample  = oversample
+        self._cached   = functools.lru_cache(maxsize=cacheSize)(self._Model)
+        self._response = functools.lru_cache(maxsize=cacheSize)(self._UnitResponse)
+
+    ## Documentation for _Configuration method.
+    #
+    # Everything the model depends on besides amplitude and frequency, part of every cache key.
+    #  @param self The object pointer.
+    def _Configuration(self):
+        return (self.fOffsetDC, self.fVrefDAC, self.fGain, self.BitRes, self.iMaxSamples,
+                self.sampleRate, self.cutoff, self.filterOrder, self.window, self.phases, self.oversample)
+
+    ## Documentation for _UnitResponse method.
+    #
+    # Models the unit amplitude wave at freq and returns (mean, lows, highs) of the DUT samples, lows and highs
+    # holding the lowest and highest sample of the window for every start phase.
+    #  @param self The object pointer.
+    def _UnitResponse(self, freq, configuration):
+        points = self.iMaxSamples*self.oversample
+        staircase = np.repeat(np.sin(np.arange(self.iMaxSamples)*(2*np.pi/self.iMaxSamples)), self.oversample)
+        spectrum = np.fft.rfft(staircase)
+        harmonics = np.arange(len(spectrum))*float(freq)
+        filtered = np.fft.irfft(spectrum*ButterworthResponse(harmonics, self.cutoff, self.filterOrder), points)
+
+        #Position of every DUT sample in the period, one row per start phase, interpolated on the time base
+        starts = np.arange(self.phases)/float(self.phases*freq)
+        times = np.arange(self.window)/float(self.sampleRate)
+        position = np.mod((starts[:, np.newaxis] + times)*freq, 1.0)*points
+        index = position.astype(np.int64)
+        fraction = position - index
+        samples = filtered[index]*(1 - fraction) + filtered[(index + 1) % points]*fraction
+        return float(samples.mean()), samples.min(axis=1), samples.max(axis=1)
+
+    ## Documentation for _Model method.
+    #  @param self The object pointer.
+    def _Model(self, fAmp, freq, configuration):
+        mean, lows, highs = self._response(freq, configuration)
+        #A negative amplitude turns the wave upside down
+        low = np.minimum(fAmp*lows, fAmp*highs).mean()
+        high = np.maximum(fAmp*lows, fAmp*highs).mean()
+        scale = self.fVrefDAC*self.fGain/self.BitRes
+        return ExpectedADC(int((self.fOffsetDC + fAmp*mean)*scale), int((self.fOffsetDC + low)*scale),
+                           int((self.fOffsetDC + high)*scale))
+
+    ## Documentation for Calculate method.
+    #
+    # Returns the ExpectedADC counts of a wave of amplitude fAmp and frequency freq. Without a frequency, e.g. before
+    # the controller has been configured, the wave is taken as a bare DAC table like ExpectedValueEngine does.
+    #  @param self The object pointer.
+    def Calculate(self, fAmp, freq=None):
+        if not freq:
+            return CalculateExpectedADC(fAmp, self.fOffsetDC, self.fVrefDAC, self.fGain, self.BitRes, self.iMaxSamples)
+        return self._cached(fAmp, freq, self._Configuration())
+
+    ## Documentation for Table method.
+    #
+    # Returns an integer array of shape (len(amplitudes), len(frequencies), 3) with the expected mean, min and max
+    # counts of every grid point, as SweepPlanner.BuildTable uses it.
+    #  @param self The object pointer.
+    def Table(self, amplitudes, frequencies):
+        return np.array([[tuple(self.Calculate(fAmp, freq)) for freq in np.asarray(frequencies).tolist()]
+                         for fAmp in np.asarray(amplitudes, dtype=float).tolist()], dtype=np.int64).reshape(
+                             len(amplitudes), len(frequencies), 3)
+
+    ## Documentation for ClearCache method.
+    #  @param self The object pointer.
+    def ClearCache(self):
+        self._cached.cache_clear()
+        self._response.cache_clear()
+
+    ## Documentation for Attenuation method.
+    #
+    # Returns the gain of the anti-alias filter at freq, for reports.
+    #  @param self The object pointer.
+    def Attenuation(self, freq):
+        return float(abs(ButterworthResponse([freq], self.cutoff, self.filterOrder)[0]))
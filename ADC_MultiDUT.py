@@ -0,0 +1,258 @@
+## @package ADC_MultiDUT
+#
+# Purpose: Runs the Sampling Engine test on a rack of DUT boards that share one controller
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  One controller generates the sine wave for every board in the rack. The MultiDUTRunner owns the controller port
+#  and starts one DUTWorker thread per DUT port. Every worker waits for its board to report ready, the controller
+#  stimulus is sent once all boards are ready, and from then on each worker reads, evaluates and logs its own board
+#  independently with its own pass counters and log file. Serial reads release the GIL, so the rack is read in
+#  parallel and throughput scales with the number of boards.
+#
+#  Ports are opened by name through the openPort callable, so the runner works against pseudo-terminal fake DUTs
+#  as well as real serial adapters.
+
+import argparse
+import logging
+import re
+import threading
+import time
+
+import serial
+
+from ADC_Expected import ExpectedValueEngine
+from ADC_FrameParser import ParseLine, ReportAssembler
+from ADC_Pipeline import EncodeSetpoint
+from ADC_Test import SamplingTest
+
+
+## Documentation for the DUTWorker class.
+#
+#  This class reads and evaluates the results of a single DUT board in its own thread
+class DUTWorker(threading.Thread):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param port COM port of the DUT.
+    #  @param baud Baudrate of the DUT.
+    #  @param limits (mean, min, max) windows as returned by ExpectedValueEngine.Limits.
+    #  @param maxTests Number of tests to run on this board.
+    #  @param startEvent Event set by the runner once the controller stimulus has been sent.
+    #  @param channels Number of ADC channels reported by the DUT.
+    #  @param openPort Callable returning an open serial port for (port, baud, timeout).
+    def __init__(self, port, baud, limits, maxTests, startEvent, channels, openPort, timeout=10):
+        threading.Thread.__init__(self, name='DUT ' + port)
+        self.daemon     = True
+        self.port       = port
+        self.baud       = baud
+        self.limits     = limits
+        self.maxTests   = maxTests
+        self.startEvent = startEvent
+        self.channels   = channels
+        #SamplingTest keeps the readings of the last test, every board gets its own
+        self.evaluator  = SamplingTest(verbose=False, channels=channels)
+        self.report     = ReportAssembler()
+        self.openPort   = openPort
+        self.timeout    = timeout
+        self.readyEvent = threading.Event()
+        self.PassCounter = [0]*channels
+        self.Missing     = [0]*channels
+        self.testCounter = 0
+        self.error       = None
+        self.logger      = self._CreateLogger()
+
+    ## Documentation for _CreateLogger method.
+    #
+    # Creates a logger writing to SamplingEngine_Results_<port>.log for this board only.
+    #  @param self The object pointer.
+    def _CreateLogger(self):
+        logName = re.sub(r'[^A-Za-z0-9]+', '_', self.port).strip('_')
+        logger = logging.getLogger('SamplingEngine.' + logName)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        if not logger.handlers:
+            handler = logging.FileHandler('SamplingEngine_Results_' + logName + '.log')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', datefmt='%d/%m/%Y %I:%M:%S %p'))
+            logger.addHandler(handler)
+        return logger
+
+    ## Documentation for _ReadLine method.
+    #  @param self The object pointer.
+    def _ReadLine(self, ser):
+        data = ser.readline()
+        if not data:
+            raise serial.SerialTimeoutException('No data from DUT on ' + self.port)
+        return data
+
+    ## Documentation for _ReadReport method.
+    #
+    # Reads the report of one test into frames, placed by the channel number of each line. A channel whose line
+    # timed out, was malformed or did not arrive before the next report started is counted and logged as a missing
+    # frame, which fails the channel in this test only.
+    #  @param self The object pointer.
+    def _ReadReport(self, ser, testCounter, frames):
+        complete = self.report.Start(frames)
+        while not complete:
+            data = ser.readline()
+            #A line cut by the timeout is dropped with it
+            if not data.endswith(b'\n'):
+                break
+            complete = self.report.Add(frames, ParseLine(data))
+        for channel in range(self.channels):
+            if frames[channel] is None:
+                self.Missing[channel] += 1
+                self.logger.warning('Test %d,Channel %d,Missing frame', testCounter, channel+1)
+        return frames
+
+    ## Documentation for run method.
+    #  @param self The object pointer.
+    def run(self):
+        ser = None
+        try:
+            ser = self.openPort(self.port, self.baud, self.timeout)
+            self.logger.info('Tests Started - Device COM port %s', self.port)
+
+            #The DUT sends one line of data for each channel when it is ready, a board that never does is aborted
+            for channel in range(self.channels):
+                self._ReadLine(ser)
+            self.readyEvent.set()
+            self.startEvent.wait()
+
+            for testCounter in range(1, self.maxTests+1):
+                result = self.evaluator.pool.Next()
+                self._ReadReport(ser, testCounter, result.frames)
+                EngineResults = self.evaluator.EvaluateFrames(result.frames, self.limits, result)
+                self.testCounter = testCounter
+                for channel in range(self.channels):
+                    if EngineResults[channel] == True:
+                        self.PassCounter[channel] += 1
+                        self.logger.info('Test %d,Passed,%d', testCounter, 100.0 * self.PassCounter[channel] / testCounter)
+                    else:
+                        self.logger.info('Test %d, Failed,%d', testCounter, 100.0 * self.PassCounter[channel] / testCounter)
+            self.logger.info('Finished')
+        except Exception as e:
+            self.error = e
+            self.logger.error('Aborted: %s', e)
+        finally:
+            #Never leave the runner waiting on a board that failed to come up
+            self.readyEvent.set()
+            if ser is not None:
+                ser.close()
+
+    ## Documentation for SuccessStat method.
+    #
+    # Returns the pass percentage of each channel over the tests run so far.
+    #  @param self The object pointer.
+    def SuccessStat(self):
+        if self.testCounter == 0:
+            return [0.0]*self.channels
+        return [100.0 * passed / self.testCounter for passed in self.PassCounter]
+
+
+## Documentation for the MultiDUTRunner class.
+#
+#  This class drives one controller and reads N DUT boards concurrently
+class MultiDUTRunner(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param dutPorts List of DUT COM ports.
+    #  @param openPort Callable returning an open serial port for (port, baud, timeout), serial.Serial by default.
+    def __init__(self, uCPort, uCBaud, dutPorts, dutBaud, fAmp, freq, maxTests, engine=None, openPort=None, timeout=10, channels=2):
+        self.uCPort   = uCPort
+        self.uCBaud   = uCBaud
+        self.dutPorts = list(dutPorts)
+        self.dutBaud  = dutBaud
+        self.fAmp     = fAmp
+        self.freq     = freq
+        self.maxTests = maxTests
+        self.engine   = engine if engine is not None else ExpectedValueEngine()
+        self.openPort = openPort if openPort is not None else self._OpenSerial
+        self.timeout  = timeout
+        self.channels = channels
+        self.workers  = []
+        self.elapsed  = 0.0
+
+    ## Documentation for _OpenSerial method.
+    @staticmethod
+    def _OpenSerial(port, baud, timeout):
+        return serial.Serial(port, baud, timeout=timeout)
+
+    ## Documentation for Run method.
+    #
+    # Opens the controller, waits for every DUT to report ready, sends the stimulus once and runs all boards
+    # until each has completed maxTests tests. Returns the list of DUTWorker objects.
+    #  @param self The object pointer.
+    def Run(self):
+        limits = self.engine.Limits(self.fAmp, self.freq)
+        startEvent = threading.Event()
+        self.workers = [DUTWorker(port, self.dutBaud, limits, self.maxTests, startEvent, self.channels, self.openPort, self.timeout)
+                        for port in self.dutPorts]
+
+        controller = self.openPort(self.uCPort, self.uCBaud, self.timeout)
+        try:
+            for worker in self.workers:
+                worker.start()
+            for worker in self.workers:
+                worker.readyEvent.wait()
+            print ("%d DUTs Ready" % sum(1 for worker in self.workers if worker.error is None))
+
+            #One stimulus for the whole rack
+            MESSAGE_PING = EncodeSetpoint(self.fAmp, self.freq)
+            controller.write(MESSAGE_PING)
+            print ("Controller Serial Port Rx: ", controller.readline())
+
+            startTime = time.monotonic()
+            startEvent.set()
+            for worker in self.workers:
+                worker.join()
+            self.elapsed = time.monotonic() - startTime
+        finally:
+            startEvent.set()
+            controller.close()
+        return self.workers
+
+    ## Documentation for TestsPerSecond method.
+    #
+    # Returns the number of completed tests per second across the whole rack.
+    #  @param self The object pointer.
+    def TestsPerSecond(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return sum(worker.testCounter for worker in self.workers) / self.elapsed
+
+
+## Documentation for a function.
+#
+# Parses the arguments and runs the test across all DUT ports given on the command line
+def main():
+
+    parser = argparse.ArgumentParser(description="Runs the Sampling Engine test on several DUTs sharing one controller.\n"
+                                                 "Each DUT is logged to SamplingEngine_Results_<port>.log")
+    parser.add_argument("uCOM", type=str, help=       "COM port of the Controller e.g. 'COM8' or '/dev/ttyUSB1'")
+    parser.add_argument("uBaud", type=int, help=      "Baudrate of the Controller e.g. '9600'")
+    parser.add_argument("Amplitude", type=float, help="Amplitude of sinewave from 0-0.5 e.g. '0.5'")
+    parser.add_argument("Frequency", type=int, help=  "Frequency of the Sine wave e.g. '50'")
+    parser.add_argument("dutCOM", type=str, nargs="+", help="COM ports of the DUTs e.g. '/dev/ttyUSB0 /dev/ttyUSB2'")
+    parser.add_argument("-b", "--dutBaud", type=int, default=115200, help="Baudrate of the DUTs, default 115200")
+    parser.add_argument("-m", "--maxtest", type=int, default=20, help=    "Maximum amount of tests to run per DUT, default 20")
+    parser.add_argument("-c", "--channels", type=int, default=2, help=    "Number of ADC channels reported by each DUT, default 2")
+    args = parser.parse_args()
+
+    runner = MultiDUTRunner(args.uCOM, args.uBaud, args.dutCOM, args.dutBaud, args.Amplitude, args.Frequency, args.maxtest,
+                            channels=args.channels)
+    workers = runner.Run()
+    for worker in workers:
+        SuccessStat = worker.SuccessStat()
+        if worker.error is not None:
+            print ("%s: aborted after %d tests (%s)" % (worker.port, worker.testCounter, worker.error))
+        else:
+            print ("%s: " % worker.port + ", ".join("Channel %d %.1f%%" % (channel+1, stat) for channel, stat in enumerate(SuccessStat)) +
+                   ", %d missing frames" % sum(worker.Missing))
+    print ("Throughput: %.1f tests/sec" % runner.TestsPerSecond())
+
+if __name__ == "__main__":
+    main()
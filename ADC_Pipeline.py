@@ -0,0 +1,224 @@
+## @package ADC_Pipeline
+#
+# Purpose: Pipelined client for the controller command port
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  SerialConnecter.SendSerialCON writes one command and waits for its reply before the next command can go out, so
+#  the link idles for a full round trip per setpoint. The PipelinedController queues pre-encoded commands and keeps
+#  up to window of them in flight. The controller answers in order, so every reply line is matched to the oldest
+#  command in flight. A reply echoing the setpoint ('OK,<amp>,<freq>') is matched to the command it echoes instead:
+#  the commands in flight before it lost their reply and are retired as lost, and an echo of no command in flight,
+#  e.g. a duplicated line, is dropped as mismatched. Either way the later replies stay matched to their commands.
+#
+#    python ADC_Pipeline.py /dev/ttyUSB1 9600 --window 8
+#  pushes the setpoints of a full amplitude x frequency sweep and reports commands/sec.
+#
+#  ADC_Test imports EncodeSetpoint from here at start up, so pyserial is only imported where a port is used.
+
+import argparse
+import collections
+import time
+
+
+#One answered command, latency in seconds from write to reply, reply is None for a command whose reply was lost
+CommandReply = collections.namedtuple('CommandReply', ['command', 'reply', 'latency', 'ok'])
+
+
+## Documentation for a function.
+#
+# Returns the controller command bytes for one setpoint
+def EncodeSetpoint(fAmp, freq):
+    return ('2,' + str(fAmp) + ',' + str(freq) + '\r').encode('ascii')
+
+
+## Documentation for the PipelinedController class.
+#
+#  This class keeps a window of controller commands in flight and matches the replies to them
+class PipelinedController(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param ser Open controller serial port.
+    #  @param window Maximum number of commands sent without a reply yet.
+    #  @param timeout Seconds to wait for the reply of the oldest command in flight.
+    def __init__(self, ser, window=8, timeout=2.0):
+        if window < 1:
+            raise ValueError('The window must hold at least one command, not %d' % window)
+        self.ser      = ser
+        self.window   = window
+        self.timeout  = timeout
+        self.pending  = collections.deque()
+        self.inFlight = collections.deque()
+        self.buffer   = bytearray()
+        self.sent       = 0
+        self.replies    = 0
+        self.errors     = 0
+        self.mismatched = 0
+        self.lost       = 0
+        self.busyTime   = 0.0
+
+    ## Documentation for Queue method.
+    #
+    # Queues one command, given as bytes or as a string to be sent as ASCII.
+    #  @param self The object pointer.
+    def Queue(self, command):
+        if isinstance(command, str):
+            command = command.encode('ascii')
+        self.pending.append(command)
+
+    ## Documentation for _Fill method.
+    #  @param self The object pointer.
+    def _Fill(self):
+        while self.pending and len(self.inFlight) < self.window:
+            command = self.pending.popleft()
+            self.ser.write(command)
+            self.inFlight.append((command, time.monotonic()))
+            self.sent += 1
+
+    ## Documentation for _Check method.
+    #
+    # Returns True when the reply accepts the command. 'OK,<amp>,<freq>' must echo the setpoint of the command,
+    # any other reply but 'ERR' is taken as an acknowledgement.
+    @staticmethod
+    def _Check(command, reply):
+        if reply.startswith(b'ERR'):
+            return False
+        fields = reply.split(b',')
+        if fields[0] != b'OK' or len(fields) != 3:
+            return True
+        sent = command.strip().split(b',')
+        try:
+            return len(sent) == 3 and float(fields[1]) == float(sent[1]) and int(fields[2]) == int(sent[2])
+        except ValueError:
+            return False
+
+    ## Documentation for _Match method.
+    #
+    # Returns the index in inFlight of the command a reply answers: the command a setpoint echo matches, None when
+    # it matches none of them, and the oldest command for any other reply.
+    #  @param self The object pointer.
+    def _Match(self, reply):
+        if not reply.startswith(b'OK,') or reply.count(b',') != 2:
+            return 0
+        for index, (command, sendTime) in enumerate(self.inFlight):
+            if self._Check(command, reply):
+                return index
+        return None
+
+    ## Documentation for _Receive method.
+    #
+    # Reads what the port has buffered and returns the replies completed by it.
+    #  @param self The object pointer.
+    def _Receive(self):
+        data = self.ser.read(max(self.ser.in_waiting, 1))
+        if not data:
+            return []
+        self.buffer += data
+        end = self.buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        lines = bytes(self.buffer[:end]).split(b'\n')
+        del self.buffer[:end+1]
+        now = time.monotonic()
+        answered = []
+        for line in lines:
+            reply = line.strip()
+            if not reply:
+                continue
+            if not self.inFlight:
+                #A reply nobody asked for, e.g. a controller banner
+                self.mismatched += 1
+                continue
+            index = self._Match(reply)
+            if index is None:
+                self.mismatched += 1
+                continue
+            #The commands sent before the one echoed never got their reply
+            for lost in range(index):
+                command, sendTime = self.inFlight.popleft()
+                self.lost += 1
+                answered.append(CommandReply(command, None, now - sendTime, False))
+            command, sendTime = self.inFlight.popleft()
+            ok = self._Check(command, reply)
+            if not ok:
+                self.errors += 1
+            answered.append(CommandReply(command, reply, now - sendTime, ok))
+            self.replies += 1
+        return answered
+
+    ## Documentation for Drain method.
+    #
+    # Sends every queued command, keeping window commands in flight, and returns the list of CommandReply in
+    # command order once all are answered or retired as lost. Raises serial.SerialTimeoutException when the oldest command in flight
+    # gets no reply within timeout.
+    #  @param self The object pointer.
+    def Drain(self):
+        startTime = time.monotonic()
+        answered = []
+        try:
+            while True:
+                self._Fill()
+                if not self.inFlight:
+                    return answered
+                received = self._Receive()
+                answered += received
+                if not received and time.monotonic() - self.inFlight[0][1] > self.timeout:
+                    import serial
+                    raise serial.SerialTimeoutException('No reply from the controller to %r' % self.inFlight[0][0])
+        finally:
+            self.busyTime += time.monotonic() - startTime
+
+    ## Documentation for CommandsPerSecond method.
+    #  @param self The object pointer.
+    def CommandsPerSecond(self):
+        return self.replies/self.busyTime if self.busyTime > 0 else 0.0
+
+
+## Documentation for a function.
+#
+# Opens the controller port and pushes every setpoint of a sweep through the pipelined client
+def main():
+
+    import serial
+    from ADC_Sweep import SweepPlanner
+    from ADC_Test import Amplitudes, Frequencies
+
+    parser = argparse.ArgumentParser(description="Pushes the setpoints of an amplitude x frequency sweep to the controller\n"
+                                                 "with several commands in flight and reports commands/sec")
+    parser.add_argument("uCOM", type=str, help=            "COM port of the Controller e.g. 'COM8' or '/dev/ttyUSB1'")
+    parser.add_argument("uBaud", type=int, help=           "Baudrate of the Controller e.g. '9600'")
+    parser.add_argument("-w", "--window", type=int, default=8, help="Commands in flight, default 8")
+    parser.add_argument("--ampsteps", type=int, default=10, help=   "Number of amplitude points, default 10")
+    parser.add_argument("--freqsteps", type=int, default=10, help=  "Number of frequency points, default 10")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Times to push the whole sweep, default 1")
+    args = parser.parse_args()
+    if args.window < 1:
+        parser.error("--window must be at least 1")
+    if args.ampsteps < 1 or args.freqsteps < 1:
+        parser.error("--ampsteps and --freqsteps must be at least 1")
+
+    amplitudes, frequencies = SweepPlanner().Grid(Amplitudes.Min.value, Amplitudes.Max.value, args.ampsteps,
+                                                  Frequencies.Min.value, Frequencies.Max.value, args.freqsteps)
+    setpoints = [EncodeSetpoint(fAmp, freq) for fAmp in amplitudes.tolist() for freq in frequencies.tolist()]
+
+    ser = serial.Serial(args.uCOM, args.uBaud, timeout=1)
+    try:
+        controller = PipelinedController(ser, args.window)
+        for repeat in range(args.repeat):
+            for setpoint in setpoints:
+                controller.Queue(setpoint)
+        answered = controller.Drain()
+    finally:
+        ser.close()
+
+    latencies = sorted(reply.latency for reply in answered if reply.reply is not None)
+    print ("%d commands, %d replies, %d errors, %d mismatched, %d lost" % (controller.sent, controller.replies, controller.errors,
+                                                                       controller.mismatched, controller.lost))
+    print ("Window %d: %.1f commands/sec, median latency %.2f ms" % (args.window, controller.CommandsPerSecond(),
+                                                                    1000*latencies[len(latencies)//2] if latencies else 0.0))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+## @package ADC_Plan
+#
+# Purpose: Runs declarative test plans of many amplitude/frequency steps across one or more stations
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  ADC_Test runs one wave per invocation. A test plan lists the stations, each a controller and the DUT it
+#  stimulates, and the steps to run on them, every step with its own amplitude, frequency, tests and tolerance.
+#  Plans are JSON, or YAML when PyYAML is installed:
+#
+#    {"channels": 2, "timeout": 10,
+#     "defaults": {"tests": 20, "tolerance": 20},
+#     "stations": [{"name": "bench1", "dut": "/dev/ttyUSB0", "dut_baud": 115200,
+#                   "controller": "/dev/ttyUSB1", "controller_baud": 9600}],
+#     "steps": [{"amplitude": 0.3, "frequency": 50, "tests": 100, "tolerance": 15},
+#               {"amplitude": 0.1, "frequency": 10, "stations": ["bench1"]}]}
+#
+#  A step runs on every station unless it names its stations. Before any port is opened the windows of every step
+#  are computed in one vectorized SweepPlanner pass. The steps of a station are then grouped by wave, so the
+#  controller is only reconfigured once per distinct amplitude and frequency, unless --keep-order is given.
+#  Every station runs its steps in its own thread on its own SessionDaemon session, and logs to
+#  SamplingEngine_Results_<station>.log.
+#
+#    python ADC_Plan.py plan.json
+#    python ADC_Plan.py plan.yaml --simulate --report results.json
+#  The run exits with status 1 when any test or step failed.
+
+import argparse
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+
+#One step of a plan, stations is None when the step runs on every station
+PlanStep = collections.namedtuple('PlanStep', ['stepId', 'fAmp', 'freq', 'tests', 'tolerance', 'stations'])
+#Outcome of one step on one station, reply is the SessionDaemon.Run reply dict or None with error set
+PlanResult = collections.namedtuple('PlanResult', ['step', 'station', 'reply', 'error'])
+
+
+## Documentation for a function.
+#
+# Reads a plan file, YAML for .yaml and .yml files and JSON otherwise, and returns its dict
+def LoadPlanFile(filename):
+    with open(filename) as planFile:
+        if os.path.splitext(filename)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError('PyYAML is needed to read %s, or write the plan as JSON' % filename)
+            return yaml.safe_load(planFile)
+        return json.load(planFile)
+
+
+## Documentation for the TestPlan class.
+#
+#  This class holds the validated stations and steps of a plan
+class TestPlan(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param stations List of FarmStation.
+    #  @param steps List of PlanStep.
+    #  @param channels Number of ADC channels reported by every DUT.
+    #  @param timeout Seconds to wait for each DUT frame.
+    def __init__(self, stations, steps, channels=2, timeout=10):
+        self.stations = list(stations)
+        self.steps    = list(steps)
+        self.channels = channels
+        self.timeout  = timeout
+
+    ## Documentation for FromDict method.
+    #
+    # Validates a plan dict as read from a plan file, raises ValueError naming the first problem found.
+    @classmethod
+    def FromDict(cls, plan):
+        from ADC_Farm import FarmStation
+
+        if not isinstance(plan, dict):
+            raise ValueError('A plan is a mapping with stations and steps')
+        defaults = plan.get('defaults', {})
+        stations = []
+        for index, station in enumerate(plan.get('stations', []), 1):
+            try:
+                name = str(station.get('name', 'station%d' % index))
+                stations.append(FarmStation(re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_'), station['dut'],
+                                            int(station.get('dut_baud', 115200)), station['controller'],
+                                            int(station.get('controller_baud', 9600))))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                raise ValueError('Station %d needs a dut and a controller port: %s' % (index, e))
+        names = [station.name for station in stations]
+        if len(set(names)) != len(names):
+            raise ValueError('Station names must be unique')
+
+        steps = []
+        for stepId, step in enumerate(plan.get('steps', []), 1):
+            try:
+                values = dict(defaults, **step)
+                stepStations = values.get('stations')
+                if stepStations is not None:
+                    stepStations = tuple(re.sub(r'[^A-Za-z0-9]+', '_', str(name)).strip('_') for name in stepStations)
+                    unknown = [name for name in stepStations if name not in names]
+                    if unknown:
+                        raise ValueError('unknown station %s' % ', '.join(unknown))
+                steps.append(PlanStep(stepId, float(values['amplitude']), int(values['frequency']),
+                                      int(values.get('tests', 20)), int(values.get('tolerance', 20)), stepStations))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError('Step %d: %s' % (stepId, e if not isinstance(e, KeyError) else 'no %s' % e))
+            if steps[-1].tests < 1 or steps[-1].tolerance < 0:
+                raise ValueError('Step %d: tests must be at least 1 and tolerance not negative' % stepId)
+        if not steps:
+            raise ValueError('The plan has no steps')
+        return cls(stations, steps, int(plan.get('channels', 2)), float(plan.get('timeout', 10)))
+
+    ## Documentation for Load method.
+    @classmethod
+    def Load(cls, filename):
+        return cls.FromDict(LoadPlanFile(filename))
+
+    ## Documentation for StepsOf method.
+    #
+    # Returns the steps that run on a station, in plan order.
+    #  @param self The object pointer.
+    def StepsOf(self, station):
+        return [step for step in self.steps if step.stations is None or station.name in step.stations]
+
+
+## Documentation for a function.
+#
+# Orders the steps of one station so the steps of one wave follow each other, the waves sorted by amplitude and
+# frequency. Steps of the same wave keep their plan order.
+def OrderSteps(steps):
+    return sorted(steps, key=lambda step: (step.fAmp, step.freq, step.stepId))
+
+
+## Documentation for a function.
+#
+# Returns the number of controller reconfigurations running the steps in the given order costs
+def Reconfigurations(steps):
+    return sum(1 for index, step in enumerate(steps)
+               if index == 0 or (step.fAmp, step.freq) != (steps[index-1].fAmp, steps[index-1].freq))
+
+
+## Documentation for a function.
+#
+# Computes the (mean, min, max) windows of every step in one pass and returns {stepId: limits}. The expected
+# counts of all step amplitudes come from one vectorized SweepPlanner evaluation, or from the engine per wave when
+# it is frequency aware.
+def PlanLimits(steps, engine=None):
+    import numpy as np
+    from ADC_Sweep import SweepPlanner
+
+    planner = SweepPlanner(engine)
+    if planner.engine.frequencyAware:
+        expected = np.array([tuple(planner.engine.Calculate(step.fAmp, step.freq)) for step in steps], dtype=np.int64)
+    else:
+        expected = planner.Expected([step.fAmp for step in steps])
+    tolerance = np.array([step.tolerance for step in steps], dtype=np.int64)[:, np.newaxis]
+    windows = np.stack((expected - tolerance, expected + tolerance), axis=-1).tolist()
+    return dict((step.stepId, tuple(tuple(window) for window in stepWindows)) for step, stepWindows in zip(steps, windows))
+
+
+## Documentation for the PlanWorker class.
+#
+#  This class runs the steps of one station on its own session in its own thread
+class PlanWorker(threading.Thread):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param station FarmStation to run on.
+    #  @param steps Ordered PlanStep list of the station.
+    #  @param limits {stepId: limits} as returned by PlanLimits.
+    #  @param openPort Callable returning an open serial port for (port, baud, timeout), serial.Serial by default.
+    def __init__(self, station, steps, limits, channels, timeout, openPort=None, flushInterval=1.0):
+        threading.Thread.__init__(self, name='Station ' + station.name)
+        self.daemon   = True
+        self.station  = station
+        self.steps    = steps
+        self.limits   = limits
+        self.channels = channels
+        self.timeout  = timeout
+        self.openPort = openPort
+        self.flushInterval = flushInterval
+        self.results  = []
+        self.testsRun = 0
+
+    ## Documentation for run method.
+    #
+    # A step that fails closes the session, the next step opens it again.
+    #  @param self The object pointer.
+    def run(self):
+        from ADC_ResultsLog import ResultsSink
+        from ADC_SessionDaemon import SessionDaemon
+
+        station = self.station
+        loggerName = 'SamplingEngine.' + station.name
+        logger = logging.getLogger(loggerName)
+        logger.propagate = False
+        sink = ResultsSink('SamplingEngine_Results_%s.log' % station.name, self.flushInterval, logger=loggerName).Start()
+        session = SessionDaemon(station.dutPort, station.dutBaud, station.uCPort, station.uCBaud, self.channels,
+                                self.timeout, self.openPort, logger=logger)
+        try:
+            for step in self.steps:
+                try:
+                    reply = session.Run(step.fAmp, step.freq, step.tests, self.limits[step.stepId])
+                except Exception as e:
+                    logger.error('Step %d aborted: %s', step.stepId, e)
+                    self.results.append(PlanResult(step, station.name, None, str(e)))
+                    try:
+                        session.Close()
+                    except Exception:
+                        session.ready = False
+                    continue
+                self.testsRun += reply['tests']
+                self.results.append(PlanResult(step, station.name, reply, None))
+        finally:
+            try:
+                session.Close()
+            finally:
+                sink.Stop()
+
+
+## Documentation for the PlanExecutor class.
+#
+#  This class precomputes, orders and runs a TestPlan, one PlanWorker thread per station
+class PlanExecutor(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param plan TestPlan to run.
+    #  @param engine ExpectedValueEngine providing the expected counts, the DAC table model by default.
+    #  @param keepOrder Run the steps in plan order instead of grouping them by wave.
+    #  @param openPort Callable returning an open serial port for (port, baud, timeout), serial.Serial by default.
+    def __init__(self, plan, engine=None, keepOrder=False, openPort=None, flushInterval=1.0):
+        self.plan      = plan
+        self.keepOrder = keepOrder
+        self.openPort  = openPort
+        self.flushInterval = flushInterval
+        self.limits    = PlanLimits(plan.steps, engine)
+        self.schedule  = collections.OrderedDict((station.name, self.Order(plan.StepsOf(station))) for station in plan.stations)
+        self.workers   = []
+        self.elapsed   = 0.0
+
+    ## Documentation for Order method.
+    #  @param self The object pointer.
+    def Order(self, steps):
+        return list(steps) if self.keepOrder else OrderSteps(steps)
+
+    ## Documentation for Run method.
+    #
+    # Runs every station's steps in parallel and returns the list of PlanResult in step and station order.
+    #  @param self The object pointer.
+    def Run(self):
+        self.workers = [PlanWorker(station, self.schedule[station.name], self.limits, self.plan.channels, self.plan.timeout,
+                                   self.openPort, self.flushInterval)
+                        for station in self.plan.stations]
+        startTime = time.monotonic()
+        for worker in self.workers:
+            worker.start()
+        for worker in self.workers:
+            worker.join()
+        self.elapsed = time.monotonic() - startTime
+        stationIndex = dict((station.name, index) for index, station in enumerate(self.plan.stations))
+        return sorted((result for worker in self.workers for result in worker.results),
+                      key=lambda result: (result.step.stepId, stationIndex[result.station]))
+
+    ## Documentation for TestsPerSecond method.
+    #
+    # Returns the number of completed tests per second across all stations.
+    #  @param self The object pointer.
+    def TestsPerSecond(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return sum(worker.testsRun for worker in self.workers) / self.elapsed
+
+
+## Documentation for a function.
+#
+# Parses the arguments, runs the plan and prints the result of every step
+def main():
+
+    parser = argparse.ArgumentParser(description="Runs a JSON or YAML test plan of amplitude/frequency steps, every station in its\n"
+                                                 "own thread. Each station is logged to SamplingEngine_Results_<station>.log")
+    parser.add_argument("plan", type=str, help=                     "Plan file, .json, or .yaml/.yml with PyYAML installed")
+    parser.add_argument("--keep-order", action="store_true", help=  "Run the steps in plan order instead of grouping them by wave")
+    parser.add_argument("--simulate", action="store_true", help=    "Run every station of the plan against a simulated DUT and controller")
+    parser.add_argument("--rate", type=float, default=500, help=    "DUT reports per second of the simulated stations, default 500")
+    parser.add_argument("--report", type=str, help=                 "Also write the results of every step to this JSON file")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Print the order and windows of every step, then exit without\n"
+                                                                    "opening any port")
+    args = parser.parse_args()
+
+    try:
+        plan = TestPlan.Load(args.plan)
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.simulate and not plan.stations:
+        from ADC_Farm import FarmStation
+        plan.stations.append(FarmStation('sim1', None, 115200, None, 9600))
+    if not plan.stations:
+        parser.error("The plan has no stations, add some or give --simulate")
+
+    executor = PlanExecutor(plan, keepOrder=args.keep_order)
+    for station in plan.stations:
+        steps = executor.schedule[station.name]
+        print ("Station %s: %d steps, %d controller reconfigurations (%d in plan order)" %
+               (station.name, len(steps), Reconfigurations(steps), Reconfigurations(plan.StepsOf(station))))
+        if args.dry_run:
+            for step in steps:
+                print ("  Step %d: amplitude %s frequency %d, %d tests, windows %s" %
+                       (step.stepId, step.fAmp, step.freq, step.tests,
+                        " ".join("%d..%d" % window for window in executor.limits[step.stepId])))
+    if args.dry_run:
+        return
+
+    #Simulated stations keep their names, only their ports are replaced
+    simulators = []
+    if args.simulate:
+        from ADC_Simulator import DUTSimulator
+        for index, station in enumerate(plan.stations):
+            simulator = DUTSimulator(args.rate, channels=plan.channels)
+            dutPort, controllerPort = simulator.Start()
+            simulators.append(simulator)
+            plan.stations[index] = station._replace(dutPort=dutPort, uCPort=controllerPort)
+    try:
+        results = executor.Run()
+    finally:
+        for simulator in simulators:
+            simulator.Stop()
+
+    allPassed = True
+    for result in results:
+        step = result.step
+        if result.reply is None:
+            allPassed = False
+            print ("Step %d amplitude %s frequency %d on %s: failed (%s)" % (step.stepId, step.fAmp, step.freq, result.station, result.error))
+            continue
+        if any(passed < step.tests for passed in result.reply['passed']):
+            allPassed = False
+        print ("Step %d amplitude %s frequency %d on %s: " % (step.stepId, step.fAmp, step.freq, result.station) +
+               ", ".join("Channel %d %.1f%%" % (channel+1, rate) for channel, rate in enumerate(result.reply['pass_rate'])))
+    configured = sum(1 for result in results if result.reply is not None and result.reply['configured'])
+    print ("%d steps on %d stations, %d controller reconfigurations, %.1f s" %
+           (len(results), len(plan.stations), configured, executor.elapsed))
+    print ("Throughput: %.1f tests/sec across %d stations" % (executor.TestsPerSecond(), len(plan.stations)))
+
+    if args.report:
+        with open(args.report, 'w') as reportFile:
+            json.dump([{'step': result.step.stepId, 'station': result.station, 'amplitude': result.step.fAmp,
+                        'frequency': result.step.freq, 'tests': result.step.tests, 'tolerance': result.step.tolerance,
+                        'reply': result.reply, 'error': result.error} for result in results], reportFile, indent=2)
+    if not allPassed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+## @package ADC_Reevaluate
+#
+# Purpose: Re-evaluates stored test results offline against a new tolerance policy
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  A results store written with ADC_Test.py --store keeps the measured and expected mean/min/max of every test and
+#  channel. This tool re-applies the pass windows to those readings with new tolerances and reports the new pass
+#  rate of every channel next to the one recorded at test time, without touching the hardware.
+#
+#  The record range is cut into chunks that are evaluated by a ProcessPoolExecutor. Every worker maps the file
+#  with numpy.memmap and only reads the pages of its own chunk, and the parent only keeps per-channel counters, so
+#  files of hundreds of millions of records are processed in constant memory on every core.
+#
+#    python ADC_Reevaluate.py results.bin --tolerance 15
+#    python ADC_Reevaluate.py results.bin --mean 10 --min 25 --max 25 -j 8
+
+import argparse
+import collections
+import concurrent.futures
+import os
+
+import numpy as np
+
+from ADC_Expected import ADC_TOLERANCE
+from ADC_ResultsStore import CheckHeader, LoadResults, PASS_ALL, NO_FRAME
+
+
+#Pass window either side of the expected mean, min and max ADC counts
+TolerancePolicy = collections.namedtuple('TolerancePolicy', ['mean', 'min', 'max'])
+
+
+## Documentation for the ChannelTally class.
+#
+#  This class adds up the re-evaluation counters of one channel
+class ChannelTally(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self):
+        self.tests      = 0
+        self.oldPassed  = 0
+        self.newPassed  = 0
+        self.noFrame    = 0
+        self.meanFailed = 0
+        self.minFailed  = 0
+        self.maxFailed  = 0
+
+    ## Documentation for OldRate method.
+    #  @param self The object pointer.
+    def OldRate(self):
+        return 100.0*self.oldPassed/self.tests if self.tests else 0.0
+
+    ## Documentation for NewRate method.
+    #  @param self The object pointer.
+    def NewRate(self):
+        return 100.0*self.newPassed/self.tests if self.tests else 0.0
+
+
+#Counters returned by EvaluateChunk, in ChannelTally attribute order
+_TALLY_FIELDS = ['tests', 'oldPassed', 'newPassed', 'noFrame', 'meanFailed', 'minFailed', 'maxFailed']
+
+
+## Documentation for a function.
+#
+# Evaluates records [start, stop) of a results file with a tolerance policy. Runs in a worker process and returns
+# {channel: [counters in _TALLY_FIELDS order]}, so only a few integers travel back to the parent.
+def EvaluateChunk(filename, start, stop, policy):
+
+    records = LoadResults(filename)[start:stop]
+    channels = records['channel']
+    passBits = records['passBits']
+    present = (passBits & NO_FRAME) == 0
+
+    #Same inclusive windows as SamplingTest.EvaluateFrames, computed in int64 so no difference can overflow
+    meanPass = np.abs(records['mean'].astype(np.int64) - records['expMean']) <= policy.mean
+    minPass  = np.abs(records['min'].astype(np.int64) - records['expMin']) <= policy.min
+    maxPass  = np.abs(records['max'].astype(np.int64) - records['expMax']) <= policy.max
+    newPass = meanPass & minPass & maxPass & present
+    oldPass = (passBits & (PASS_ALL | NO_FRAME)) == PASS_ALL
+
+    columns = [np.ones(len(records), dtype=bool), oldPass, newPass, ~present,
+               ~meanPass & present, ~minPass & present, ~maxPass & present]
+    length = int(channels.max()) + 1 if len(records) else 0
+    counts = [np.bincount(channels, weights=column, minlength=length) for column in columns]
+    tally = {}
+    for channel in np.flatnonzero(counts[0]):
+        tally[int(channel)] = [int(count[channel]) for count in counts]
+    return tally
+
+
+## Documentation for a function.
+#
+# Re-evaluates a whole results file and returns {channel: ChannelTally}. Chunks of chunkSize records are handed to
+# a pool of worker processes, at most 2*workers chunks are in flight at any time.
+def Reevaluate(filename, policy, workers=None, chunkSize=1000000):
+
+    total = CheckHeader(filename)
+    workers = workers or os.cpu_count() or 1
+    tallies = collections.defaultdict(ChannelTally)
+
+    def Merge(result):
+        for channel, counts in result.items():
+            tally = tallies[channel]
+            for field, count in zip(_TALLY_FIELDS, counts):
+                setattr(tally, field, getattr(tally, field) + count)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for start in range(0, total, chunkSize):
+            pending.add(executor.submit(EvaluateChunk, filename, start, min(start + chunkSize, total), policy))
+            if len(pending) >= 2*workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    Merge(future.result())
+        for future in concurrent.futures.as_completed(pending):
+            Merge(future.result())
+
+    return dict(tallies)
+
+
+## Documentation for a function.
+#
+# Parses the arguments, re-evaluates the file and prints the old and new pass rates of every channel
+def main():
+
+    parser = argparse.ArgumentParser(description="Re-evaluates a results store written by ADC_Test.py --store against new tolerances")
+    parser.add_argument("store", type=str, help=                  "Binary results file")
+    parser.add_argument("-t", "--tolerance", type=int, default=ADC_TOLERANCE, help="Pass window either side of every expected value, default %d" % ADC_TOLERANCE)
+    parser.add_argument("--mean", type=int, help=                 "Pass window of the mean, overrides --tolerance")
+    parser.add_argument("--min", type=int, help=                  "Pass window of the minimum, overrides --tolerance")
+    parser.add_argument("--max", type=int, help=                  "Pass window of the maximum, overrides --tolerance")
+    parser.add_argument("-j", "--workers", type=int, help=        "Number of worker processes, default one per CPU")
+    parser.add_argument("--chunk", type=int, default=1000000, help="Records per work item, default 1000000")
+    args = parser.parse_args()
+
+    policy = TolerancePolicy(args.tolerance if args.mean is None else args.mean,
+                             args.tolerance if args.min is None else args.min,
+                             args.tolerance if args.max is None else args.max)
+    print ("Re-evaluating %d records of %s with windows mean +-%d, min +-%d, max +-%d" %
+           ((CheckHeader(args.store), args.store) + tuple(policy)))
+
+    tallies = Reevaluate(args.store, policy, args.workers, args.chunk)
+    print ("%-8s %10s %10s %10s %10s %10s %10s" % ("Channel", "Tests", "Old pass%", "New pass%", "Mean fail", "Min fail", "Max fail"))
+    for channel in sorted(tallies):
+        tally = tallies[channel]
+        print ("%-8d %10d %10.2f %10.2f %10d %10d %10d" % (channel, tally.tests, tally.OldRate(), tally.NewRate(),
+                                                          tally.meanFailed, tally.minFailed, tally.maxFailed))
+        if tally.noFrame:
+            print ("%-8s %d tests without a DUT frame" % ("", tally.noFrame))
+
+if __name__ == "__main__":
+    main()
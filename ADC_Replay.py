@@ -0,0 +1,470 @@
+## @package ADC_Replay
+#
+# Purpose: Records the serial traffic of a test run and replays it in place of the serial ports
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  A TrafficRecorder wraps the ports SerialConnecter opens and appends every open, write, read and close to a
+#  capture file, with the time since the start of the recording. The file starts with a 20 byte header (magic,
+#  version, start time in seconds since the epoch), followed by one event after the other:
+#
+#    timestamp  float64  seconds since the start of the recording
+#    port       uint8    ports are numbered in the order they were opened
+#    kind       uint8    OPEN, TX, RX or CLOSE
+#    pad        uint16
+#    length     uint32   length of the payload
+#    payload    bytes    the bytes written or read, 'port,baud,timeout' for OPEN
+#
+#  Every read is recorded as it returned, so a read that timed out is an RX event without payload.
+#
+#  A TrafficReplay hands out ReplayPort objects through the same openPort hook, in the order the ports were opened
+#  in the recording. Every read returns the next recorded read of its port, timeouts included, and writes are
+#  checked against the recorded commands. By default the capture is replayed as fast as the test code can take it, and
+#  Clock gives the recorded time of the traffic, which SerialConnecter uses for its read deadlines so a recorded
+#  timeout is replayed without waiting for it. With realtime every read waits for its recorded time.
+#
+#    python ADC_Test.py /dev/ttyUSB0 115200 /dev/ttyUSB1 9600 0.3 50 -m 86400 --record soak.trf
+#    python ADC_Test.py replay 115200 replay 9600 0.3 50 -m 86400 --replay soak.trf -q
+#    python ADC_Replay.py soak.trf --dump 20
+
+import argparse
+import collections
+import struct
+import time
+
+
+MAGIC = b'ADCTRF01'
+VERSION = 1
+HEADER = struct.Struct('<8sId')
+EVENT = struct.Struct('<dBBxxI')
+
+OPEN  = 0
+TX    = 1
+RX    = 2
+CLOSE = 3
+EVENT_NAMES = {OPEN: 'open', TX: 'tx', RX: 'rx', CLOSE: 'close'}
+
+
+## Documentation for the ReplayEnded class.
+#
+#  Raised when the test code reads more than the capture holds
+class ReplayEnded(EOFError):
+    pass
+
+
+## Documentation for the TrafficRecorder class.
+#
+#  This class opens ports through openPort and records their traffic to a capture file
+class TrafficRecorder(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param filename Capture file, overwritten if it exists.
+    #  @param openPort Callable returning an open serial port for (port, baud, timeout).
+    #  @param bufferSize Bytes of events buffered before they are written.
+    def __init__(self, filename, openPort, bufferSize=65536):
+        self.filename   = filename
+        self.openPort   = openPort
+        self.bufferSize = bufferSize
+        self.buffer     = bytearray()
+        self.events     = 0
+        self.ports      = 0
+        self._file = open(filename, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self._startTime = time.monotonic()
+
+    ## Documentation for Record method.
+    #
+    # Appends one event to the capture.
+    #  @param self The object pointer.
+    def Record(self, port, kind, data=b''):
+        self.buffer += EVENT.pack(time.monotonic() - self._startTime, port, kind, len(data))
+        self.buffer += data
+        self.events += 1
+        if len(self.buffer) >= self.bufferSize:
+            self.Flush()
+
+    ## Documentation for OpenPort method.
+    #
+    # openPort callable for SerialConnecter, returns a RecordingPort around the real port.
+    #  @param self The object pointer.
+    def OpenPort(self, port, baud, timeout):
+        ser = self.openPort(port, baud, timeout)
+        index = self.ports
+        self.ports += 1
+        self.Record(index, OPEN, ('%s,%s,%s' % (port, baud, timeout)).encode('ascii', 'replace'))
+        return RecordingPort(ser, self, index)
+
+    ## Documentation for Flush method.
+    #  @param self The object pointer.
+    def Flush(self):
+        if self.buffer:
+            self._file.write(self.buffer)
+            del self.buffer[:]
+        self._file.flush()
+
+    ## Documentation for Close method.
+    #  @param self The object pointer.
+    def Close(self):
+        if not self._file.closed:
+            self.Flush()
+            self._file.close()
+
+
+## Documentation for the RecordingPort class.
+#
+#  Stand-in for serial.Serial that passes every call on to the real port and records the traffic
+class RecordingPort(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self, ser, recorder, index):
+        self.ser      = ser
+        self.recorder = recorder
+        self.index    = index
+
+    ## Documentation for timeout property.
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.ser.timeout = value
+
+    ## Documentation for in_waiting property.
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting
+
+    ## Documentation for write method.
+    #  @param self The object pointer.
+    def write(self, data):
+        count = self.ser.write(data)
+        self.recorder.Record(self.index, TX, bytes(data))
+        return count
+
+    ## Documentation for read method.
+    #  @param self The object pointer.
+    def read(self, size=1):
+        data = self.ser.read(size)
+        self.recorder.Record(self.index, RX, data)
+        return data
+
+    ## Documentation for readline method.
+    #  @param self The object pointer.
+    def readline(self):
+        data = self.ser.readline()
+        self.recorder.Record(self.index, RX, data)
+        return data
+
+    ## Documentation for readinto method.
+    #  @param self The object pointer.
+    def readinto(self, buffer):
+        count = self.ser.readinto(buffer)
+        self.recorder.Record(self.index, RX, bytes(buffer[:count]))
+        return count
+
+    ## Documentation for reset_input_buffer method.
+    #
+    # The discarded bytes were never read by the test, so they are not recorded.
+    #  @param self The object pointer.
+    def reset_input_buffer(self):
+        self.ser.reset_input_buffer()
+
+    ## Documentation for close method.
+    #  @param self The object pointer.
+    def close(self):
+        self.ser.close()
+        self.recorder.Record(self.index, CLOSE)
+
+
+## Documentation for a function.
+#
+# Reads the header of an open capture file and returns its start time, the file is left at its first event
+def ReadHeader(captureFile, filename):
+    header = captureFile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError('%s is not a traffic capture file' % filename)
+    magic, version, startTime = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a version %d traffic capture file' % (filename, VERSION))
+    return startTime
+
+
+## Documentation for a function.
+#
+# Yields every (timestamp, port, kind, payload) event of a capture file, a partly written last event is left out
+def IterEvents(filename):
+    with open(filename, 'rb') as captureFile:
+        ReadHeader(captureFile, filename)
+        for event in _Events(captureFile):
+            yield event
+
+
+## Documentation for a function.
+#
+# Yields the events of an open capture file from its current position, one record at a time, so a capture of a
+# long soak is never held in memory
+def _Events(captureFile):
+    read = captureFile.read
+    unpack = EVENT.unpack
+    while True:
+        record = read(EVENT.size)
+        if len(record) < EVENT.size:
+            break
+        timestamp, port, kind, length = unpack(record)
+        payload = read(length)
+        if len(payload) < length:
+            break
+        yield timestamp, port, kind, payload
+
+
+## Documentation for the TrafficReplay class.
+#
+#  This class replays a capture file through ReplayPort objects
+class TrafficReplay(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param filename Capture file written by a TrafficRecorder.
+    #  @param realtime Wait for the recorded time of every read instead of replaying as fast as possible.
+    def __init__(self, filename, realtime=False):
+        self.filename   = filename
+        self.realtime   = realtime
+        self._file      = open(filename, 'rb')
+        try:
+            self.startTime = ReadHeader(self._file, filename)
+        except ValueError:
+            self._file.close()
+            raise
+        self._events    = _Events(self._file)
+        self._received  = collections.defaultdict(collections.deque)
+        self._sent      = collections.defaultdict(collections.deque)
+        self._opened    = {}
+        self.ports      = 0
+        self.now        = 0.0
+        self.events     = 0
+        self.reads      = 0
+        self.mismatches = 0
+        self._realStart = None
+
+    ## Documentation for OpenPort method.
+    #
+    # openPort callable for SerialConnecter, the n-th port opened replays the n-th port of the recording.
+    #  @param self The object pointer.
+    def OpenPort(self, port, baud, timeout):
+        index = self.ports
+        self.ports += 1
+        while index not in self._opened:
+            if not self._Next():
+                raise ReplayEnded('The capture holds no port %d to open as %s' % (index + 1, port))
+        if self._realStart is None:
+            self._realStart = time.monotonic() - self._opened[index]
+        return ReplayPort(self, index, timeout)
+
+    ## Documentation for _Next method.
+    #
+    # Sorts the next event of the capture into its port queue, returns False at the end of the capture.
+    #  @param self The object pointer.
+    def _Next(self):
+        for timestamp, port, kind, payload in self._events:
+            self.events += 1
+            if kind == RX:
+                self._received[port].append((timestamp, payload))
+            elif kind == TX:
+                self._sent[port].append((timestamp, payload))
+            elif kind == OPEN:
+                self._opened[port] = timestamp
+            return True
+        return False
+
+    ## Documentation for Received method.
+    #
+    # Takes the next recorded read of a port, waiting for its recorded time when replaying in real time.
+    #  @param self The object pointer.
+    def Received(self, port):
+        queue = self._received[port]
+        while not queue:
+            if not self._Next():
+                raise ReplayEnded('The capture of port %d ends after %d reads' % (port + 1, self.reads))
+        timestamp, data = queue.popleft()
+        self._Advance(timestamp)
+        self.reads += 1
+        return data
+
+    ## Documentation for Sent method.
+    #
+    # Checks a write against the next recorded write of the port.
+    #  @param self The object pointer.
+    def Sent(self, port, data):
+        queue = self._sent[port]
+        while not queue:
+            if not self._Next():
+                self.mismatches += 1
+                return
+        timestamp, recorded = queue.popleft()
+        self._Advance(timestamp)
+        if recorded != bytes(data):
+            self.mismatches += 1
+
+    ## Documentation for _Advance method.
+    #  @param self The object pointer.
+    def _Advance(self, timestamp):
+        if timestamp > self.now:
+            self.now = timestamp
+        if self.realtime:
+            delay = self._realStart + timestamp - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    ## Documentation for Clock method.
+    #
+    # Recorded time of the traffic replayed so far, in place of time.monotonic when replaying as fast as possible.
+    #  @param self The object pointer.
+    def Clock(self):
+        return self.now
+
+    ## Documentation for Close method.
+    #  @param self The object pointer.
+    def Close(self):
+        self._file.close()
+
+    ## Documentation for Report method.
+    #  @param self The object pointer.
+    def Report(self):
+        return ("Replayed %d reads, %.1f s of recorded traffic, %d writes differed from the recording" %
+                (self.reads, self.now, self.mismatches))
+
+
+## Documentation for the ReplayPort class.
+#
+#  Stand-in for serial.Serial that returns the recorded reads of one port
+class ReplayPort(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    def __init__(self, replay, index, timeout):
+        self.replay  = replay
+        self.index   = index
+        self.timeout = timeout
+        self.pending = b''
+        self.timedOut = False
+
+    ## Documentation for _Fill method.
+    #
+    # Makes the next recorded read pending, an empty one is a timeout.
+    #  @param self The object pointer.
+    def _Fill(self):
+        if not self.pending and not self.timedOut:
+            self.pending = self.replay.Received(self.index)
+            self.timedOut = not self.pending
+
+    ## Documentation for _Take method.
+    #
+    # Returns up to size bytes of the pending read, or b'' for a recorded timeout.
+    #  @param self The object pointer.
+    def _Take(self, size):
+        self._Fill()
+        if self.timedOut:
+            self.timedOut = False
+            return b''
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    ## Documentation for in_waiting property.
+    #
+    # The bytes of the next recorded read are waiting, none before a recorded timeout.
+    @property
+    def in_waiting(self):
+        self._Fill()
+        return len(self.pending)
+
+    ## Documentation for write method.
+    #  @param self The object pointer.
+    def write(self, data):
+        self.replay.Sent(self.index, data)
+        return len(data)
+
+    ## Documentation for read method.
+    #  @param self The object pointer.
+    def read(self, size=1):
+        return self._Take(size)
+
+    ## Documentation for readinto method.
+    #  @param self The object pointer.
+    def readinto(self, buffer):
+        data = self._Take(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    ## Documentation for readline method.
+    #
+    # Joins recorded reads up to the end of a line, a recorded timeout ends the line early.
+    #  @param self The object pointer.
+    def readline(self):
+        line = b''
+        while True:
+            self._Fill()
+            if self.timedOut:
+                if not line:
+                    self.timedOut = False
+                return line
+            end = self.pending.find(b'\n') + 1
+            if end:
+                line += self.pending[:end]
+                self.pending = self.pending[end:]
+                return line
+            line += self.pending
+            self.pending = b''
+
+    ## Documentation for reset_input_buffer method.
+    #
+    # What the recording discarded was never recorded, so there is nothing to drop.
+    #  @param self The object pointer.
+    def reset_input_buffer(self):
+        pass
+
+    ## Documentation for close method.
+    #  @param self The object pointer.
+    def close(self):
+        pass
+
+
+## Documentation for a function.
+#
+# Prints a summary of a capture file, and its first events with --dump
+def main():
+
+    parser = argparse.ArgumentParser(description="Summarises a serial traffic capture written by ADC_Test.py --record")
+    parser.add_argument("capture", help=                      "Capture file")
+    parser.add_argument("--dump", type=int, default=0, help=  "Also print the first DUMP events")
+    args = parser.parse_args()
+
+    with open(args.capture, 'rb') as captureFile:
+        startTime = ReadHeader(captureFile, args.capture)
+    ports = {}
+    counts = collections.Counter()
+    sizes = collections.Counter()
+    timeouts = collections.Counter()
+    duration = 0.0
+    for number, (timestamp, port, kind, payload) in enumerate(IterEvents(args.capture)):
+        if number < args.dump:
+            print ("%12.6f  port %d  %-5s %r" % (timestamp, port + 1, EVENT_NAMES.get(kind, kind), payload))
+        if kind == OPEN:
+            ports.setdefault(port, payload.decode('ascii', 'replace'))
+        counts[port, kind] += 1
+        sizes[port, kind] += len(payload)
+        if kind == RX and not payload:
+            timeouts[port] += 1
+        duration = timestamp
+
+    print ("Recorded %s, %.1f s of traffic" % (time.strftime('%d/%m/%Y %I:%M:%S %p', time.localtime(startTime)), duration))
+    for port in sorted(ports):
+        print ("Port %d %s: %d writes (%d bytes), %d reads (%d bytes), %d timeouts" %
+               (port + 1, ports[port], counts[port, TX], sizes[port, TX], counts[port, RX], sizes[port, RX], timeouts[port]))
+
+if __name__ == "__main__":
+    main()
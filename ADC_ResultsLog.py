@@ -0,0 +1,175 @@
+## @package ADC_ResultsLog
+#
+# Purpose: Batched, background writer for SamplingEngine_Results.log
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The test loop logs through the standard logging calls. The ResultsSink attaches a queue handler to the root
+#  logger, so a logging.info call only puts the record on a bounded queue. A listener thread formats the queued
+#  records and writes them to the log file in batches, once per flush interval. A full queue makes the test loop
+#  wait rather than drop records. Stop drains the queue, so records are not lost on Ctrl-C or at exit.
+#
+#  A record that cannot be formatted is reported through the handleError of the handler, like logging does for its
+#  own handlers, and a batch that cannot be written is reported on stderr. The writer thread keeps going either way,
+#  so the test loop never waits on a queue nobody empties.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+
+LOG_FORMAT      = '%(asctime)s %(message)s'
+LOG_DATE_FORMAT = '%d/%m/%Y %I:%M:%S %p'
+
+_STOP = object()
+
+
+## Documentation for the BlockingQueueHandler class.
+#
+#  Queue handler that waits for room instead of dropping records, and leaves formatting to the listener thread
+class BlockingQueueHandler(logging.handlers.QueueHandler):
+
+    #Thread emptying the queue, a full queue is only waited on while it runs
+    writer = None
+
+    ## Documentation for prepare method.
+    #
+    # The test loop only logs numbers and strings, so the record can be queued as is and formatted later.
+    #  @param self The object pointer.
+    def prepare(self, record):
+        return record
+
+    ## Documentation for enqueue method.
+    #
+    # Waits for room on the queue while the writer thread runs. Raises RuntimeError once it has stopped, which emit
+    # reports through handleError.
+    #  @param self The object pointer.
+    def enqueue(self, record):
+        while True:
+            try:
+                self.queue.put(record, timeout=1.0)
+                return
+            except queue.Full:
+                if self.writer is None or not self.writer.is_alive():
+                    raise RuntimeError('The results log writer has stopped, the record is dropped')
+
+
+## Documentation for the ResultsSink class.
+#
+#  This class collects the results log records on a queue and writes them to file in batches from a thread
+class ResultsSink(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param filename Log file, opened for append.
+    #  @param flushInterval Seconds between batch writes.
+    #  @param queueSize Maximum number of records waiting to be written.
+    #  @param logger Name of the logger the records are taken from, the root logger by default.
+    def __init__(self, filename='SamplingEngine_Results.log', flushInterval=1.0, queueSize=10000, level=logging.INFO, logger=None):
+        self.filename      = filename
+        self.flushInterval = flushInterval
+        self.queue         = queue.Queue(maxsize=queueSize)
+        self.level         = level
+        self.logger        = logger
+        self.formatter     = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+        self.handler       = BlockingQueueHandler(self.queue)
+        self.records       = 0
+        self.batches       = 0
+        self.errors        = 0
+        self._thread       = None
+
+    ## Documentation for Start method.
+    #
+    # Opens the log file, attaches the queue handler to the logger and starts the writer thread.
+    #  @param self The object pointer.
+    def Start(self):
+        self._file = open(self.filename, 'a')
+        root = logging.getLogger(self.logger)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self._thread = threading.Thread(target=self._Run, name='Results log writer')
+        self._thread.daemon = True
+        self.handler.writer = self._thread
+        self._thread.start()
+        atexit.register(self.Stop)
+        return self
+
+    ## Documentation for Stop method.
+    #
+    # Detaches the handler, writes every record still queued and closes the file. Safe to call more than once.
+    #  @param self The object pointer.
+    def Stop(self):
+        if self._thread is None:
+            return
+        logging.getLogger(self.logger).removeHandler(self.handler)
+        #A writer that has stopped takes no _STOP, there is nothing to wait for then
+        while self._thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        atexit.unregister(self.Stop)
+
+    ## Documentation for _Run method.
+    #
+    # Writer thread. Collects records for up to flushInterval seconds and writes them as one batch.
+    #  @param self The object pointer.
+    def _Run(self):
+        batch = []
+        nextFlush = time.monotonic() + self.flushInterval
+        running = True
+        while running:
+            try:
+                record = self.queue.get(timeout=max(nextFlush - time.monotonic(), 0))
+                if record is _STOP:
+                    running = False
+                else:
+                    batch.append(self._Format(record))
+            except queue.Empty:
+                pass
+            if batch and (not running or time.monotonic() >= nextFlush):
+                self._Write(batch)
+                batch = []
+            if time.monotonic() >= nextFlush:
+                nextFlush = time.monotonic() + self.flushInterval
+
+    ## Documentation for _Format method.
+    #
+    # Returns the formatted record, or None when it cannot be formatted, which is reported through handleError.
+    #  @param self The object pointer.
+    def _Format(self, record):
+        try:
+            return self.formatter.format(record)
+        except Exception:
+            self.errors += 1
+            self.handler.handleError(record)
+            return None
+
+    ## Documentation for _Write method.
+    #
+    # Writes one batch, a batch the file does not take is dropped and reported on stderr.
+    #  @param self The object pointer.
+    def _Write(self, batch):
+        lines = [line for line in batch if line is not None]
+        if not lines:
+            return
+        lines.append('')
+        try:
+            self._file.write('\n'.join(lines))
+            self._file.flush()
+        except Exception as e:
+            self.errors += 1
+            sys.stderr.write('Results log: %d records not written to %s: %s\n' % (len(lines) - 1, self.filename, e))
+            return
+        self.records += len(lines) - 1
+        self.batches += 1
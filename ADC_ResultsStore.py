@@ -0,0 +1,122 @@
+## @package ADC_ResultsStore
+#
+# Purpose: Compact append-only binary store for the per-channel results of every test
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  SamplingEngine_Results.log only keeps a pass percentage per line. The results store keeps the raw readings of
+#  every test and channel as fixed-width little-endian records:
+#
+#    test       uint64   test index
+#    timestamp  float64  seconds since the epoch
+#    channel    uint16   ADC channel reported by the DUT
+#    passBits   uint8    PASS_MEAN | PASS_MIN | PASS_MAX, NO_FRAME if the DUT line was missing or malformed
+#    pad        uint8
+#    mean, min, max           int32  measured ADC counts
+#    expMean, expMin, expMax  int32  expected ADC counts
+#
+#  The file starts with a 16 byte header (magic, record size). Records are packed with struct into a reusable
+#  bytearray and appended in batches. A run that crashed can leave a partly written record at the end of the file,
+#  it is cut off before the next run appends, so every record stays at a multiple of the record size. LoadResults maps the file with numpy.memmap, so every field can be read as
+#  a column of a 10 million record run without parsing text or loading the file into memory.
+
+import os
+import struct
+import time
+
+
+MAGIC = b'ADCRES01'
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<QdHBxiiiiii')
+
+PASS_MEAN = 0x01
+PASS_MIN  = 0x02
+PASS_MAX  = 0x04
+PASS_ALL  = PASS_MEAN | PASS_MIN | PASS_MAX
+NO_FRAME  = 0x08
+
+#numpy layout of RECORD, field for field
+RESULT_FIELDS = [('test', '<u8'), ('timestamp', '<f8'), ('channel', '<u2'), ('passBits', 'u1'), ('pad', 'u1'),
+                 ('mean', '<i4'), ('min', '<i4'), ('max', '<i4'),
+                 ('expMean', '<i4'), ('expMin', '<i4'), ('expMax', '<i4')]
+
+
+## Documentation for the ResultsStore class.
+#
+#  This class appends result records to a binary results file
+class ResultsStore(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param filename Results file, created with a header if it does not exist yet.
+    #  @param batchSize Number of records buffered before they are written.
+    def __init__(self, filename, batchSize=4096):
+        self.filename  = filename
+        self.batchSize = batchSize
+        self.buffer    = bytearray(RECORD.size*batchSize)
+        self.pending   = 0
+        self.records   = 0
+        #Bytes of a torn trailing record cut off the existing file
+        self.truncated = 0
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            end = HEADER.size + CheckHeader(filename)*RECORD.size
+            self.truncated = os.path.getsize(filename) - end
+            if self.truncated:
+                os.truncate(filename, end)
+        self._file = open(filename, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, RECORD.size, 0))
+
+    ## Documentation for Append method.
+    #
+    # Adds one record. Records reach the file when the batch is full, on Flush or on Close.
+    #  @param self The object pointer.
+    def Append(self, test, channel, mean, adcMin, adcMax, expMean, expMin, expMax, passBits, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        RECORD.pack_into(self.buffer, self.pending*RECORD.size, test, timestamp, channel, passBits,
+                         mean, adcMin, adcMax, expMean, expMin, expMax)
+        self.pending += 1
+        if self.pending == self.batchSize:
+            self.Flush()
+
+    ## Documentation for Flush method.
+    #  @param self The object pointer.
+    def Flush(self):
+        if self.pending:
+            self._file.write(memoryview(self.buffer)[:self.pending*RECORD.size])
+            self.records += self.pending
+            self.pending = 0
+        self._file.flush()
+
+    ## Documentation for Close method.
+    #  @param self The object pointer.
+    def Close(self):
+        self.Flush()
+        self._file.close()
+
+
+## Documentation for a function.
+#
+# Checks the header of a results file and returns the number of complete records in it
+def CheckHeader(filename):
+    with open(filename, 'rb') as resultsFile:
+        header = resultsFile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError('%s is too short for a results store file' % filename)
+    magic, recordSize, _ = HEADER.unpack(header)
+    if magic != MAGIC or recordSize != RECORD.size:
+        raise ValueError('%s is not a results store file' % filename)
+    return (os.path.getsize(filename) - HEADER.size) // RECORD.size
+
+
+## Documentation for a function.
+#
+# Maps a results file read-only as a numpy record array, e.g. LoadResults(f)['mean'] is the column of measured
+# means. A partly written trailing record is left out.
+def LoadResults(filename):
+    import numpy as np
+    count = CheckHeader(filename)
+    return np.memmap(filename, dtype=np.dtype(RESULT_FIELDS), mode='r', offset=HEADER.size, shape=(count,))
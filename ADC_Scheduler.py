@@ -0,0 +1,102 @@
+## @package ADC_Scheduler
+#
+# Purpose: Schedulers deciding when the test loop starts its next test
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The FixedScheduler keeps the original behaviour of sleeping a fixed interval after every test. The
+#  AdaptiveScheduler does not sleep at all. The next test starts as soon as the DUT has delivered its next set of
+#  frames, because RunTest blocks on those reads. Only a minimum period between test starts is enforced, and the
+#  timeout is applied to the DUT reads, so a silent board fails its tests instead of stalling the run. Both
+#  schedulers count the completed tests and report the achieved tests/sec.
+
+import time
+
+
+## Documentation for the FixedScheduler class.
+#
+#  This class waits a fixed interval after every test
+class FixedScheduler(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param interval Seconds to wait after every test.
+    def __init__(self, interval):
+        self.interval  = interval
+        self.tests     = 0
+        self.startTime = None
+
+    ## Documentation for Attach method.
+    #
+    # Nothing to configure, the DUT port keeps its own timeout.
+    #  @param self The object pointer.
+    def Attach(self, connector):
+        pass
+
+    ## Documentation for Start method.
+    #
+    # Marks the start of the run, call before the first test.
+    #  @param self The object pointer.
+    def Start(self):
+        self.startTime = time.monotonic()
+        self.tests = 0
+
+    ## Documentation for Wait method.
+    #
+    # Call after every test, returns when the next test may start.
+    #  @param self The object pointer.
+    def Wait(self):
+        self.tests += 1
+        time.sleep(self.interval)
+
+    ## Documentation for TestsPerSecond method.
+    #  @param self The object pointer.
+    def TestsPerSecond(self):
+        if self.startTime is None:
+            return 0.0
+        elapsed = time.monotonic() - self.startTime
+        return self.tests/elapsed if elapsed > 0 else 0.0
+
+
+## Documentation for the AdaptiveScheduler class.
+#
+#  This class starts the next test as soon as the DUT frames arrive, subject to a minimum period
+class AdaptiveScheduler(FixedScheduler):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param minPeriod Minimum seconds between the starts of two tests.
+    #  @param timeout Seconds to wait for each DUT frame before the channel is failed.
+    def __init__(self, minPeriod=0.0, timeout=10.0):
+        FixedScheduler.__init__(self, 0.0)
+        self.minPeriod = minPeriod
+        self.timeout   = timeout
+        self._lastStart = None
+
+    ## Documentation for Attach method.
+    #
+    # Applies the frame timeout to the DUT port of an open SerialConnecter.
+    #  @param self The object pointer.
+    def Attach(self, connector):
+        connector.ser2.timeout = self.timeout
+
+    ## Documentation for Start method.
+    #  @param self The object pointer.
+    def Start(self):
+        FixedScheduler.Start(self)
+        self._lastStart = self.startTime
+
+    ## Documentation for Wait method.
+    #
+    # Only sleeps for whatever is left of the minimum period since the last test started.
+    #  @param self The object pointer.
+    def Wait(self):
+        self.tests += 1
+        now = time.monotonic()
+        remaining = self._lastStart + self.minPeriod - now
+        if remaining > 0:
+            time.sleep(remaining)
+            now += remaining
+        self._lastStart = now
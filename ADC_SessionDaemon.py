@@ -0,0 +1,295 @@
+## @package ADC_SessionDaemon
+#
+# Purpose: Keeps the controller and DUT sessions open between test runs
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  Every run of ADC_Test.py opens both serial ports, waits for the DUT ready lines and sends the controller command
+#  again. The session daemon does that once and then serves test runs over a local TCP socket. A run only sends the
+#  controller command when the amplitude or frequency changed since the last run, drops the DUT reports that piled
+#  up in between and starts testing at the next report boundary.
+#
+#  Requests and replies are single lines of JSON:
+#    {"command": "run", "amplitude": 0.3, "frequency": 50, "tests": 20}
+#        -> {"tests": 20, "passed": [20, 20], "pass_rate": [100.0, 100.0], "missing": [0, 0], "elapsed": 0.04, ...}
+#    {"command": "status"}   -> session state and run counters
+#    {"command": "shutdown"} -> closes the ports and stops the daemon
+#  Runs are served one at a time, in the order they arrive, as there is only one set of boards.
+#
+#    python ADC_SessionDaemon.py serve /dev/ttyUSB0 115200 /dev/ttyUSB1 9600
+#    python ADC_SessionDaemon.py run 0.3 50 -m 20
+#  The run client exits with status 1 when any test failed, for use in CI scripts.
+
+import argparse
+import json
+import logging
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import ADC_Test
+from ADC_Expected import ExpectedValueEngine
+from ADC_Pipeline import EncodeSetpoint
+from ADC_ResultsLog import ResultsSink
+
+
+DEFAULT_PORT = 8765
+
+
+## Documentation for the SessionDaemon class.
+#
+#  This class holds the serial sessions open and runs tests on request
+class SessionDaemon(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param channels Number of ADC channels reported by the DUT.
+    #  @param timeout Seconds to wait for each DUT frame.
+    #  @param openPort Callable returning an open serial port for (port, baud, timeout), serial.Serial by default.
+    #  @param logger Logger of the test results, the root logger by default.
+    def __init__(self, dutPort, dutBaud, uCPort, uCBaud, channels=2, timeout=10, openPort=None, engine=None, logger=None):
+        self.dutPort  = dutPort
+        self.dutBaud  = dutBaud
+        self.uCPort   = uCPort
+        self.uCBaud   = uCBaud
+        self.channels = channels
+        self.timeout  = timeout
+        self.engine   = engine if engine is not None else ExpectedValueEngine()
+        self.logger   = logger if logger is not None else logging.getLogger()
+        self.connector = ADC_Test.SerialConnecter(verbose=False, openPort=openPort)
+        self.evaluator = ADC_Test.SamplingTest(verbose=False, channels=channels)
+        self.ready    = False
+        self.stimulus = None
+        self.runs     = 0
+        self.testsRun = 0
+        self.openTime = None
+        self.server   = None
+
+    ## Documentation for Open method.
+    #
+    # Opens both ports and waits for the DUT ready lines, once for the life of the session.
+    #  @param self The object pointer.
+    def Open(self):
+        #The session keeps its ports to itself, so several sessions can run side by side in one process
+        self.connector.openSerialPortCON(self.uCPort, self.uCBaud)
+        self.connector.openSerialPortDUT(self.dutPort, self.dutBaud)
+        self.connector.ser2.timeout = self.timeout
+        for channel in range(self.channels):
+            self.connector.ReadSerialPortLineDUT()
+        print ("The DUT is Ready")
+        self.ready = True
+        self.stimulus = None
+        self.openTime = time.monotonic()
+
+    ## Documentation for Close method.
+    #  @param self The object pointer.
+    def Close(self):
+        if self.ready:
+            self.ready = False
+            self.connector.CloseSerialPortCON()
+            self.connector.CloseSerialPortDUT()
+
+    ## Documentation for Configure method.
+    #
+    # Sends the controller command, only when the wave differs from the one already running.
+    #  @param self The object pointer.
+    def Configure(self, fAmp, freq):
+        if self.stimulus == (fAmp, freq):
+            return False
+        MESSAGE_PING = EncodeSetpoint(fAmp, freq)
+        self.connector.SendSerialCON(MESSAGE_PING)
+        ack = self.connector.ReadSerialPortLineCON()
+        if not ack:
+            raise IOError('No answer from the controller on ' + self.uCPort)
+        self.stimulus = (fAmp, freq)
+        return True
+
+    ## Documentation for Resync method.
+    #
+    # Drops the DUT reports received since the last run and reads up to the last channel of the next report, so
+    # the run starts with channel 1 of a fresh report.
+    #  @param self The object pointer.
+    def Resync(self):
+        if not self.connector.ResyncDUT(self.channels):
+            raise IOError('No data from the DUT on ' + self.dutPort)
+
+    ## Documentation for Run method.
+    #
+    # Runs tests tests at the given wave and returns the reply dict. Every test is logged like LoopAndLog does.
+    #  @param self The object pointer.
+    #  @param limits Optional precomputed (mean, min, max) windows, taken from the engine when omitted.
+    def Run(self, fAmp, freq, tests, limits=None):
+        if not self.ready:
+            self.Open()
+        startTime = time.monotonic()
+        configured = self.Configure(fAmp, freq)
+        self.Resync()
+        if limits is None:
+            limits = self.engine.Limits(fAmp, freq)
+        self.runs += 1
+
+        self.logger.info('Run %d Started - Amplitude %s, Frequency %s, %d tests', self.runs, fAmp, freq, tests)
+        passed = [0]*self.channels
+        missing = [0]*self.channels
+        testStart = time.monotonic()
+        for testCounter in range(1, tests+1):
+            result = self.evaluator.pool.Next()
+            self.connector.ReadReportDUT(result.frames)
+            results = self.evaluator.EvaluateFrames(result.frames, limits, result)
+            for channel in range(self.channels):
+                if results.frames[channel] is None:
+                    missing[channel] += 1
+                if results[channel]:
+                    passed[channel] += 1
+                    self.logger.info('Test %d,Passed,%d', testCounter, 100.0 * passed[channel] / testCounter)
+                else:
+                    self.logger.info('Test %d, Failed,%d', testCounter, 100.0 * passed[channel] / testCounter)
+        endTime = time.monotonic()
+        self.testsRun += tests
+        self.logger.info('Finished')
+
+        return {'tests': tests, 'passed': passed, 'missing': missing,
+                'pass_rate': [100.0 * count / tests if tests else 0.0 for count in passed],
+                'configured': configured, 'elapsed': endTime - startTime, 'test_time': endTime - testStart}
+
+    ## Documentation for Status method.
+    #  @param self The object pointer.
+    def Status(self):
+        return {'ready': self.ready, 'amplitude': self.stimulus[0] if self.stimulus else None,
+                'frequency': self.stimulus[1] if self.stimulus else None, 'channels': self.channels,
+                'runs': self.runs, 'tests': self.testsRun,
+                'uptime': time.monotonic() - self.openTime if self.openTime is not None else 0.0,
+                'malformed': self.connector.parserDUT.malformed if self.ready else 0}
+
+    ## Documentation for Handle method.
+    #
+    # Serves one request dict and returns the reply dict. A serial error closes the session, the next run opens
+    # it again.
+    #  @param self The object pointer.
+    def Handle(self, request):
+        command = request.get('command', 'run')
+        try:
+            if command == 'run':
+                return self.Run(float(request['amplitude']), int(request['frequency']), int(request.get('tests', 20)))
+            if command == 'status':
+                return self.Status()
+            if command == 'shutdown':
+                self.Close()
+                if self.server is not None:
+                    #shutdown() waits for serve_forever, which is busy serving this request
+                    threading.Thread(target=self.server.shutdown).start()
+                return {'shutdown': True}
+            return {'error': 'Unknown command %r' % command}
+        except (KeyError, ValueError) as e:
+            return {'error': 'Bad request: %s' % e}
+        except Exception as e:
+            self.logger.error('Session aborted: %s', e)
+            try:
+                self.Close()
+            except Exception:
+                self.ready = False
+            return {'error': str(e)}
+
+    ## Documentation for Serve method.
+    #
+    # Opens the session and serves requests on host:port until a shutdown request arrives.
+    #  @param self The object pointer.
+    def Serve(self, port=DEFAULT_PORT, host='127.0.0.1'):
+        self.Open()
+        socketserver.TCPServer.allow_reuse_address = True
+        self.server = socketserver.TCPServer((host, port), SessionHandler)
+        self.server.session = self
+        print ("Session daemon listening on %s:%d" % self.server.server_address[:2])
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.Close()
+
+
+## Documentation for the SessionHandler class.
+#
+#  This class reads JSON requests from one client connection and answers each with one JSON line
+class SessionHandler(socketserver.StreamRequestHandler):
+
+    ## Documentation for handle method.
+    #  @param self The object pointer.
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                reply = self.server.session.Handle(request) if isinstance(request, dict) else {'error': 'Bad request'}
+            except ValueError as e:
+                reply = {'error': 'Bad request: %s' % e}
+            self.wfile.write(json.dumps(reply).encode('ascii') + b'\n')
+            if reply.get('shutdown'):
+                return
+
+
+## Documentation for a function.
+#
+# Sends one request to a session daemon and returns its reply dict
+def RequestSession(request, port=DEFAULT_PORT, host='127.0.0.1', timeout=None):
+    with socket.create_connection((host, port), timeout=timeout) as connection:
+        connection.sendall(json.dumps(request).encode('ascii') + b'\n')
+        reply = connection.makefile('rb').readline()
+    if not reply:
+        raise IOError('No reply from the session daemon')
+    return json.loads(reply)
+
+
+## Documentation for a function.
+#
+# Parses the arguments and either serves the session or sends it one request
+def main():
+
+    parser = argparse.ArgumentParser(description="Keeps the serial sessions open and serves test runs over a local socket")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="Local TCP port of the daemon, default %d" % DEFAULT_PORT)
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="Open the serial sessions and serve test runs")
+    serve.add_argument("dutCOM", type=str, help=          "COM port of the DUT e.g. 'COM7' or '/dev/ttyUSB0'")
+    serve.add_argument("dutBaud", type=int, help=         "Baudrate of the DUT e.g. '115200'")
+    serve.add_argument("uCOM", type=str, help=            "COM port of the Controller e.g. 'COM8' or '/dev/ttyUSB1'")
+    serve.add_argument("uBaud", type=int, help=           "Baudrate of the Controller e.g. '9600'")
+    serve.add_argument("-c", "--channels", type=int, default=2, help="Number of ADC channels reported by the DUT, default 2")
+    serve.add_argument("-t", "--timeout", type=float, default=10, help="Seconds to wait for each DUT frame, default 10")
+    run = commands.add_parser("run", help="Run tests on the daemon's session")
+    run.add_argument("Amplitude", type=float, help=       "Amplitude of sinewave from 0-0.5 e.g. '0.5'")
+    run.add_argument("Frequency", type=int, help=         "Frequency of the Sine wave e.g. '50'")
+    run.add_argument("-m", "--maxtest", type=int, default=20, help="Amount of tests to run, default 20")
+    commands.add_parser("status", help="Print the session state")
+    commands.add_parser("shutdown", help="Close the serial sessions and stop the daemon")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        results = ResultsSink(ADC_Test.LOGFILENAME).Start()
+        try:
+            SessionDaemon(args.dutCOM, args.dutBaud, args.uCOM, args.uBaud, args.channels, args.timeout).Serve(args.port)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            results.Stop()
+    elif args.command == "run":
+        reply = RequestSession({'command': 'run', 'amplitude': args.Amplitude, 'frequency': args.Frequency,
+                                'tests': args.maxtest}, args.port)
+        if 'error' in reply:
+            print ("Error: " + reply['error'])
+            sys.exit(2)
+        for channel, rate in enumerate(reply['pass_rate']):
+            print ("Channel %d: %d/%d passed (%.1f%%)" % (channel+1, reply['passed'][channel], reply['tests'], rate))
+        print ("%d tests in %.3f s" % (reply['tests'], reply['elapsed']))
+        if any(count < reply['tests'] for count in reply['passed']):
+            sys.exit(1)
+    elif args.command in ("status", "shutdown"):
+        print (json.dumps(RequestSession({'command': args.command}, args.port), indent=2))
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+## @package ADC_Simulator
+#
+# Purpose: Simulates the controller and DUT boards on pseudo-terminals for offline load and regression testing
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The DUTSimulator opens one pseudo-terminal for the controller and one for the DUT. The controller side accepts the
+#  '2,<amp>,<freq>\r' command and acknowledges it with one line. The DUT side streams one
+#  'header,channel,mean,min,max' line per channel at a configurable rate. The readings are the expected ADC counts
+#  for the current controller amplitude, from ExpectedValueEngine, with gaussian noise added. Until the first command
+#  arrives the DUT reports the bare DC offset, like a board that is powered but not stimulated.
+#
+#  Sent 'RAW,<blockSize>\r' on its own port, the DUT streams raw sample blocks of the sine wave instead, at
+#  sampleRate samples per second and channel, as 'RAW,channel,s1,...,sN' lines (see ADC_Capture). 'RAW,0\r' returns
+#  to the normal reports. A share of third harmonic can be mixed in to exercise the THD measurement.
+#
+#  Given a FrequencyModelEngine (--cutoff), the readings follow the anti-alias filter of the DUT, e.g. the peaks
+#  shrink towards Frequencies.Max.
+#
+#  Every channel can have its own gain and offset error, like a real board, so calibration runs have something to fit.
+#
+#  The controller can answer each command after a fixed latency, like a slow link or a busy controller. Commands
+#  that arrive back to back are answered latency after each arrival, so pipelined clients see the latency once.
+#
+#  The slave device names work as COM ports, so ADC_Test.py and the other runners run against the simulator
+#  unchanged:
+#    python ADC_Simulator.py --rate 1000
+#    python ADC_Test.py <DUT port> 115200 <Controller port> 9600 0.3 50
+#
+#  Like a UART with nothing attached, the DUT drops lines while no host has the port open. Pause silences the DUT
+#  for a while, to exercise the read timeouts of the runners.
+
+import argparse
+import math
+import os
+import random
+import threading
+import time
+
+from ADC_Expected import ExpectedValueEngine
+
+
+## Documentation for the DUTSimulator class.
+#
+#  This class runs a simulated controller and DUT on a pair of pseudo-terminals
+class DUTSimulator(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param rate DUT reports per second, every report is one line per channel.
+    #  @param noise Standard deviation of the gaussian noise added to each reading, in ADC counts.
+    #  @param channels Number of ADC channels reported by the DUT.
+    #  @param header Header field of every DUT line.
+    #  @param engine ExpectedValueEngine the readings are derived from.
+    #  @param seed Seed for the noise generator, for repeatable runs.
+    #  @param sampleRate Raw samples per second and channel in capture mode.
+    #  @param distortion Amplitude of the third harmonic in raw samples, as a fraction of the fundamental.
+    #  @param latency Seconds between a controller command arriving and its reply.
+    #  @param gains Gain error of every channel, a single value applies to all channels.
+    #  @param offsets Offset error of every channel in ADC counts, a single value applies to all channels.
+    def __init__(self, rate=1.0, noise=2.0, channels=2, header='ADC', engine=None, seed=None, sampleRate=10000, distortion=0.0,
+                 latency=0.0, gains=None, offsets=None):
+        self.rate     = rate
+        self.noise    = noise
+        self.channels = channels
+        self.header   = header
+        self.engine   = engine if engine is not None else ExpectedValueEngine()
+        self.random   = random.Random(seed)
+        self.fAmp     = 0.0
+        self.freq     = 0
+        self.commands = 0
+        self.sampleRate = sampleRate
+        self.distortion = distortion
+        self.latency    = latency
+        self.gains      = self._PerChannel(gains, 1.0)
+        self.offsets    = self._PerChannel(offsets, 0.0)
+        self.rawBlock   = 0
+        self.rawSample  = 0
+        self.linesSent    = 0
+        self.linesDropped = 0
+        self._pauseUntil  = 0.0
+        self._stop    = threading.Event()
+        self._threads = []
+
+    ## Documentation for _PerChannel method.
+    #  @param self The object pointer.
+    def _PerChannel(self, values, default):
+        if values is None:
+            return [default]*self.channels
+        if len(values) == 1:
+            return list(values)*self.channels
+        if len(values) != self.channels:
+            raise ValueError('Expected 1 or %d values, not %d' % (self.channels, len(values)))
+        return list(values)
+
+    ## Documentation for Start method.
+    #
+    # Opens the pseudo-terminals and starts the controller and DUT threads. Returns (dutPort, controllerPort).
+    #  @param self The object pointer.
+    def Start(self):
+        self._dutMaster, self._dutSlave = os.openpty()
+        self._conMaster, self._conSlave = os.openpty()
+        os.set_blocking(self._dutMaster, False)
+        os.set_blocking(self._conMaster, False)
+        self.dutPort        = os.ttyname(self._dutSlave)
+        self.controllerPort = os.ttyname(self._conSlave)
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._RunController, name='Controller simulator'),
+                         threading.Thread(target=self._RunDUT, name='DUT simulator')]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return self.dutPort, self.controllerPort
+
+    ## Documentation for Stop method.
+    #  @param self The object pointer.
+    def Stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        for fd in (self._dutMaster, self._dutSlave, self._conMaster, self._conSlave):
+            os.close(fd)
+
+    ## Documentation for Pause method.
+    #
+    # Stops the DUT reports for seconds, like a board that goes silent. The reports due meanwhile are never sent.
+    #  @param self The object pointer.
+    def Pause(self, seconds):
+        self._pauseUntil = time.monotonic() + seconds
+
+    ## Documentation for Reading method.
+    #
+    # Returns one DUT line for a channel at the current amplitude and frequency.
+    #  @param self The object pointer.
+    def Reading(self, channel):
+        expected = self.engine.Calculate(self.fAmp, self.freq)
+        gauss = self.random.gauss
+        noise = self.noise
+        gain, offset = self.gains[channel-1], self.offsets[channel-1]
+        return '%s,%d,%d,%d,%d\r\n' % (self.header, channel, round(gain*expected.mean + offset + gauss(0, noise)),
+                                       round(gain*expected.peakMin + offset + gauss(0, noise)),
+                                       round(gain*expected.peakMax + offset + gauss(0, noise)))
+
+    ## Documentation for RawBlock method.
+    #
+    # Returns one raw block line for a channel, continuing the waveform where the previous block of the channel
+    # ended. All channels sample the same wave.
+    #  @param self The object pointer.
+    def RawBlock(self, channel, firstSample):
+        engine = self.engine
+        scale = engine.fVrefDAC*engine.fGain/engine.BitRes*self.gains[channel-1]
+        offset = self.offsets[channel-1]
+        step = 2*math.pi*self.freq/float(self.sampleRate)
+        gauss = self.random.gauss
+        noise = self.noise
+        samples = []
+        for index in range(firstSample, firstSample + self.rawBlock):
+            phase = step*index
+            wave = self.fAmp*(math.sin(phase) + self.distortion*math.sin(3*phase)) + engine.fOffsetDC
+            samples.append('%d' % round(wave*scale + offset + gauss(0, noise)))
+        return 'RAW,%d,%s\r\n' % (channel, ','.join(samples))
+
+    ## Documentation for HandleDUTCommand method.
+    #
+    # Applies one command received on the DUT port, only 'RAW,<blockSize>' is understood.
+    #  @param self The object pointer.
+    def HandleDUTCommand(self, command):
+        fields = command.strip().split(',')
+        if fields[0] == 'RAW' and len(fields) == 2 and fields[1].isdigit():
+            self.rawBlock = int(fields[1])
+            self.commands += 1
+
+    ## Documentation for HandleCommand method.
+    #
+    # Applies one controller command and returns the acknowledgement line.
+    #  @param self The object pointer.
+    def HandleCommand(self, command):
+        fields = command.strip().split(',')
+        try:
+            if fields[0] != '2' or len(fields) != 3:
+                raise ValueError(command)
+            self.fAmp = float(fields[1])
+            self.freq = int(fields[2])
+        except ValueError:
+            return 'ERR\r\n'
+        self.commands += 1
+        return 'OK,%s,%d\r\n' % (self.fAmp, self.freq)
+
+    ## Documentation for _Send method.
+    #
+    # Writes what a non-blocking pty master takes of data and returns the tail left unwritten, b'' once all of it
+    # is written. A line is only ever sent whole, the tail goes out before anything else. Raises OSError when the
+    # port is gone.
+    @staticmethod
+    def _Send(fd, data):
+        try:
+            count = os.write(fd, data)
+        except BlockingIOError:
+            return data
+        return data[count:]
+
+    ## Documentation for _RunController method.
+    #  @param self The object pointer.
+    def _RunController(self):
+        import collections
+        import select
+        pending = b''
+        replies = collections.deque()
+        blocked = False
+        while not self._stop.is_set():
+            wait = 0.1
+            if replies:
+                #A reply the port did not take is retried shortly, not in a busy loop
+                wait = min(wait, max(replies[0][0] - time.monotonic(), 0.01 if blocked else 0))
+            readable, _, _ = select.select([self._conMaster], [], [], wait)
+            if readable:
+                try:
+                    pending += os.read(self._conMaster, 1024)
+                except OSError:
+                    #No host has the port open
+                    time.sleep(0.1)
+                    continue
+                arrival = time.monotonic()
+                pending = pending.replace(b'\n', b'\r')
+                while b'\r' in pending:
+                    command, pending = pending.split(b'\r', 1)
+                    if command:
+                        reply = self.HandleCommand(command.decode('ascii', 'replace'))
+                        replies.append((arrival + self.latency, reply.encode('ascii')))
+            now = time.monotonic()
+            blocked = False
+            while replies and replies[0][0] <= now:
+                due, reply = replies[0]
+                try:
+                    tail = self._Send(self._conMaster, reply)
+                except OSError:
+                    #No host has the port open, the reply is lost
+                    tail = b''
+                if tail:
+                    replies[0] = (due, tail)
+                    blocked = True
+                    break
+                replies.popleft()
+
+    ## Documentation for _RunDUT method.
+    #
+    # Streams DUT reports, or raw blocks in capture mode, on a fixed schedule. When the thread falls behind at high
+    # rates, all reports due are written in one batch. A batch the port only takes part of is finished before the
+    # next one, and the reports due while it is unfinished are dropped, like a DUT whose transmit FIFO is full.
+    #  @param self The object pointer.
+    def _RunDUT(self):
+        nextReport = time.monotonic()
+        pending = b''
+        outgoing = b''
+        while not self._stop.is_set():
+            try:
+                pending += os.read(self._dutMaster, 1024)
+            except (BlockingIOError, OSError):
+                pass
+            pending = pending.replace(b'\n', b'\r')
+            while b'\r' in pending:
+                command, pending = pending.split(b'\r', 1)
+                if command:
+                    self.HandleDUTCommand(command.decode('ascii', 'replace'))
+            if outgoing:
+                try:
+                    outgoing = self._Send(self._dutMaster, outgoing)
+                except OSError:
+                    outgoing = b''
+
+            period = self.rawBlock/float(self.sampleRate) if self.rawBlock else 1.0/self.rate
+            now = time.monotonic()
+            if now < nextReport:
+                self._stop.wait(min(nextReport - now, 0.01))
+                continue
+            due = int((now - nextReport)/period) + 1
+            nextReport += due*period
+            if now < self._pauseUntil:
+                continue
+            if self.rawBlock:
+                block = ''.join(self.RawBlock(channel, self.rawSample + report*self.rawBlock)
+                                for report in range(due) for channel in range(1, self.channels+1))
+                self.rawSample += due*self.rawBlock
+            else:
+                block = ''.join(self.Reading(channel) for _ in range(due) for channel in range(1, self.channels+1))
+            if outgoing:
+                self.linesDropped += due*self.channels
+                continue
+            try:
+                outgoing = self._Send(self._dutMaster, block.encode('ascii'))
+                self.linesSent += due*self.channels
+            except OSError:
+                self.linesDropped += due*self.channels
+
+
+## Documentation for a function.
+#
+# Starts the simulator and runs it until Ctrl-C
+def main():
+
+    parser = argparse.ArgumentParser(description="Simulates the controller and DUT on pseudo-terminals.\n"
+                                                 "Run ADC_Test.py with the printed ports.")
+    parser.add_argument("-r", "--rate", type=float, default=1.0, help= "DUT reports per second, default 1")
+    parser.add_argument("-n", "--noise", type=float, default=2.0, help="Standard deviation of the reading noise in ADC counts, default 2")
+    parser.add_argument("-c", "--channels", type=int, default=2, help= "Number of ADC channels, default 2")
+    parser.add_argument("--seed", type=int, help=                      "Seed for the noise generator")
+    parser.add_argument("--samplerate", type=int, default=10000, help= "Raw samples per second and channel in capture mode, default 10000")
+    parser.add_argument("--distortion", type=float, default=0.0, help= "Third harmonic in raw samples as a fraction of the fundamental, default 0")
+    parser.add_argument("--latency", type=float, default=0.0, help=    "Seconds before the controller answers a command, default 0")
+    parser.add_argument("--cutoff", type=float, help=                  "Model a DUT anti-alias filter with this -3 dB frequency in Hz, see ADC_FrequencyModel")
+    parser.add_argument("--filterorder", type=int, default=1, help=    "Order of the --cutoff filter, default 1")
+    parser.add_argument("--gain", type=float, nargs="+", help=         "Gain error of every channel, or one for all, default 1")
+    parser.add_argument("--offset", type=float, nargs="+", help=       "Offset error of every channel in ADC counts, or one for all, default 0")
+    args = parser.parse_args()
+
+    engine = None
+    if args.cutoff:
+        from ADC_FrequencyModel import FrequencyModelEngine
+        engine = FrequencyModelEngine(args.samplerate, args.cutoff, args.filterorder)
+    simulator = DUTSimulator(args.rate, args.noise, args.channels, engine=engine, seed=args.seed, sampleRate=args.samplerate,
+                             distortion=args.distortion, latency=args.latency, gains=args.gain, offsets=args.offset)
+    dutPort, controllerPort = simulator.Start()
+    print ("DUT Serial Port:        " + dutPort)
+    print ("Controller Serial Port: " + controllerPort)
+    print ("e.g. python ADC_Test.py %s 115200 %s 9600 0.3 50" % (dutPort, controllerPort))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    simulator.Stop()
+    print ("%d commands, %d lines sent, %d dropped" % (simulator.commands, simulator.linesSent, simulator.linesDropped))
+
+if __name__ == "__main__":
+    main()
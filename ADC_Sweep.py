@@ -0,0 +1,118 @@
+## @package ADC_Sweep
+#
+# Purpose: Plans amplitude x frequency sweeps and precomputes the expected ADC counts for every grid point
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  Boards are qualified across the whole Amplitudes.Min..Max x Frequencies.Min..Max envelope. The SweepPlanner
+#  builds the grid and evaluates the DAC sine model for all points in one NumPy pass, using the configuration of an
+#  ExpectedValueEngine. The resulting SweepTable holds the expected counts and pass windows per grid point, so the
+#  test loop only has to look them up.
+
+import numpy as np
+
+from ADC_Expected import ExpectedValueEngine
+
+
+## Documentation for the SweepTable class.
+#
+#  This class holds the precomputed expected ADC counts and tolerance windows of a sweep grid
+class SweepTable(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param amplitudes 1D array of grid amplitudes.
+    #  @param frequencies 1D array of grid frequencies.
+    #  @param expected Integer array of shape (amplitudes, frequencies, 3) holding the mean, min and max counts.
+    #  @param tolerance Pass window either side of the expected counts.
+    def __init__(self, amplitudes, frequencies, expected, tolerance):
+        self.amplitudes  = amplitudes
+        self.frequencies = frequencies
+        self.expected    = expected
+        self.limits      = np.stack((expected - tolerance, expected + tolerance), axis=-1)
+        #Plain python lookup table so the test loop does not touch NumPy per iteration
+        self._lookup = {}
+        limits = self.limits.tolist()
+        for iAmp, fAmp in enumerate(amplitudes.tolist()):
+            for iFreq, freq in enumerate(frequencies.tolist()):
+                self._lookup[(fAmp, freq)] = tuple(tuple(window) for window in limits[iAmp][iFreq])
+
+    ## Documentation for Points method.
+    #
+    # Returns the (amplitude, frequency) grid points in sweep order: amplitude outer, frequency inner.
+    #  @param self The object pointer.
+    def Points(self):
+        return [(fAmp, freq) for fAmp in self.amplitudes.tolist() for freq in self.frequencies.tolist()]
+
+    ## Documentation for Lookup method.
+    #
+    # Returns the ((Min, Max) mean, (Min, Max) min, (Min, Max) max) windows for one grid point, in the same form
+    # as ExpectedValueEngine.Limits.
+    #  @param self The object pointer.
+    def Lookup(self, fAmp, freq):
+        return self._lookup[(fAmp, freq)]
+
+    ## Documentation for __len__ method.
+    #  @param self The object pointer.
+    def __len__(self):
+        return len(self._lookup)
+
+
+## Documentation for the SweepPlanner class.
+#
+#  This class evaluates the expected ADC counts of a whole amplitude x frequency grid in one vectorized pass
+class SweepPlanner(object):
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param engine ExpectedValueEngine providing the DAC/ADC configuration.
+    def __init__(self, engine=None):
+        self.engine = engine if engine is not None else ExpectedValueEngine()
+
+    ## Documentation for Grid method.
+    #
+    # Returns evenly spaced amplitude and frequency axes covering the given ranges. Frequencies are whole Hz as
+    # the controller command only accepts integers.
+    #  @param self The object pointer.
+    def Grid(self, ampMin, ampMax, ampSteps, freqMin, freqMax, freqSteps):
+        amplitudes  = np.round(np.linspace(ampMin, ampMax, ampSteps), 4)
+        frequencies = np.unique(np.round(np.linspace(freqMin, freqMax, freqSteps)).astype(int))
+        return amplitudes, frequencies
+
+    ## Documentation for Expected method.
+    #
+    # Returns an integer array of shape (len(amplitudes), 3) with the expected mean, min and max ADC counts.
+    # Mirrors ADC_Expected.CalculateExpectedADC, including its summation over samples 1..iMaxSamples-1.
+    #  @param self The object pointer.
+    def Expected(self, amplitudes):
+        engine = self.engine
+        iMaxSamples = engine.iMaxSamples
+        step = (2*np.pi)/iMaxSamples
+        fAmp = np.asarray(amplitudes, dtype=float)[:, np.newaxis]
+
+        sine = np.sin(np.arange(1, iMaxSamples)*step)
+        peaks = np.sin(np.array([(iMaxSamples*3//4)*step, (iMaxSamples//4)*step]))
+
+        fDACValMean = (fAmp*sine + engine.fOffsetDC).sum(axis=1)/iMaxSamples
+        fDACPeaks   = fAmp*peaks + engine.fOffsetDC
+        fDACVals    = np.column_stack((fDACValMean, fDACPeaks))
+
+        #int() in the scalar model truncates towards zero
+        return np.trunc(fDACVals*engine.fVrefDAC*engine.fGain/engine.BitRes).astype(np.int64)
+
+    ## Documentation for BuildTable method.
+    #
+    # Computes the SweepTable for every combination of the given amplitudes and frequencies.
+    #  @param self The object pointer.
+    def BuildTable(self, amplitudes, frequencies):
+        amplitudes  = np.asarray(amplitudes, dtype=float)
+        frequencies = np.asarray(frequencies)
+        if self.engine.frequencyAware:
+            expected = self.engine.Table(amplitudes, frequencies)
+        else:
+            expected = self.Expected(amplitudes)
+            #The DAC table model does not depend on frequency, broadcast it across the frequency axis
+            expected = np.broadcast_to(expected[:, np.newaxis, :], (len(amplitudes), len(frequencies), 3))
+        return SweepTable(amplitudes, frequencies, expected, self.engine.tolerance)
@@ -20,19 +20,33 @@
 #  That device then samples the waveform and returns 3 values, the average ADC count, the minimum, the maximum. 
 #  The script then checks whether the returned values are accurate according to the input waveform.
 #  This test runs continously through a specified amount of iterations.
+#
+#  numpy, pyserial and logging with the results log are imported by the functions that use them, not here. Together
+#  they make up most of the start up time, which --help, --dry-run and a mistyped argument no longer pay for.
+#    python ADC_Test.py /dev/ttyUSB0 115200 /dev/ttyUSB1 9600 0.3 50 --dry-run
+#  validates the arguments and prints the expected ADC values without opening a port.
 
 import argparse
 from argparse import RawTextHelpFormatter
 from enum import Enum
-import serial
-import logging
 import time
-import math
+import collections
+from ADC_Expected import ExpectedValueEngine
+from ADC_FrameParser import FrameParser, ParseLine, ReportAssembler
+from ADC_ResultsStore import ResultsStore, PASS_MEAN, PASS_MIN, PASS_MAX, NO_FRAME
+from ADC_Scheduler import FixedScheduler, AdaptiveScheduler
+from ADC_Pipeline import EncodeSetpoint
+from ADC_Replay import TrafficRecorder, TrafficReplay, ReplayEnded
 
 
 MAJOR = 1
 MINOR = 0
 
+LOGFILENAME = 'SamplingEngine_Results.log'
+
+#Weights turning the mean/min/max pass flags of a channel into ResultsStore pass bits
+_PASS_BIT_WEIGHTS = (PASS_MEAN, PASS_MIN, PASS_MAX)
+
 class Amplitudes(Enum):
     Max = 0.43
     Min = 0.0
@@ -52,8 +66,10 @@ class Frequencies(Enum):
 class InputParse(object):
     
     ## The constructor.
+    #
+    # Prints nothing, the banners of main() only follow once the arguments are valid.
     def __init__(self):
-        print ("InputParse Initialised")
+        pass
 
     ## Documentation for the GetInput method.
     #
@@ -83,12 +99,108 @@ class InputParse(object):
         parser.add_argument("dutBaud", type=int, help=          "Baudrate of the DUT e.g. '115200'")
         parser.add_argument("uCOM", type=str, help=             "COM port of the Controller e.g. 'COM8' or '/dev/ttyUSB1'")
         parser.add_argument("uBaud", type=int, help=            "Baudrate of the Controller e.g. '9600'")
-        parser.add_argument("Amplitude", type=float, help=        "Amplitude of sinewave from 0-0.5 e.g. '0.5'")
-        parser.add_argument("Frequency", type=int, help=        "Frequency of the Sine wave e.g. '50'")
+        parser.add_argument("Amplitude", type=float, nargs="?", help= "Amplitude of sinewave from 0-0.5 e.g. '0.5', not used with --sweep")
+        parser.add_argument("Frequency", type=int, nargs="?", help=   "Frequency of the Sine wave e.g. '50', not used with --sweep")
         parser.add_argument("-i", "--interval", type=int, help= "Interval between Tests")
         parser.add_argument("-m", "--maxtest", type=int, help=   "Maximum amount of tests to run")
+        parser.add_argument("-s", "--sweep", action="store_true", help="Run the tests at every point of an amplitude x frequency grid\n"
+                                                                      "covering the Amplitudes and Frequencies ranges")
+        parser.add_argument("--ampsteps", type=int, default=10, help= "Number of amplitude points in a sweep, default 10")
+        parser.add_argument("--freqsteps", type=int, default=10, help="Number of frequency points in a sweep, default 10")
+        parser.add_argument("-a", "--asyncio", action="store_true", help="Use the asyncio serial transport, tests follow the DUT\n"
+                                                                        "instead of a fixed interval")
+        parser.add_argument("-t", "--timeout", type=float, default=10, help="Deadline in seconds for each serial read with --asyncio or\n"
+                                                                           "--adaptive, default 10")
+        parser.add_argument("--adaptive", action="store_true", help=      "Start the next test as soon as the DUT results arrive instead of\n"
+                                                                           "waiting the --interval")
+        parser.add_argument("--minperiod", type=float, default=0.0, help= "Minimum seconds between test starts with --adaptive, default 0")
+        parser.add_argument("-c", "--channels", type=int, default=2, help="Number of ADC channels reported by the DUT, default 2")
+        parser.add_argument("-q", "--quiet", action="store_true", help=   "Do not print every serial Tx/Rx and test result to stdout")
+        parser.add_argument("--flush", type=float, default=1.0, help=      "Seconds between writes of the results log, default 1")
+        parser.add_argument("--queue", type=int, default=10000, help=      "Maximum number of results waiting to be written, default 10000")
+        parser.add_argument("--store", type=str, help=                     "Also append the raw readings of every test to this binary results file,\n"
+                                                                           "read it back with ADC_ResultsStore.LoadResults")
+        parser.add_argument("--earlystop", type=float, help=               "Stop testing a channel once its pass rate is shown to be above or below\n"
+                                                                           "EARLYSTOP percent, maxtest is the most tests run")
+        parser.add_argument("--rule", choices=["sprt", "wilson"], default="sprt", help="Stopping rule of --earlystop, default sprt")
+        parser.add_argument("--confidence", type=float, default=0.95, help="Confidence of the --earlystop decisions, default 0.95")
+        parser.add_argument("--margin", type=float, default=2.5, help=     "Pass rate in percent either side of the threshold the sprt rule may\n"
+                                                                           "not tell apart, default 2.5")
+        parser.add_argument("--drift", type=int, help=                     "Keep the last DRIFT tests of every channel, log their rolling mean, standard\n"
+                                                                           "deviation and pass rate and a CUSUM drift alarm once the readings or the pass\n"
+                                                                           "rate move away from the first DRIFT tests")
+        parser.add_argument("--driftlimit", type=float, default=8.0, help="CUSUM threshold of --drift in standard deviations, default 8")
+        parser.add_argument("--capture", action="store_true", help=        "Capture raw sample blocks from the DUT instead of testing, maxtest is the\n"
+                                                                           "number of blocks per channel. Logs running mean/min/max/RMS, SNR and THD")
+        parser.add_argument("--blocksize", type=int, default=256, help=    "Samples per raw block with --capture, default 256")
+        parser.add_argument("--samplerate", type=float, default=10000, help="DUT sample rate in Hz with --capture and --freqmodel, default 10000")
+        parser.add_argument("--ring", type=int, default=4096, help=        "Samples per channel in the spectrum of --capture, default 4096")
+        parser.add_argument("--stats", type=float, help=                   "Time the serial reads and writes, RunTest and the logging calls and print\n"
+                                                                           "a summary line every STATS seconds, not used with --asyncio")
+        parser.add_argument("--statsport", type=int, help=                 "Also serve the timing counters as JSON on http://127.0.0.1:STATSPORT/")
+        parser.add_argument("--freqmodel", action="store_true", help=      "Expect the readings of a DUT that filters the wave with its anti-alias\n"
+                                                                           "filter and samples it at --samplerate, instead of the bare DAC table")
+        parser.add_argument("--cutoff", type=float, default=1000, help=    "-3 dB frequency in Hz of the DUT anti-alias filter with --freqmodel, default 1000")
+        parser.add_argument("--filterorder", type=int, default=1, help=    "Order of the Butterworth anti-alias filter with --freqmodel, default 1")
+        parser.add_argument("--window", type=int, help=                    "DUT samples per report with --freqmodel, default one second of samples")
+        parser.add_argument("--calibrate", action="store_true", help=      "Fit the gain and offset of every channel at --calpoints amplitudes before\n"
+                                                                           "testing, save them to --calfile and test against the calibrated windows")
+        parser.add_argument("--calibrated", action="store_true", help=     "Test against the calibration of the board saved in --calfile")
+        parser.add_argument("--board", type=str, help=                     "Name of the board in --calfile, e.g. its serial number, default the DUT port")
+        parser.add_argument("--calfile", type=str, default="ADC_Calibration.json", help="Calibration file, default ADC_Calibration.json")
+        parser.add_argument("--calpoints", type=int, default=5, help=      "Number of amplitudes of a --calibrate run, default 5")
+        parser.add_argument("--caltests", type=int, default=10, help=      "Tests per amplitude of a --calibrate run, default 10")
+        parser.add_argument("--record", type=str, help=                    "Record every byte sent to and received from the controller and the DUT,\n"
+                                                                           "with its time, to this capture file")
+        parser.add_argument("--replay", type=str, help=                    "Replay a capture file written with --record instead of opening the ports,\n"
+                                                                           "as fast as possible. The ports given are not used")
+        parser.add_argument("--realtime", action="store_true", help=       "Replay the capture with its recorded timing")
+        parser.add_argument("-n", "--dry-run", action="store_true", help=  "Validate the arguments and print the expected ADC values, then exit\n"
+                                                                           "without opening any port")
     
         args = parser.parse_args()
+        if not args.sweep and (args.Amplitude is None or args.Frequency is None):
+            parser.error("Amplitude and Frequency are required unless --sweep is given")
+        if args.channels < 1:
+            parser.error("--channels must be at least 1")
+        if args.ampsteps < 1 or args.freqsteps < 1:
+            parser.error("--ampsteps and --freqsteps must be at least 1")
+        if args.calibrate and args.calibrated:
+            parser.error("--calibrate already tests against the new calibration, --calibrated is not needed")
+        if args.record and args.replay:
+            parser.error("--record and --replay cannot be used together")
+        if args.realtime and not args.replay:
+            parser.error("--realtime needs --replay")
+        if (args.record or args.replay) and args.asyncio:
+            parser.error("--record and --replay do not support --asyncio")
+        if args.capture and (args.sweep or args.asyncio):
+            parser.error("--capture runs no tests, it cannot be used with --sweep or --asyncio")
+        if args.earlystop is not None and (args.sweep or args.asyncio or args.capture):
+            parser.error("--earlystop is only supported by the test loop, not with --sweep, --asyncio or --capture")
+        if args.earlystop is not None and not 0 < args.earlystop < 100:
+            parser.error("--earlystop must be above 0 and below 100")
+        if not 0 < args.confidence < 1:
+            parser.error("--confidence must be above 0 and below 1")
+        if args.margin <= 0:
+            parser.error("--margin must be above 0")
+        if args.store and args.capture:
+            parser.error("--store keeps test results, --capture runs no tests")
+        if args.drift is not None and (args.sweep or args.asyncio or args.capture):
+            parser.error("--drift is only supported by the test loop, not with --sweep, --asyncio or --capture")
+        if args.drift is not None and args.drift < 2:
+            parser.error("--drift must be at least 2")
+        if (args.stats is not None or args.statsport is not None) and args.asyncio:
+            parser.error("--stats and --statsport time the blocking serial calls, they are not supported with --asyncio")
+        if args.stats is not None and args.stats <= 0:
+            parser.error("--stats must be above 0")
+        if args.capture and args.Frequency:
+            #numpy is only needed for captures
+            from ADC_Capture import MinimumRingSize
+            if args.ring < MinimumRingSize(args.Frequency, args.samplerate):
+                parser.error("--ring must be at least %d samples to resolve %d Hz at --samplerate %g" %
+                             (MinimumRingSize(args.Frequency, args.samplerate), args.Frequency, args.samplerate))
+        if args.calibrate and args.calpoints < 2:
+            parser.error("--calpoints must be at least 2")
         return args.dutCOM, args.dutBaud, args.uCOM, args.uBaud, args.Amplitude, args.Frequency
 
 ## Documentation for the SerialConnecter class.
@@ -97,26 +209,55 @@ class InputParse(object):
 class SerialConnecter(object):
     
     ## The constructor.
-    def __init__(self):
+    #  @param verbose Print every serial Tx/Rx to stdout.
+    #  @param openPort Callable returning an open serial port for (port, baud, timeout), serial.Serial by default.
+    def __init__(self, verbose=True, openPort=None):
+        self.verbose = verbose
+        self.openPort = openPort if openPort is not None else self._OpenSerial
+        #Clock of the DUT read deadlines, a replay of recorded traffic runs on the recorded time
+        self.clock = time.monotonic
         print ("SerialConnecter Initialised")
 
+    ## Documentation for _OpenSerial method.
+    @staticmethod
+    def _OpenSerial(port, baud, timeout):
+        import serial
+        return serial.Serial(port, baud, timeout=timeout)
+
     ## Documentation for openSerialPortCON method.
+    #
+    # Opens the controller port, uC_PORT and uC_BAUD unless a port is given.
     #  @param self The object pointer.
-    def openSerialPortCON(self):
-        self.ser1 = serial.Serial(uC_PORT, uC_BAUD, timeout=10)
+    def openSerialPortCON(self, port=None, baud=None):
+        self.ser1 = self.openPort(port if port is not None else uC_PORT, baud if baud is not None else uC_BAUD, 10)
         print ("Controller Serial Port: Open") 
 
     ## Documentation for openSerialPortDUT method.
+    #
+    # Opens the DUT port, DUT_PORT and DUT_BAUD unless a port is given.
     #  @param self The object pointer.
-    def openSerialPortDUT(self):
-        self.ser2 = serial.Serial(DUT_PORT, DUT_BAUD, timeout=10)
+    def openSerialPortDUT(self, port=None, baud=None):
+        self.ser2 = self.openPort(port if port is not None else DUT_PORT, baud if baud is not None else DUT_BAUD, 10)
+        self.parserDUT = FrameParser()
+        self.framesDUT = collections.deque()
+        self.reportDUT = ReportAssembler()
         print ("DUT Serial Port: Open") 
 
+    ## Documentation for Encode method.
+    #
+    # pyserial writes bytes, commands built as strings are sent as ASCII
+    @staticmethod
+    def Encode(command):
+        if isinstance(command, str):
+            command = command.encode('ascii')
+        return command
+
     ## Documentation for SendSerialCON method.
     #  @param self The object pointer.
     def SendSerialCON(self,command, getline=False):
-        print ("Controller Serial Port Tx: ", command)
-        self.ser1.write(command)
+        if self.verbose:
+            print ("Controller Serial Port Tx: ", command)
+        self.ser1.write(self.Encode(command))
         data = ''
         if getline:
             data=self.ReadLine()
@@ -125,8 +266,9 @@ class SerialConnecter(object):
     ## Documentation for SendSerialDUT method.
     #  @param self The object pointer.
     def SendSerialDUT(self,command, getline=False):
-        print ("DUT Serial Port Tx: ", command)
-        self.ser2.write(command)
+        if self.verbose:
+            print ("DUT Serial Port Tx: ", command)
+        self.ser2.write(self.Encode(command))
         data = ''
         if getline:
             data=self.ReadLine()
@@ -136,16 +278,69 @@ class SerialConnecter(object):
     #  @param self The object pointer.
     def ReadSerialPortLineCON(self):
         data = self.ser1.readline()
-        print ("Controller Serial Port Rx: ", data)
+        if self.verbose:
+            print ("Controller Serial Port Rx: ", data)
         return data
 
     ## Documentation for ReadSerialPortLineDUT method.
     #  @param self The object pointer.
     def ReadSerialPortLineDUT(self):
         data = self.ser2.readline()
-        print ("DUT Serial Port Rx: ", data)
+        if self.verbose:
+            print ("DUT Serial Port Rx: ", data)
         return data    
 
+    ## Documentation for ReadFrameDUT method.
+    #
+    # Returns the next DUTFrame from the DUT port, or None if no valid frame arrived within the port timeout.
+    # Malformed lines are skipped and counted by parserDUT.
+    #  @param self The object pointer.
+    def ReadFrameDUT(self):
+        deadline = self.clock() + self.ser2.timeout
+        while not self.framesDUT:
+            self.framesDUT.extend(self.parserDUT.ReadFrom(self.ser2))
+            if not self.framesDUT and self.clock() >= deadline:
+                print ("DUT Serial Port Rx: timeout, %d malformed lines so far" % self.parserDUT.malformed)
+                return None
+        frame = self.framesDUT.popleft()
+        if self.verbose:
+            print ("DUT Serial Port Rx: ", frame)
+        return frame
+
+    ## Documentation for ReadReportDUT method.
+    #
+    # Reads one DUT report into frames, one entry per channel, placed by the channel number of each frame. A channel
+    # whose line was lost, malformed or timed out is left None. The report ends at its last channel, or at a frame
+    # of a channel already read, which is kept for the next report, so the reads stay on the report boundaries.
+    #  @param self The object pointer.
+    def ReadReportDUT(self, frames):
+        complete = self.reportDUT.Start(frames)
+        while not complete:
+            frame = self.ReadFrameDUT()
+            if frame is None:
+                break
+            complete = self.reportDUT.Add(frames, frame)
+        return frames
+
+    ## Documentation for ResyncDUT method.
+    #
+    # Drops the DUT reports received so far, e.g. at the previous setpoint, and reads up to the last channel of the
+    # next report, so the next ReadReportDUT starts with channel 1 of a fresh report. The first frame read could be a
+    # line cut by the reset. Returns False if the DUT sent nothing within the port timeout.
+    #  @param self The object pointer.
+    #  @param channels Number of ADC channels reported by the DUT.
+    def ResyncDUT(self, channels):
+        self.ser2.reset_input_buffer()
+        self.framesDUT.clear()
+        self.parserDUT.Reset()
+        self.reportDUT.Reset()
+        while True:
+            frame = self.ReadFrameDUT()
+            if frame is None:
+                return False
+            if frame.channel == channels:
+                return True
+
     ## Documentation for CloseSerialPortCON method.
     #  @param self The object pointer.
     def CloseSerialPortCON(self):
@@ -164,7 +359,18 @@ class SerialConnecter(object):
 class SamplingTest(object):
 
     ## The constructor.
-    def __init__(self):
+    #  @param verbose Print the progress of every test to stdout.
+    #  @param channels Number of ADC channels reported by the DUT.
+    def __init__(self, verbose=True, channels=2):
+        import numpy as np
+        from ADC_TestResult import ResultPool
+        self.verbose  = verbose
+        self.channels = channels
+        #Preallocated result records, filled in turn by every test
+        self.pool = ResultPool(channels)
+        self.lastResult = None
+        self.passBitWeights = np.array(_PASS_BIT_WEIGHTS, dtype=np.uint8)
+        self._limitsKey = None
         print ("SamplingTest Initialised")
 
     ## Documentation for RunTest method.
@@ -176,207 +382,124 @@ class SamplingTest(object):
     # The returned values are then evaluated against expected results.
     # if the values returned are as expected then the test is a success, if any values fall outside of tolerance then the test is a fail 
     #  @param self The object pointer.
-    def RunTest(self):
-
-        #Local Variables------------------------------------------------------------------------
-        #DUT ADC Configuration
-        fGain       = 0.17    #Gain value of the ADC = 1/6
-        BitRes      = 0.59    #Bit resolution of the DUT ADC in mV = 0.59  
-        #Controller DAC Configuration
-        fVrefDAC    = 3300    #Voltage reference used in the controller DAC in mV
-        fOffsetDC   = 0.43    #DC offset value in terms of Controller DAC output
-        iSampleDAC  = 1       #Current sample used in DAC
-        iMaxSamples = 100     #Number of samples used by DAC
-        fDacVal     = 0.0     #DAC Voltage
-        #Measurement Variables     
-        fVoltMean   = 0.0     #Represent the mean voltage of the input wave in mV
-        fVoltPkMax  = 0.0     #Represent the maximum peak woltage of the input wave in mV
-        fVoltPkMin  = 0.0     #Represent the maximum peak woltage of the input wave in mV
-        fDACValSum  = 0       #Summation of DAC values used to calculate the mean
-        iADCmean    = 0       #Expected Mean Value for ADC 
-        iADCpeakMin = 0       #Expected Maximum peak Value for ADC
-        iADCpeakMax = 0       #Expected Maximum peak Value for ADC 
-        #flags
-        
-        
-        #-----------------------------------------------------------------------------------------
-        
-        #Define Tolerance dictionaries--------
-        ADCMeanLimits = {
-            'Max': iADCmean + 20,
-            'Min': iADCmean - 20
-        }
-
-        ADCMinLimits = {
-            'Max': iADCpeakMin + 20,
-            'Min': iADCpeakMin - 20
-        }
-
-        ADCMaxLimits = {
-            'Max': iADCpeakMax + 20,
-            'Min': iADCpeakMax - 20
-        }
-        #------------------------------------
-
-        #Extract readings from the DUT Serial port------------------------------------- 
-        #Read DUT data
-        print ("Wait for DUT result")
-        received_data = myConnector.ReadSerialPortLineDUT().rstrip()
-        Header1,ADC_Channel1,ADC_Mean1,ADC_Min1,ADC_Max1=received_data.split(",")
-        ADC_Max1 = ADC_Max1.rstrip()
-        #time.sleep(1)
-        received_data = myConnector.ReadSerialPortLineDUT()
-        Header2,ADC_Channel2,ADC_Mean2,ADC_Min2,ADC_Max2=received_data.split(",")
-        ADC_Max2 = ADC_Max2.rstrip()
-        #Debug Trace---------------------------------------------
-        #print "Header = " + str(Header1)
-        #print "ADC Channel = " + str(ADC_Channel1)
-        #print "ADC Average Count = " + str(ADC_Mean1)
-        #print "ADC Minimum Count = " + str(ADC_Min1)
-        #print "ADC Maximum Count = " + str(ADC_Max1)
-        #print "Header = " + str(Header2)
-        #print "ADC Channel = " + str(ADC_Channel2)
-        #print "ADC Average Count = " + str(ADC_Mean2)
-        #print "ADC Minimum Count = " + str(ADC_Min2)
-        #print "ADC Maximum Count = " + str(ADC_Max2)
-        #-------------------------------------------------------
-        #----------------------------------------------------------------------------
-
-        #Convert input fAmp to Comparable ADC Values
-
-        #Calculate the expected Mean ADC Value----------------------------------------------------------------------------------------------    
-        for iSampleDAC in range(1, iMaxSamples):
-            fDacVal = fAMP*math.sin(iSampleDAC*((2*math.pi)/iMaxSamples)) + fOffsetDC
-            fDACValSum += fDacVal
-        
-        fDACValMean = fDACValSum/iMaxSamples                #Quotient of the sum of DAC samples in DAC units and the number of samples
-        fVoltMean = fDACValMean*fVrefDAC                    #Convert DAC values to voltage in mV  
-        iADCmean  = fVoltMean*fGain/BitRes                  #Convert the mean value in voltage to DUT comparable ADC value
-        iADCmean  = int(iADCmean)                           #Should be an int
-    
-        #Debug Trace-------------------------------------------------------------
-        #print "Average Value from DAC:                      " + str(fDACValMean)    
-        #print "Average mV Value from DAC:                   " + str(fVoltMean) 
-        #print "Expected Average Voltage Value from DUT ADC: " + str(iADCmean)
-        #------------------------------------------------------------------------
-
-        #-----------------------------------------------------------------------------------------------------------------------------------
-
-        #Calculate the expected Min ADC Value---------------------------------------------------------------------------------------------- 
-        fDacVal = fAMP*math.sin(75*((2*math.pi)/iMaxSamples)) + fOffsetDC   #The lowest value from the DAC in DAC units
-        fVoltPkMin = fDacVal*fVrefDAC                                       #Convert DAC values to voltage in mV 
-        iADCpeakMin  = fVoltPkMin*fGain/BitRes                              #Convert the mean value in voltage to DUT comparable ADC value
-        iADCpeakMin  = int(iADCpeakMin)                                     #Convert to an int  
-
-        #Debug Trace-------------------------------------------------
-        #print "Min Value from DAC:   " + str(fDacVal)
-        #print "Min Value in mV:      " + str(fVoltPkMin)
-        #print "Expected Min Value in ADC Val: " + str(iADCpeakMin)
-        #-------------------------------------------------------------
-        #----------------------------------------------------------------------------------------------------------------------------------
-
-        #Calculate the expected Max ADC Value---------------------------------------------------------------------------------------------- 
-        fDacVal = fAMP*math.sin(25*((2*math.pi)/iMaxSamples)) + fOffsetDC   #The highest value from the DAC in DAC units
-        fVoltPkMax = fDacVal*fVrefDAC                                       #Convert DAC values to voltage in mV
-        iADCpeakMax  = fVoltPkMax*fGain/BitRes                               #Convert the mean value in voltage to DUT comparable ADC value
-        iADCpeakMax  = int(iADCpeakMax)                                     #Convert to an int
-  
-        #Debug Trace--------------------------------------
-        #print "Max Value from DAC:   " + str(fDacVal)
-        #print "Max Value in mV:      " + str(fVoltPkMax)
-        #print "Expected Max Value in ADC Val: " + str(iADCpeakMax)
-        #-------------------------------------------------
-        #-----------------------------------------------------------------------------------------------------------------------------------
-
-        #Set the pass/fail tolerances from the expected values---------------------------------
-        #limits for the average ADC Value
-        ADCMeanLimits['Max'] = iADCmean + 20
-        ADCMeanLimits['Min'] = iADCmean - 20
-
-        #limits for the minimum ADC Value
-        ADCMinLimits['Max'] = iADCpeakMin + 20
-        ADCMinLimits['Min'] = iADCpeakMin - 20
-
-        #limits for the maximum ADC Value
-        ADCMaxLimits['Max'] = iADCpeakMax + 20
-        ADCMaxLimits['Min'] = iADCpeakMax - 20
-        #--------------------------------------------------------------------------------------
-
-
-        #Evaluate the values from readings against the expected values-----------
-        #Check pass/fail for all 6 parameters
-        #Channel 1
-        #Channel1 Mean
-        if int(ADC_Mean1) <=  ADCMeanLimits['Max'] and int(ADC_Mean1) >= ADCMeanLimits['Min']:
-            passADC1mean = True
-            
-        else:
-            passADC1mean = False
-        #Channel1 Min
-        if int(ADC_Min1) <=  ADCMinLimits['Max'] and int(ADC_Min1) >= ADCMinLimits['Min']:
-            passADC1min = True
-            
-        else:
-            passADC1min = False
-        #Channel1 Max
-        if int(ADC_Max1) <=  ADCMaxLimits['Max'] and int(ADC_Max1) >= ADCMaxLimits['Min']:
-            passADC1max = True
-            
-        else:
-            passADC1max = False
-        #Channel 2
-        #Channel2 Mean
-        if int(ADC_Mean2) <=  ADCMeanLimits['Max'] and int(ADC_Mean2) >= ADCMeanLimits['Min']:
-            passADC2mean = True
-            
-        else:
-            passADC2mean = False
-        #Channel2 Min
-        if int(ADC_Min2) <=  ADCMinLimits['Max'] and int(ADC_Min2) >= ADCMinLimits['Min']:
-            passADC2min = True
-            
-        else:
-            passADC2min = False
-        #Channel2 Max
-        if int(ADC_Max2) <=  ADCMaxLimits['Max'] and int(ADC_Max2) >= ADCMaxLimits['Min']:
-            passADC2max = True
-            
-        else:
-            passADC2max = False
+    #  @param limits Optional precomputed (mean, min, max) windows, e.g. from a SweepTable. Taken from myExpected when omitted.
+    def RunTest(self, limits=None):
+
+        #Expected ADC values and tolerances, served from the cache after the first test of a run
+        if limits is None:
+            limits = myExpected.Limits(fAMP, FREQ)
+
+        #Extract readings from the DUT Serial port, one line per channel, into the next pooled record
+        if self.verbose:
+            print ("Wait for DUT result")
+        result = self.pool.Next()
+        myConnector.ReadReportDUT(result.frames)
+
+        return self.EvaluateFrames(result.frames, limits, result)
+
+    ## Documentation for EvaluateReadings method.
+    #
+    # This method checks one set of DUT lines, one per channel, against the expected value windows.
+    # It does no serial I/O, so it can be shared by runners that read the DUT ports themselves.
+    #  @param self The object pointer.
+    #  @param received_data List of DUT lines 'header,channel,mean,min,max', one per channel.
+    #  @param limits (mean, min, max) windows as returned by ExpectedValueEngine.Limits.
+    def EvaluateReadings(self, received_data, limits):
+        return self.EvaluateFrames([ParseLine(line) for line in received_data], limits)
+
+    ## Documentation for SetLimits method.
+    #
+    # Converts the (mean, min, max) windows to the low/high limit arrays used by EvaluateFrames. The windows either
+    # apply to every channel, ((low, high),)*3, or are given per channel with shape (channels, 3, 2). Both are
+    # expanded to channels x 3 arrays, comparing arrays of the same shape needs no broadcasting buffers.
+    # The conversion is skipped while the windows stay the same. ExpectedValueEngine.Limits builds new tuples on
+    # every call, so tuples are compared by value.
+    #  @param self The object pointer.
+    def SetLimits(self, limits):
+        if limits is self._limitsKey or (type(limits) is tuple and limits == self._limitsKey):
+            return
+        import numpy as np
+        limitArray = np.asarray(limits, dtype=np.int64)
+        self.limitsLow  = np.ascontiguousarray(np.broadcast_to(limitArray[..., 0], (self.channels, 3)))
+        self.limitsHigh = np.ascontiguousarray(np.broadcast_to(limitArray[..., 1], (self.channels, 3)))
+        self._limitsKey = limits
+
+    ## Documentation for EvaluateFrames method.
+    #
+    # This method checks one set of DUTFrame records, one per channel, against the expected value windows.
+    # The readings are gathered in a channels x {mean,min,max} array and compared with the limit arrays in one
+    # vectorized step. Every frame is taken for the channel it reports, not for its place in frames, so a lost line
+    # cannot shift the others onto the wrong channel. A channel without a frame, because it timed out, was malformed
+    # or was reported twice, fails.
+    # The result is written into a TestResult from the pool, so no arrays are allocated per test. The record
+    # behaves like a list of channel results and is reused two tests later.
+    #  @param self The object pointer.
+    #  @param frames List of DUTFrame records or None, one per channel. result.frames is taken as already placed.
+    #  @param limits (mean, min, max) windows as returned by ExpectedValueEngine.Limits.
+    #  @param result Optional TestResult to fill, the next record of the pool when omitted.
+    def EvaluateFrames(self, frames, limits, result=None):
+        import numpy as np
+
+        self.SetLimits(limits)
+        if result is None:
+            result = self.pool.Next()
+        placed = result.frames
+        if frames is not placed:
+            for channel in range(self.channels):
+                placed[channel] = None
+            for frame in frames:
+                if frame is not None and 1 <= frame.channel <= self.channels and placed[frame.channel-1] is None:
+                    placed[frame.channel-1] = frame
+        readings = result.readings
+        present = result.present
+        for channel, frame in enumerate(placed):
+            if frame is not None:
+                readings[channel, 0] = frame.mean
+                readings[channel, 1] = frame.min
+                readings[channel, 2] = frame.max
+                present[channel] = True
+            else:
+                readings[channel, 0] = readings[channel, 1] = readings[channel, 2] = 0
+                present[channel] = False
+
+        #Check pass/fail of every parameter of every channel, channels need all 3 parameters to pass
+        passMetrics = result.passMetrics
+        np.greater_equal(readings, self.limitsLow, out=passMetrics)
+        np.less_equal(readings, self.limitsHigh, out=result.inWindow)
+        passMetrics &= result.inWindow
+        passed = result.passed
+        meanPassed, minPassed, maxPassed = result.metricColumns
+        np.logical_and(meanPassed, minPassed, out=passed)
+        passed &= maxPassed
+        #A channel without a frame fails
+        passed &= present
+
+        #Keep the record of this test for StoreResults
+        result.limits = limits
+        self.lastResult = result
 
-        #Check overall pass for each channel, channels need all 3 parameters to pass-
-        #Channel 1
-        if passADC1mean == True and passADC1min == True and passADC1max == True:
-            passChannel1 = True
-        else:
-            passChannel1 = False
-        #Channel 2 
-        if passADC2mean == True and passADC2min == True and passADC2max == True:
-            passChannel2 = True
-        else:
-            passChannel2 = False
-        #-----------------------------------------------------------------------------
-
-        ADCChannelsResults = [passChannel1,passChannel2]
-
-        #Debug Trace----------------------------------------------------
-        #print "Channel 1 mean value pass state: " + str(passADC1mean)
-        #print "Channel 1 min value pass state:  " + str(passADC1min)
-        #print "Channel 1 max value pass state:  " + str(passADC1max)
-        #print "Channel 2 mean value pass state: " + str(passADC2mean)
-        #print "Channel 2 min value pass state:  " + str(passADC2min)
-        #print "Channel 2 max value pass state:  " + str(passADC2max)
-        #print "Channel 1 pass state:            " + str(passChannel1)
-        #print "Channel 2 pass state:            " + str(passChannel2)
-        #print ADCChannelsResults
-        #--------------------------------------------------------------
-        #------------------------------------------------------------------------
-        
         #Return the results
-        return ADCChannelsResults
+        return result
 
-        #myConnector.CloseSerialPortCON()
-        #myConnector.CloseSerialPortDUT()
+    ## Documentation for StoreResults method.
+    #
+    # Appends the readings, expected values and pass bits of the last evaluated test to a ResultsStore.
+    #  @param self The object pointer.
+    #  @param store An open ResultsStore.
+    #  @param testCounter Index of the test.
+    def StoreResults(self, store, testCounter):
+        import numpy as np
+        expected = np.broadcast_to((self.limitsLow + self.limitsHigh)//2, (self.channels, 3)).tolist()
+        result = self.lastResult
+        passBits = (result.passMetrics.dot(self.passBitWeights) * result.present).tolist()
+        timestamp = time.time()
+        for channel, frame in enumerate(result.frames):
+            expMean, expMin, expMax = expected[channel]
+            if frame is None:
+                store.Append(testCounter, channel+1, 0, 0, 0, expMean, expMin, expMax, NO_FRAME, timestamp)
+            else:
+                store.Append(testCounter, frame.channel, frame.mean, frame.min, frame.max,
+                             expMean, expMin, expMax, passBits[channel], timestamp)
 
     ## Documentation for CalculateMean method.
     #  @param self The object pointer.
@@ -389,9 +512,11 @@ class SamplingTest(object):
         return waitInterval
 
     ## Documentation for CheckMaxTests method.
-    #  @param self The object pointer.
-    def CheckMaxTests(self):
-        if args.maxtest > 0:
+    #
+    # Depends on the arguments only, so it can be called on the class before any SamplingTest exists.
+    @staticmethod
+    def CheckMaxTests():
+        if args.maxtest is not None and args.maxtest > 0:
             maximumTests = args.maxtest
         else:
             maximumTests = 20
@@ -400,98 +525,504 @@ class SamplingTest(object):
     ## Documentation for CheckInterval method.
     #  @param self The object pointer.
     def CheckInterval(self):
-        if args.interval > 0:
+        if args.interval is not None and args.interval > 0:
             waitInterval = args.interval
         else:
             #default wait period in seconds
             waitInterval = 1
         return waitInterval
 
+    ## Documentation for CreateStopRules method.
+    #
+    # Returns one early stopping rule per channel, or None when every test up to CheckMaxTests() is to be run.
+    #  @param self The object pointer.
+    def CreateStopRules(self):
+        if args.earlystop is None:
+            return None
+        from ADC_EarlyStop import CreateStopRule
+        return [CreateStopRule(args.rule, args.earlystop, args.confidence, args.margin) for channel in range(self.channels)]
+
+    ## Documentation for CreateDriftMonitor method.
+    #
+    # Returns the rolling window drift monitor of all channels, or None when --drift is not given.
+    #  @param self The object pointer.
+    def CreateDriftMonitor(self):
+        if args.drift is None:
+            return None
+        from ADC_Drift import DriftMonitor
+        return DriftMonitor(self.channels, args.drift, args.driftlimit)
+
+    ## Documentation for CreateScheduler method.
+    #
+    # Returns the scheduler selected by the user: adaptive, or a fixed CheckInterval() wait after every test.
+    #  @param self The object pointer.
+    def CreateScheduler(self):
+        #A replay as fast as possible does not wait between tests, the recorded traffic already has the gaps
+        fastReplay = getattr(args, 'replay', None) and not args.realtime
+        if args.adaptive:
+            return AdaptiveScheduler(0.0 if fastReplay else args.minperiod, args.timeout)
+        return FixedScheduler(0.0 if fastReplay else self.CheckInterval())
+
 ## Documentation for a function.
 #
 # Runs the tests in a continous loop for a definite or indefinite amount of iterations and logs the results
 #Note: Change the function to accept input parameters for Message Ping 
 def LoopAndLog():
 
+    import logging
+
     #Local Variables
     testCounter = 1
-    PassCounter = [0,0]
-    SuccessStat = [0,0]
-    PassCounterChannel1 = 0
-    PassCounterChannel2 = 0
-    SuccessStatChannel1 = 0
-    SuccessStatChannel2 = 0
+    CHANNELS = mySamplingTest.channels
+    PassCounter = [0]*CHANNELS
+    SuccessStat = [0]*CHANNELS
     #Flags
     TestBegin = True
 
-    #Create and configure the log file-----------------------------------------------------------------------------------------------
-    LOGFILENAME = 'SamplingEngine_Results.log'
-    logging.basicConfig(filename=LOGFILENAME,level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%d/%m/%Y %I:%M:%S %p')
+    #The log file is opened by main() through the batched results sink--------------------------------------------------------------
     logging.info('Tests Started - Device COM port %s', DUT_PORT)
     #--------------------------------------------------------------------------------------------------------------------------------
 
-    #Configure the time interval between tests and the maximum amount of tests to run-
-    TEST_WAIT_PERIOD_SECONDS = mySamplingTest.CheckInterval()
+    #Configure the scheduling between tests and the maximum amount of tests to run-----
+    myScheduler = mySamplingTest.CreateScheduler()
     MAX_TEST = mySamplingTest.CheckMaxTests()
+    myStopRules = mySamplingTest.CreateStopRules()
+    myDrift = mySamplingTest.CreateDriftMonitor()
     #---------------------------------------------------------------------------------
 
     #Open the serial ports----------
     myConnector.openSerialPortCON()
     myConnector.openSerialPortDUT()
+    myScheduler.Attach(myConnector)
     #-------------------------------
 
+    #The controller command is only sent once, encoded before the loop
+    MESSAGE_PING = EncodeSetpoint(fAMP, FREQ)
+
     #Continously run through tests until max number of tests have been reached-----------------------------
     for testCounter in range(1, MAX_TEST+1):
-        print ("Test Number :",testCounter)
-        MESSAGE_PING = '2,' + str(fAMP) + ',' + str(FREQ) + '\r'
+        if mySamplingTest.verbose:
+            print ("Test Number :",testCounter)
 
         #Wait for DUT and then trigger the controller------------------------------------------------- 
-        #It send 2 lines of data, one for each channel---
+        #It sends one line of data for each channel---
         #Only runs on first iteration
         #time.sleep(1)
         if TestBegin == True:
-            received_data = myConnector.ReadSerialPortLineDUT()
-            received_data = myConnector.ReadSerialPortLineDUT() #run twice for both incoming lines
+            for channel in range(CHANNELS):
+                received_data = myConnector.ReadSerialPortLineDUT()
             print ("The DUT is Ready")
             myConnector.SendSerialCON(MESSAGE_PING)
             myConnector.ReadSerialPortLineCON()            #Check that the command ran
+            myScheduler.Start()
             TestBegin = False
         #time.sleep(1)
         #--------------------------------------------------------------------------------------------
 
-        EngineResults = [False,False]
         EngineResults = mySamplingTest.RunTest()
+        if myStore is not None:
+            mySamplingTest.StoreResults(myStore, testCounter)
         #print "Sampling Engine Results = " + str(EngineResults)
-        Channel1result = EngineResults[0]
-        Channel2result = EngineResults[1]
-        if Channel1result == True :
-            PassCounterChannel1 += 1
-            SuccessStatChannel1 = 100.0 * PassCounterChannel1 / testCounter
-            print ("Expected response received. Channel 1 Test Passed: ", SuccessStatChannel1)
-            logging.info('Test %d,Passed,%d', testCounter, SuccessStatChannel1)
-        else:
-            SuccessStatChannel1 = 100.0 * PassCounterChannel1 / testCounter
-            print("Expected response Not received. Channel 1 Test Failed: ", SuccessStatChannel1)
-            logging.info('Test %d, Failed,%d', testCounter, SuccessStatChannel1)
-        if Channel2result == True :
-            PassCounterChannel2 += 1
-            SuccessStatChannel2 = 100.0 * PassCounterChannel2 / testCounter
-            print ("Expected response received. Channel 2 Test Passed: ", SuccessStatChannel2)
-            logging.info('Test %d,Passed,%d', testCounter, SuccessStatChannel2)
-        else:
-            SuccessStatChannel2 = 100.0 * PassCounterChannel2 / testCounter
-            print("Expected response Not received. Channel 2 Test Failed: ", SuccessStatChannel2)
-            logging.info('Test %d, Failed,%d', testCounter, SuccessStatChannel2)
-        
-        time.sleep(TEST_WAIT_PERIOD_SECONDS)
+        for channel in range(CHANNELS):
+            #A channel that has been decided by the early stop rule is no longer counted
+            if myStopRules is not None and myStopRules[channel].decision is not None:
+                continue
+            if EngineResults[channel] == True :
+                PassCounter[channel] += 1
+                SuccessStat[channel] = 100.0 * PassCounter[channel] / testCounter
+                if mySamplingTest.verbose:
+                    print ("Expected response received. Channel %d Test Passed: " % (channel+1), SuccessStat[channel])
+                logging.info('Test %d,Passed,%d', testCounter, SuccessStat[channel])
+            else:
+                SuccessStat[channel] = 100.0 * PassCounter[channel] / testCounter
+                if mySamplingTest.verbose:
+                    print("Expected response Not received. Channel %d Test Failed: " % (channel+1), SuccessStat[channel])
+                logging.info('Test %d, Failed,%d', testCounter, SuccessStat[channel])
+            if myStopRules is not None and myStopRules[channel].Update(EngineResults[channel]) is not None:
+                LogStopRule(channel, myStopRules[channel])
+
+        #Rolling window of the recent tests, logged every time it has been filled anew
+        if myDrift is not None:
+            for channel, metric, direction in myDrift.Update(EngineResults.readings, EngineResults.present, EngineResults.passed):
+                LogDrift(testCounter, channel, myDrift, 'Drift %s %s' % (metric, direction))
+            if testCounter % myDrift.window.size == 0:
+                for channel in range(CHANNELS):
+                    LogDrift(testCounter, channel, myDrift, 'Rolling')
+
+        #Stop once every channel has been decided
+        if myStopRules is not None and all(rule.decision is not None for rule in myStopRules):
+            break
+        myScheduler.Wait()
     #--------------------------------------------------------------------------------------------------------    
     
     #Close Serial Ports and end-------
     myConnector.CloseSerialPortCON()
     myConnector.CloseSerialPortDUT()
-    logging.info('Finished')
+    if myStopRules is not None:
+        for channel, rule in enumerate(myStopRules):
+            if rule.decision is None:
+                LogStopRule(channel, rule)
+    print ("Achieved %.2f tests/sec" % myScheduler.TestsPerSecond())
+    logging.info('Finished,%.2f tests/sec', myScheduler.TestsPerSecond())
     #--------------------------------
 
+## Documentation for a function.
+#
+# Logs the decision of a channel's early stop rule with the pass rate confidence interval it stopped on
+def LogStopRule(channel, rule):
+    import logging
+    low, high = rule.Interval()
+    decision = rule.decision if rule.decision is not None else 'Undecided'
+    print ("Channel %d %s after %d tests: pass rate %.1f%%, %d%% confidence interval %.1f%% - %.1f%%" %
+           (channel+1, decision, rule.tests, rule.PassRate(), round(100*rule.confidence), low, high))
+    logging.info('Channel %d,%s,Tests %d,Pass rate %.1f,CI %.1f-%.1f', channel+1, decision, rule.tests, rule.PassRate(), low, high)
+
+## Documentation for a function.
+#
+# Logs the rolling window of a channel, with the drift alarm that was raised on it if any
+def LogDrift(testCounter, channel, monitor, event):
+    import logging
+    mean, std, passRate = monitor.Summary(channel)
+    print ("Test %d Channel %d %s: rolling pass rate %.1f%%, mean %.1f/%.1f/%.1f, std %.2f/%.2f/%.2f over %d tests" %
+           ((testCounter, channel+1, event, passRate) + mean + std + (monitor.window.filled,)))
+    logging.info('Test %d,Channel %d,%s,Pass rate %.1f,Mean %.1f/%.1f/%.1f,Std %.2f/%.2f/%.2f', testCounter, channel+1, event,
+                 passRate, *(mean + std))
+
+## Documentation for a function.
+#
+# Runs the tests at every point of an amplitude x frequency grid. The expected values for the whole grid are computed
+# up front in one vectorized pass, the loop only looks up the windows for the current point.
+def SweepAndLog():
+
+    import logging
+    #numpy is only needed for sweeps
+    from ADC_Sweep import SweepPlanner
+
+    global fAMP
+    global FREQ
+
+    #Plan the sweep and precompute the expected values----------------------------------------
+    planner = SweepPlanner(getattr(myExpected, 'engine', myExpected))
+    amplitudes, frequencies = planner.Grid(Amplitudes.Min.value, Amplitudes.Max.value, args.ampsteps,
+                                           Frequencies.Min.value, Frequencies.Max.value, args.freqsteps)
+    table = planner.BuildTable(amplitudes, frequencies)
+    #A calibrated board has its own windows per channel, they are looked up per amplitude instead
+    Lookup = myExpected.Limits if hasattr(myExpected, 'calibration') else table.Lookup
+    print ("Sweep planned: %d points" % len(table))
+    #-------------------------------------------------------------------------------------------
+
+    logging.info('Sweep Started - Device COM port %s', DUT_PORT)
+
+    myScheduler = mySamplingTest.CreateScheduler()
+    MAX_TEST = mySamplingTest.CheckMaxTests()
+
+    myConnector.openSerialPortCON()
+    myConnector.openSerialPortDUT()
+    myScheduler.Attach(myConnector)
+
+    #Wait for the DUT once, it sends one line of data for each channel
+    CHANNELS = mySamplingTest.channels
+    for channel in range(CHANNELS):
+        myConnector.ReadSerialPortLineDUT()
+    print ("The DUT is Ready")
+    myScheduler.Start()
+
+    #Every point is tested at its own setpoint, so the commands go out one at a time, encoded up front
+    setpoints = [(fAmp, freq, EncodeSetpoint(fAmp, freq)) for fAmp, freq in table.Points()]
+
+    sweepCounter = 0
+    for fAMP, FREQ, MESSAGE_PING in setpoints:
+        limits = Lookup(fAMP, FREQ)
+        myConnector.SendSerialCON(MESSAGE_PING)
+        myConnector.ReadSerialPortLineCON()            #Check that the command ran
+        #The reports buffered meanwhile were measured at the previous point
+        if not myConnector.ResyncDUT(CHANNELS):
+            raise IOError('No data from the DUT on ' + DUT_PORT)
+        logging.info('Sweep point %s,%d', fAMP, FREQ)
+
+        PassCounter = [0]*CHANNELS
+        for testCounter in range(1, MAX_TEST+1):
+            EngineResults = mySamplingTest.RunTest(limits)
+            if myStore is not None:
+                sweepCounter += 1
+                mySamplingTest.StoreResults(myStore, sweepCounter)
+            for channel in range(CHANNELS):
+                if EngineResults[channel] == True:
+                    PassCounter[channel] += 1
+            myScheduler.Wait()
+
+        SuccessStat = [100.0 * passed / MAX_TEST for passed in PassCounter]
+        print ("Sweep point amplitude %s frequency %d: " % (fAMP, FREQ) +
+               ", ".join("Channel %d %d%%" % (channel+1, stat) for channel, stat in enumerate(SuccessStat)))
+        logging.info('Amplitude %s,Frequency %d,%s', fAMP, FREQ,
+                     ",".join("Channel %d,%d" % (channel+1, stat) for channel, stat in enumerate(SuccessStat)))
+
+    myConnector.CloseSerialPortCON()
+    myConnector.CloseSerialPortDUT()
+    print ("Achieved %.2f tests/sec" % myScheduler.TestsPerSecond())
+    logging.info('Finished,%.2f tests/sec', myScheduler.TestsPerSecond())
+
+## Documentation for a function.
+#
+# Captures raw sample blocks instead of testing. The DUT is switched to raw mode after the usual handshake and
+# every block is folded into the running statistics and spectrum ring of its channel, so a capture can run for as
+# long as needed in constant memory. The statistics of every channel are logged about once a second and at the end.
+# Ctrl-C ends the capture early.
+def CaptureAndLog():
+
+    import logging
+    #numpy is only needed for captures
+    from ADC_Capture import CaptureAnalyser, RawBlockReader
+
+    CHANNELS = mySamplingTest.channels
+    MAX_BLOCKS = mySamplingTest.CheckMaxTests()
+    myAnalyser = CaptureAnalyser(CHANNELS, args.samplerate, args.ring)
+    myReader = RawBlockReader()
+
+    def LogReports():
+        for channel in range(1, CHANNELS+1):
+            report = myAnalyser.Report(channel)
+            logging.info('Capture,Channel %d,Samples %d,Mean %.2f,Min %s,Max %s,RMS %.2f,Std %.2f,Freq %s,SNR %s,THD %s',
+                         channel, report['samples'], report['mean'], report['min'], report['max'], report['rms'], report['std'],
+                         '%.1f' % report['fundamental_hz'] if report['fundamental_hz'] is not None else '-',
+                         '%.1f' % report['snr_db'] if report['snr_db'] is not None else '-',
+                         '%.1f' % report['thd_db'] if report['thd_db'] is not None else '-')
+            if mySamplingTest.verbose or finished:
+                print ("Channel %d: %d samples, mean %.2f, min %s, max %s, RMS %.2f, SNR %s dB, THD %s dB" %
+                       (channel, report['samples'], report['mean'], report['min'], report['max'], report['rms'],
+                        '%.1f' % report['snr_db'] if report['snr_db'] is not None else '-',
+                        '%.1f' % report['thd_db'] if report['thd_db'] is not None else '-'))
+
+    logging.info('Capture Started - Device COM port %s', DUT_PORT)
+    myConnector.openSerialPortCON()
+    myConnector.openSerialPortDUT()
+
+    #Wait for the DUT, it sends one line of data for each channel, then start the sine wave
+    for channel in range(CHANNELS):
+        myConnector.ReadSerialPortLineDUT()
+    print ("The DUT is Ready")
+    MESSAGE_PING = EncodeSetpoint(fAMP, FREQ)
+    myConnector.SendSerialCON(MESSAGE_PING)
+    myConnector.ReadSerialPortLineCON()
+    myConnector.SendSerialDUT('RAW,%d\r' % args.blocksize)
+
+    finished = False
+    nextReport = myConnector.clock() + 1.0
+    deadline = myConnector.clock() + myConnector.ser2.timeout
+    try:
+        while min(myAnalyser.blocks) < MAX_BLOCKS:
+            blocks = myReader.ReadFrom(myConnector.ser2)
+            now = myConnector.clock()
+            if blocks:
+                deadline = now + myConnector.ser2.timeout
+            elif now >= deadline:
+                print ("DUT Serial Port Rx: timeout, %d raw blocks received" % myReader.blocks)
+                break
+            for channel, samples in blocks:
+                myAnalyser.Feed(channel, samples)
+            if now >= nextReport:
+                LogReports()
+                nextReport = now + 1.0
+    except KeyboardInterrupt:
+        print ("Capture stopped")
+    finally:
+        finished = True
+        myConnector.SendSerialDUT('RAW,0\r')
+        myConnector.CloseSerialPortCON()
+        myConnector.CloseSerialPortDUT()
+        LogReports()
+        logging.info('Finished,%d blocks,%d other lines skipped', myReader.blocks, myReader.skipped)
+
+## Documentation for a function.
+#
+# Calibration run: reads caltests tests at each of calpoints amplitudes across the Amplitudes range and fits the
+# gain and offset of every channel to them. Readings taken before the controller settled on an amplitude are
+# dropped by resynchronising after every setpoint. Leaves the controller at the test setpoint and returns the
+# BoardCalibration.
+def CalibrateBoard():
+
+    import logging
+    from ADC_Calibration import BoardCalibration, CalibrationAmplitudes
+
+    CHANNELS = mySamplingTest.channels
+    engine = getattr(myExpected, 'engine', myExpected)
+    freq = FREQ if FREQ is not None else Frequencies.Min.value
+    amplitudes = CalibrationAmplitudes(args.calpoints, Amplitudes.Min.value, Amplitudes.Max.value)
+    logging.info('Calibration Started - Device COM port %s', DUT_PORT)
+
+    myConnector.openSerialPortCON()
+    myConnector.openSerialPortDUT()
+    expected, measured = [], []
+    try:
+        for fAmp in amplitudes:
+            myConnector.SendSerialCON(EncodeSetpoint(fAmp, freq))
+            myConnector.ReadSerialPortLineCON()
+            if not myConnector.ResyncDUT(CHANNELS):
+                raise IOError('No data from the DUT on ' + DUT_PORT)
+            nominal = tuple(engine.Calculate(fAmp, freq))
+            for test in range(args.caltests):
+                readings = [None]*CHANNELS
+                for channel in range(CHANNELS):
+                    frame = myConnector.ReadFrameDUT()
+                    if frame is not None and 1 <= frame.channel <= CHANNELS:
+                        readings[frame.channel-1] = frame[2:]
+                if None not in readings:
+                    expected.append(nominal)
+                    measured.append(readings)
+        if fAMP is not None:
+            myConnector.SendSerialCON(EncodeSetpoint(fAMP, FREQ))
+            myConnector.ReadSerialPortLineCON()
+    finally:
+        myConnector.CloseSerialPortCON()
+        myConnector.CloseSerialPortDUT()
+
+    calibration = BoardCalibration.Fit(expected, measured, engine.tolerance, amplitudes, freq)
+    for channel in range(CHANNELS):
+        print ("Channel %d calibrated: gain %.4f, offset %.1f, windows mean +-%d, min +-%d, max +-%d" %
+               ((channel+1, calibration.gain[channel], calibration.offset[channel]) + tuple(calibration.tolerance[channel])))
+        logging.info('Calibration,Channel %d,Gain %.4f,Offset %.1f,Tolerance %d/%d/%d', channel+1, calibration.gain[channel],
+                     calibration.offset[channel], *calibration.tolerance[channel])
+    return calibration
+
+## Documentation for a function.
+#
+# Returns the expected value engine to test with: myExpected itself, or a CalibratedExpected wrapping it when a
+# calibration is run (--calibrate) or loaded (--calibrated) for the board.
+def LoadCalibration():
+
+    if not args.calibrate and not args.calibrated:
+        return myExpected
+    from ADC_Calibration import CalibrationCache, CalibratedExpected
+
+    board = args.board or DUT_PORT
+    cache = CalibrationCache(args.calfile)
+    if args.calibrate:
+        calibration = CalibrateBoard()
+        cache.Put(board, calibration)
+        cache.Save()
+        print ("Calibration of board %s saved to %s" % (board, args.calfile))
+    else:
+        calibration = cache.Get(board)
+        if calibration is None:
+            raise SystemExit("No calibration of board %s in %s, run with --calibrate first" % (board, args.calfile))
+    if calibration.Channels() != args.channels:
+        raise SystemExit("The calibration of board %s has %d channels, not %d" % (board, calibration.Channels(), args.channels))
+    return CalibratedExpected(myExpected, calibration)
+
+## Documentation for a function.
+#
+# Runs the tests through the asyncio serial transport. The controller and DUT are read concurrently and every
+# read has its own deadline instead of the fixed 10 s port timeout.
+def AsyncLoopAndLog():
+
+    import asyncio
+    import logging
+    from ADC_AsyncSerial import AsyncSerialConnecter, LoopAndLogAsync
+
+    logging.info('Tests Started - Device COM port %s', DUT_PORT)
+
+    asyncConnector = AsyncSerialConnecter(uC_PORT, uC_BAUD, DUT_PORT, DUT_BAUD, readTimeout=args.timeout, verbose=not args.quiet)
+    asyncio.run(LoopAndLogAsync(asyncConnector, mySamplingTest, fAMP, FREQ, myExpected.Limits(fAMP, FREQ), mySamplingTest.CheckMaxTests(),
+                                myStore))
+
+## Documentation for a function.
+#
+# Times the hot path sections of the synchronous test loops: the serial reads and writes of myConnector (the
+# controller handshake is the only user of the CON port and of the line reads), RunTest, the expected value lookup
+# and the results logging calls. Returns the Instrumentation and the started reporter and server, None when not
+# requested.
+def InstrumentTest():
+
+    import logging
+    from ADC_Instrument import Instrumentation, StatsServer, SummaryReporter
+
+    myStats = Instrumentation()
+    for methodName in ('SendSerialCON', 'SendSerialDUT', 'ReadSerialPortLineCON', 'ReadSerialPortLineDUT', 'ReadFrameDUT'):
+        myStats.Wrap(myConnector, methodName)
+    myStats.Wrap(mySamplingTest, 'RunTest')
+    myStats.Wrap(myExpected, 'Limits', 'ExpectedLimits')
+    #logging.info() goes through the root logger
+    myStats.Wrap(logging.getLogger(), 'info', 'LogResult')
+    myStats.Gauge('malformed', lambda: myConnector.parserDUT.malformed if hasattr(myConnector, 'parserDUT') else 0)
+    myStats.Gauge('queued', lambda: myResults.queue.qsize())
+
+    reporter = SummaryReporter(myStats, args.stats).Start() if args.stats else None
+    server = StatsServer(myStats, args.statsport).Start() if args.statsport is not None else None
+    return myStats, reporter, server
+
+## Documentation for a function.
+#
+# Returns the SerialConnecter of the run and the TrafficRecorder or TrafficReplay behind its ports, None without
+# --record and --replay
+def CreateConnector():
+    myTraffic = None
+    if args.record:
+        myTraffic = TrafficRecorder(args.record, SerialConnecter._OpenSerial)
+    elif args.replay:
+        myTraffic = TrafficReplay(args.replay, args.realtime)
+    connector = SerialConnecter(not args.quiet, myTraffic.OpenPort if myTraffic is not None else None)
+    if args.replay and not args.realtime:
+        connector.clock = myTraffic.Clock
+    return connector, myTraffic
+
+## Documentation for a function.
+#
+# Returns the expected value engine selected by the arguments, the frequency aware model with --freqmodel.
+def CreateExpectedEngine():
+    if not args.freqmodel:
+        return ExpectedValueEngine()
+    from ADC_FrequencyModel import FrequencyModelEngine
+    return FrequencyModelEngine(args.samplerate, args.cutoff, args.filterorder, args.window)
+
+## Documentation for a function.
+#
+# Prints what a run with the parsed arguments would do and the expected ADC values it would test against, without
+# opening a port. Amplitudes and frequencies outside the Amplitudes and Frequencies ranges are reported.
+def DryRun():
+
+    if args.capture:
+        mode = "capture, %d blocks of %d samples per channel" % (SamplingTest.CheckMaxTests(), args.blocksize)
+    elif args.sweep:
+        mode = "sweep, %d x %d points, %d tests per point" % (args.ampsteps, args.freqsteps, SamplingTest.CheckMaxTests())
+    else:
+        mode = "%s, %d tests" % ("asyncio" if args.asyncio else "loop", SamplingTest.CheckMaxTests())
+    print ("Dry run, no port is opened")
+    print ("DUT Serial Port %s at %d baud, Controller Serial Port %s at %d baud" % (DUT_PORT, DUT_BAUD, uC_PORT, uC_BAUD))
+    print ("Mode %s, %d channels" % (mode, args.channels))
+
+    expected = myExpected
+    if args.calibrate:
+        from ADC_Calibration import CalibrationAmplitudes
+        print ("Calibration of %d tests at amplitudes %s, the windows below are uncalibrated" %
+               (args.caltests, ", ".join(str(fAmp) for fAmp in CalibrationAmplitudes(args.calpoints, Amplitudes.Min.value, Amplitudes.Max.value))))
+    elif args.calibrated:
+        expected = LoadCalibration()
+        print ("Calibrated windows of board %s from %s" % (args.board or DUT_PORT, args.calfile))
+
+    if args.sweep:
+        from ADC_Sweep import SweepPlanner
+        planner = SweepPlanner(myExpected)
+        amplitudes, frequencies = planner.Grid(Amplitudes.Min.value, Amplitudes.Max.value, args.ampsteps,
+                                               Frequencies.Min.value, Frequencies.Max.value, args.freqsteps)
+        table = planner.BuildTable(amplitudes, frequencies)
+        points = [(fAmp, freq, expected.Limits(fAmp, freq) if expected is not myExpected else table.Lookup(fAmp, freq))
+                  for fAmp, freq in table.Points()]
+    else:
+        if not Amplitudes.Min.value <= fAMP <= Amplitudes.Max.value:
+            print ("Warning: amplitude %s is outside %s-%s" % (fAMP, Amplitudes.Min.value, Amplitudes.Max.value))
+        if not Frequencies.Min.value <= FREQ <= Frequencies.Max.value:
+            print ("Warning: frequency %d is outside %d-%d" % (FREQ, Frequencies.Min.value, Frequencies.Max.value))
+        print ("Controller command %r" % EncodeSetpoint(fAMP, FREQ))
+        points = [(fAMP, FREQ, expected.Limits(fAMP, FREQ))]
+
+    print ("%-10s %-10s %-8s %-16s %-16s %-16s" % ("Amplitude", "Frequency", "Channel", "Mean", "Min", "Max"))
+    for fAmp, freq, limits in points:
+        #Calibrated windows are given per channel
+        channelLimits = limits if expected is not myExpected else [limits]*args.channels
+        for channel, windows in enumerate(channelLimits):
+            print ("%-10s %-10d %-8d %-16s %-16s %-16s" % ((fAmp, freq, channel+1) + tuple("%d (%d-%d)" % ((low + high)//2, low, high)
+                                                                                            for low, high in windows)))
+
 ## Documentation for a function.
 #
 # The main function parses the arguments input by the user, creates a modem object, opens the serial port, opens the TCP port
@@ -510,29 +1041,71 @@ def main():
     global myInputs         #Name for instance of InputParse object
     global myConnector      #Name for instance of SerialConnecter object
     global mySamplingTest   #Name for instance of SamplingTest object
+    global myExpected       #Name for instance of ExpectedValueEngine object
+    global myResults        #Name for instance of ResultsSink object
+    global myStore          #Name for instance of ResultsStore object, None when not storing
     global MESSAGE_PING     #String Command to be sent to the controller
 
     #Temp variables
 
-    #Create the needed class instances
+    #Initialize variables from input parameters, nothing is created or printed before they are valid
     myInputs = InputParse()
-    myConnector = SerialConnecter()
-    mySamplingTest = SamplingTest()
-
-    #Initialize variables from input parameters
     [DUT_PORT, DUT_BAUD, uC_PORT, uC_BAUD, fAMP, FREQ] = myInputs.GetInput()
+    myExpected = CreateExpectedEngine()
+    if args.dry_run:
+        DryRun()
+        return
+
+    #Create the needed class instances, the SamplingTest is sized once the channel count is known
+    from ADC_ResultsLog import ResultsSink
+    myConnector, myTraffic = CreateConnector()
+    mySamplingTest = SamplingTest(not args.quiet, args.channels)
 
     print ("\nDUT Sampling Engine Test")
-    print 'DUT'+' Serial Port '+str(DUT_PORT)
-    print 'Controller'+' Serial Port '+str(uC_PORT)
-    print "Sampling Engine Test version: V" + str(MAJOR) + '.' + str(MINOR)
+    print ('DUT'+' Serial Port '+str(DUT_PORT))
+    print ('Controller'+' Serial Port '+str(uC_PORT))
+    print ("Sampling Engine Test version: V" + str(MAJOR) + '.' + str(MINOR))
     
-    LoopAndLog()
+    #Results are queued and written to the log file in batches, Stop drains the queue even on Ctrl-C
+    myResults = ResultsSink(LOGFILENAME, args.flush, args.queue).Start()
+    myStore = ResultsStore(args.store) if args.store else None
+    if myStore is not None and myStore.truncated:
+        print ("Results store %s: cut off a torn record of %d bytes left by an earlier run" % (args.store, myStore.truncated))
+    myStats, myReporter, myStatsServer = None, None, None
+    try:
+        #A calibration run uses the ports before the tests, the timing counters start after it
+        if not args.capture:
+            myExpected = LoadCalibration()
+        if args.stats is not None or args.statsport is not None:
+            myStats, myReporter, myStatsServer = InstrumentTest()
+        if args.capture:
+            CaptureAndLog()
+        elif args.sweep:
+            SweepAndLog()
+        elif args.asyncio:
+            AsyncLoopAndLog()
+        else:
+            LoopAndLog()
+    except ReplayEnded as e:
+        print ("Replay ended: %s" % e)
+    finally:
+        if myTraffic is not None:
+            myTraffic.Close()
+            if args.replay:
+                print (myTraffic.Report())
+        if myReporter is not None:
+            myReporter.Stop()
+        if myStatsServer is not None:
+            myStatsServer.Stop()
+        if myStore is not None:
+            myStore.Close()
+        myResults.Stop()
     #Debug and Trace Section-------------
     #------------------------------------
 
 
-    print "All Tests completed!"
+    print ("Expected value cache: %d hits, %d misses" % (myExpected.CacheHits(), myExpected.CacheMisses()))
+    print ("All Tests completed!")
 
 if __name__ == "__main__":
     main()
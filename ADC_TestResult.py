@@ -0,0 +1,100 @@
+## @package ADC_TestResult
+#
+# Purpose: Preallocated result records of one test, reused from a small pool
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  A TestResult holds everything SamplingTest.EvaluateFrames knows about one test: the DUT frames, the readings
+#  and frame presence of every channel, the pass result of every metric and the pass result of every channel.
+#  Every field is a buffer allocated with the record, EvaluateFrames writes into them with the out arguments of
+#  the numpy ufuncs, so evaluating a test allocates no arrays. The operands of those ufuncs have the same shape and
+#  dtype, numpy allocates buffers to broadcast or cast them otherwise. The records use __slots__ and behave like
+#  the list of channel results RunTest used to return: result[channel], len(result) and iteration work as before,
+#  on numpy bools.
+#
+#  A ResultPool hands out its records in turn. A record is overwritten size tests after it was handed out, so a
+#  caller that keeps a result for longer copies what it needs, e.g. result.ToList() or result.readings.copy().
+
+import numpy as np
+
+
+## Documentation for the TestResult class.
+#
+#  This class holds the readings and results of one test in preallocated buffers
+class TestResult(object):
+
+    __slots__ = ('channels', 'frames', 'readings', 'present', 'passMetrics', 'metricColumns', 'inWindow', 'passed',
+                 'limits')
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param channels Number of ADC channels reported by the DUT.
+    def __init__(self, channels):
+        self.channels      = channels
+        #DUTFrame or None of every channel
+        self.frames        = [None]*channels
+        #Readings of every channel: mean, min, max
+        self.readings      = np.zeros((channels, 3), dtype=np.int64)
+        self.present       = np.zeros(channels, dtype=bool)
+        #Pass result of every metric of every channel, its columns, and a scratch buffer of the same shape
+        self.passMetrics   = np.zeros((channels, 3), dtype=bool)
+        self.metricColumns = [self.passMetrics[:, metric] for metric in range(3)]
+        self.inWindow      = np.zeros((channels, 3), dtype=bool)
+        self.passed        = np.zeros(channels, dtype=bool)
+        self.limits        = None
+
+    ## Documentation for __len__ method.
+    #  @param self The object pointer.
+    def __len__(self):
+        return self.channels
+
+    ## Documentation for __getitem__ method.
+    #
+    # Pass result of a channel, counted from 0.
+    #  @param self The object pointer.
+    def __getitem__(self, channel):
+        return self.passed[channel]
+
+    ## Documentation for __iter__ method.
+    #  @param self The object pointer.
+    def __iter__(self):
+        return iter(self.passed)
+
+    ## Documentation for AllPassed method.
+    #  @param self The object pointer.
+    def AllPassed(self):
+        return bool(self.passed.all())
+
+    ## Documentation for ToList method.
+    #
+    # Pass result of every channel as a new list of bools, kept when the record is reused.
+    #  @param self The object pointer.
+    def ToList(self):
+        return self.passed.tolist()
+
+
+## Documentation for the ResultPool class.
+#
+#  This class hands out a fixed set of TestResult records in turn
+class ResultPool(object):
+
+    __slots__ = ('records', 'index')
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param channels Number of ADC channels reported by the DUT.
+    #  @param size Number of records, a record is reused size tests after it was handed out.
+    def __init__(self, channels, size=2):
+        self.records = [TestResult(channels) for record in range(size)]
+        self.index   = 0
+
+    ## Documentation for Next method.
+    #
+    # Returns the next record to fill, the oldest of the pool.
+    #  @param self The object pointer.
+    def Next(self):
+        record = self.records[self.index]
+        self.index = (self.index + 1) % len(self.records)
+        return record
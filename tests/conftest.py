@@ -0,0 +1,46 @@
+## @package conftest
+#
+# Purpose: pytest set up of the tests, the ADC modules are imported from the repository root
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The runners are tested on the pseudo terminals of DUTSimulator, made with os.openpty(). The simulators start with
+#  the setpoint already applied, so the first readings are valid. The results logs are written to the temporary
+#  directory of each test.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ADC_Simulator import DUTSimulator
+
+AMPLITUDE = 0.3
+FREQUENCY = 50
+
+
+## Documentation for a function.
+#
+# Simulators of the test, stopped after it. The results logs go to the temporary directory of the test.
+@pytest.fixture
+def simulators(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sims = []
+    yield sims
+    for sim in sims:
+        sim.Stop()
+
+
+## Documentation for a function.
+#
+# Starts count simulators with the setpoint applied and returns their (dutPort, uCPort)
+def StartSimulators(sims, count, rate=100):
+    for seed in range(count):
+        sim = DUTSimulator(rate=rate, noise=1, seed=seed)
+        sim.fAmp, sim.freq = AMPLITUDE, FREQUENCY
+        sims.append(sim)
+    return [sim.Start() for sim in sims]
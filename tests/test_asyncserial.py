@@ -0,0 +1,27 @@
+## @package test_asyncserial
+#
+# Purpose: Tests of LoopAndLogAsync against DUTSimulator
+#
+# Version : V1.0
+
+import asyncio
+import re
+
+from conftest import AMPLITUDE, FREQUENCY, StartSimulators
+from ADC_AsyncSerial import AsyncSerialConnecter, LoopAndLogAsync
+from ADC_Expected import ExpectedValueEngine
+from ADC_Test import SamplingTest
+
+
+def test_asyncio_counts_timeouts(simulators, capsys):
+    [(dutPort, uCPort)] = StartSimulators(simulators, 1)
+    connector = AsyncSerialConnecter(uCPort, 9600, dutPort, 115200, readTimeout=0.2, verbose=False)
+    #Silent while the runner waits for the DUT, the run goes on once it reports again
+    simulators[0].Pause(0.5)
+    PassCounter = asyncio.run(LoopAndLogAsync(connector, SamplingTest(verbose=False), AMPLITUDE, FREQUENCY,
+                                              ExpectedValueEngine().Limits(AMPLITUDE, FREQUENCY), 10))
+
+    output = capsys.readouterr().out
+    assert len(PassCounter) == 2
+    assert 'DUT Serial Port Rx: timeout' in output
+    assert int(re.search(r'10 tests in [0-9.]+ s, ([0-9]+) reads timed out', output).group(1)) > 0
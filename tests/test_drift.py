@@ -0,0 +1,62 @@
+## @package test_drift
+#
+# Purpose: Tests of the rolling window and CUSUM drift alarms of DriftMonitor
+#
+# Version : V1.0
+
+import numpy as np
+
+from ADC_Drift import DriftMonitor, RollingWindow
+
+
+## Documentation for a function.
+#
+# Returns count tests of readings around (400, 120, 700) with a noise of 5 counts, shape (count, channels, 3). A
+# steady board raises a false alarm about once every 9000 tests per metric, the seed gives a run without one.
+def Readings(count, channels=2, seed=2):
+    generator = np.random.default_rng(seed)
+    return np.rint(np.array([400, 120, 700]) + generator.normal(0, 5, (count, channels, 3))).astype(np.int64)
+
+
+def test_window_matches_last_tests():
+    readings = Readings(30)
+    present = np.array([True, True])
+    window = RollingWindow(10, 2)
+    for test in range(30):
+        window.Update(readings[test], present, np.array([test % 3 != 0, True]))
+
+    assert np.allclose(window.Mean(), readings[-10:].mean(axis=0))
+    assert np.allclose(window.Std(), readings[-10:].std(axis=0, ddof=1))
+    assert window.PassRate().tolist() == [70.0, 100.0]
+
+
+def test_missing_frame_counts_as_fail_only():
+    window = RollingWindow(4, 1)
+    for present in (True, True, False, True):
+        window.Update(np.array([[400, 120, 700]]), np.array([present]), np.array([present]))
+
+    assert window.Mean().tolist() == [[400.0, 120.0, 700.0]]
+    assert window.PassRate().tolist() == [75.0]
+
+
+def test_steady_board_raises_no_alarm():
+    monitor = DriftMonitor(2, window=500)
+    passed = np.array([True, True])
+    present = np.array([True, True])
+    alarms = [alarm for test in Readings(1000) for alarm in monitor.Update(test, present, passed)]
+
+    assert monitor.Ready()
+    assert alarms == []
+
+
+def test_shift_of_mean_raises_one_alarm():
+    monitor = DriftMonitor(2, window=500)
+    passed = np.array([True, True])
+    present = np.array([True, True])
+    readings = Readings(800)
+    #Two standard deviations on the mean of channel 2
+    readings[600:, 1, 0] += 10
+    alarms = [(test, alarm) for test in range(800) for alarm in monitor.Update(readings[test], present, passed)]
+
+    assert [alarm for test, alarm in alarms] == [(1, 'mean', 'high')]
+    assert 600 <= alarms[0][0] < 620
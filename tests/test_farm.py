@@ -0,0 +1,24 @@
+## @package test_farm
+#
+# Purpose: Tests of FarmCoordinator against DUTSimulator
+#
+# Version : V1.0
+
+from conftest import AMPLITUDE, FREQUENCY, StartSimulators
+from ADC_Farm import FarmCoordinator, FarmStation, ParseJob
+
+
+def test_farm_runs_jobs_on_two_stations(simulators):
+    ports = StartSimulators(simulators, 2)
+    stations = [FarmStation('station%d' % index, dutPort, 115200, uCPort, 9600)
+                for index, (dutPort, uCPort) in enumerate(ports)]
+    jobs = [ParseJob('%s,%d,10' % (AMPLITUDE, FREQUENCY), jobId) for jobId in range(4)]
+    coordinator = FarmCoordinator(stations, timeout=2)
+    results = coordinator.Run(jobs)
+
+    assert coordinator.failed == []
+    assert [result.job.jobId for result in results] == [0, 1, 2, 3]
+    for result in results:
+        assert result.error is None
+        assert result.reply is not None
+        assert result.reply['tests'] == 10
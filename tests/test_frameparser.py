@@ -0,0 +1,117 @@
+## @package test_frameparser
+#
+# Purpose: Tests of the placement of DUT frames by channel, with lost and corrupted lines
+#
+# Version : V1.0
+#
+#  More details.
+#
+#  The DUT reports are written on the master side of an os.openpty() pair and read from its slave side, report n
+#  has the mean 100*n + channel on every channel, so every frame shows the report and channel it came from.
+
+import asyncio
+import os
+import threading
+
+import serial
+
+from conftest import AMPLITUDE, FREQUENCY
+from ADC_AsyncSerial import AsyncSerialConnecter, LoopAndLogAsync
+from ADC_Expected import ExpectedValueEngine
+from ADC_FrameParser import DUTFrame, ReportAssembler
+from ADC_Test import SamplingTest, SerialConnecter
+
+CORRUPTED = b'ADC,2,0,0\xff\r\n'
+
+
+## Documentation for a function.
+#
+# Returns the DUT line of a channel in report number report
+def Line(report, channel):
+    return b'ADC,%d,%d,0,999\r\n' % (channel, 100*report + channel)
+
+
+## Documentation for a function.
+#
+# Returns (report, channel) of every frame, None for a missing one
+def Origins(frames):
+    return [None if frame is None else (frame.mean // 100, frame.channel) for frame in frames]
+
+
+def test_assembler_keeps_report_boundaries():
+    report = ReportAssembler()
+    frames = [None]*3
+    lines = [(1, 1), (1, 2), (1, 3), (2, 1), (2, 3), (3, 1), (3, 2), (3, 3), (4, 2), (4, 3), (5, 1), (5, 7), (5, 3)]
+    reports = []
+    complete = report.Start(frames)
+    for reportNumber, channel in lines:
+        complete = complete or report.Add(frames, DUTFrame('ADC', channel, 100*reportNumber + channel, 0, 999))
+        if complete:
+            reports.append(Origins(frames))
+            complete = report.Start(frames)
+
+    assert reports == [[(1, 1), (1, 2), (1, 3)],
+                       [(2, 1), None, (2, 3)],
+                       [(3, 1), (3, 2), (3, 3)],
+                       [None, (4, 2), (4, 3)],
+                       [(5, 1), None, (5, 3)]]
+    assert report.misplaced == 1
+
+
+def test_serial_reports_resync_after_corrupted_line():
+    master, slave = os.openpty()
+    connector = SerialConnecter(verbose=False, openPort=lambda port, baud, timeout: serial.Serial(port, baud, timeout=0.2))
+    connector.openSerialPortDUT(os.ttyname(slave), 115200)
+    try:
+        os.write(master, Line(1, 1) + Line(1, 2) + Line(2, 1) + CORRUPTED + Line(3, 1) + Line(3, 2) +
+                 Line(4, 2) + Line(5, 1) + Line(5, 2))
+        reports = [Origins(connector.ReadReportDUT([None, None])) for report in range(6)]
+    finally:
+        connector.ser2.close()
+        os.close(master)
+        os.close(slave)
+
+    assert reports == [[(1, 1), (1, 2)], [(2, 1), None], [(3, 1), (3, 2)], [None, (4, 2)], [(5, 1), (5, 2)],
+                       [None, None]]
+    assert connector.parserDUT.malformed == 1
+
+
+def test_evaluate_places_frames_by_channel():
+    evaluator = SamplingTest(verbose=False)
+    limits = ((100, 300),)*3
+    result = evaluator.EvaluateFrames([DUTFrame('ADC', 2, 202, 150, 250), DUTFrame('ADC', 1, 101, 150, 250)], limits)
+    assert [frame.channel for frame in result.frames] == [1, 2]
+    assert result.ToList() == [True, True]
+
+    result = evaluator.EvaluateFrames([DUTFrame('ADC', 2, 202, 150, 250), DUTFrame('ADC', 2, 202, 150, 250)], limits)
+    assert result.frames[0] is None
+    assert result.ToList() == [False, True]
+
+
+def test_asyncio_reports_resync_after_corrupted_line(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    dutMaster, dutSlave = os.openpty()
+    conMaster, conSlave = os.openpty()
+    engine = ExpectedValueEngine()
+    limits = engine.Limits(AMPLITUDE, FREQUENCY)
+    mean, low, high = engine.Calculate(AMPLITUDE, FREQUENCY)
+    good = [b'ADC,1,%d,%d,%d\r\n' % (mean, low, high), b'ADC,2,%d,%d,%d\r\n' % (mean, low, high)]
+    bad = b'ADC,1,0,0,0\r\n'
+    #Ready lines, then channel 2 of the first test is corrupted and channel 1 of the last test fails, written once
+    #the ports are open and configured
+    writer = threading.Timer(0.1, lambda: (os.write(dutMaster, b''.join(good) + good[0] + CORRUPTED +
+                                                    (b''.join(good))*3 + bad + good[1]),
+                                           os.write(conMaster, b'OK\r\n')))
+    writer.start()
+    connector = AsyncSerialConnecter(os.ttyname(conSlave), 9600, os.ttyname(dutSlave), 115200, readTimeout=1,
+                                     verbose=False)
+    try:
+        PassCounter = asyncio.run(LoopAndLogAsync(connector, SamplingTest(verbose=False), AMPLITUDE, FREQUENCY,
+                                                  limits, 5))
+    finally:
+        writer.join()
+        for fd in (dutMaster, dutSlave, conMaster, conSlave):
+            os.close(fd)
+
+    #Channel 2 misses test 1 and channel 1 fails test 5, the other tests stay on their channels
+    assert PassCounter == [4, 4]
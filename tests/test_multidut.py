@@ -0,0 +1,45 @@
+## @package test_multidut
+#
+# Purpose: Tests of MultiDUTRunner against DUTSimulator
+#
+# Version : V1.0
+
+import threading
+import time
+
+from conftest import AMPLITUDE, FREQUENCY, StartSimulators
+from ADC_MultiDUT import MultiDUTRunner
+
+
+def test_multidut_passes(simulators):
+    ports = StartSimulators(simulators, 2)
+    runner = MultiDUTRunner(ports[0][1], 9600, [dutPort for dutPort, uCPort in ports], 115200, AMPLITUDE, FREQUENCY,
+                            20, timeout=2)
+    workers = runner.Run()
+
+    assert len(workers) == 2
+    for worker in workers:
+        assert worker.error is None
+        assert worker.testCounter == 20
+        assert worker.Missing == [0, 0]
+        assert worker.PassCounter == [20, 20]
+
+
+def test_multidut_counts_dropped_frames(simulators):
+    ports = StartSimulators(simulators, 2)
+    runner = MultiDUTRunner(ports[0][1], 9600, [dutPort for dutPort, uCPort in ports], 115200, AMPLITUDE, FREQUENCY,
+                            100, timeout=0.2)
+    thread = threading.Thread(target=runner.Run)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while (len(runner.workers) < 2 or runner.workers[1].testCounter < 20) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    simulators[1].Pause(0.5)
+    thread.join(30)
+
+    assert not thread.is_alive()
+    for worker in runner.workers:
+        assert worker.error is None
+        assert worker.testCounter == 100
+    assert runner.workers[0].Missing == [0, 0]
+    assert sum(runner.workers[1].Missing) > 0
@@ -0,0 +1,65 @@
+## @package test_pipeline
+#
+# Purpose: Tests of PipelinedController against the controller of DUTSimulator
+#
+# Version : V1.0
+
+import pytest
+import serial
+
+from conftest import StartSimulators
+from ADC_Pipeline import EncodeSetpoint, PipelinedController
+
+SETPOINTS = [EncodeSetpoint(fAmp, 50) for fAmp in (0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45)]
+
+
+## Documentation for a function.
+#
+# Sends SETPOINTS through a PipelinedController on the controller port and returns the controller and its replies
+def DrainSetpoints(uCPort):
+    ser = serial.Serial(uCPort, 9600, timeout=0.1)
+    try:
+        controller = PipelinedController(ser, window=4)
+        for setpoint in SETPOINTS:
+            controller.Queue(setpoint)
+        return controller, controller.Drain()
+    finally:
+        ser.close()
+
+
+def test_pipeline_matches_replies(simulators):
+    [(dutPort, uCPort)] = StartSimulators(simulators, 1)
+    controller, answered = DrainSetpoints(uCPort)
+
+    assert [reply.command for reply in answered] == SETPOINTS
+    assert all(reply.ok for reply in answered)
+    assert (controller.replies, controller.lost, controller.mismatched) == (8, 0, 0)
+
+
+def test_pipeline_resyncs_after_lost_and_duplicated_reply(simulators):
+    [(dutPort, uCPort)] = StartSimulators(simulators, 1)
+    sim = simulators[0]
+    HandleCommand = sim.HandleCommand
+    commands = []
+
+    #The controller drops its reply to the third command and sends the one to the sixth twice
+    def Faulty(command):
+        reply = HandleCommand(command)
+        commands.append(command)
+        if len(commands) == 3:
+            return ''
+        if len(commands) == 6:
+            return reply*2
+        return reply
+    sim.HandleCommand = Faulty
+    controller, answered = DrainSetpoints(uCPort)
+
+    assert [reply.command for reply in answered] == SETPOINTS
+    assert [reply.ok for reply in answered] == [True, True, False, True, True, True, True, True]
+    assert answered[2].reply is None
+    assert (controller.replies, controller.lost, controller.mismatched) == (7, 1, 1)
+
+
+def test_pipeline_rejects_empty_window():
+    with pytest.raises(ValueError):
+        PipelinedController(None, window=0)
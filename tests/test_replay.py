@@ -0,0 +1,82 @@
+## @package test_replay
+#
+# Purpose: Tests of TrafficRecorder and TrafficReplay on the ports of DUTSimulator
+#
+# Version : V1.0
+
+import pytest
+
+from conftest import StartSimulators
+from ADC_Pipeline import EncodeSetpoint
+from ADC_Replay import IterEvents, ReplayEnded, TrafficRecorder, TrafficReplay, EVENT, HEADER, RX
+from ADC_Test import SerialConnecter
+
+REPORTS = 10
+
+
+## Documentation for a function.
+#
+# Sends the setpoint and reads REPORTS reports through connector, returns them as lists of (channel, mean) or None
+def RunSession(connector, dutPort, uCPort):
+    connector.openSerialPortCON(uCPort, 9600)
+    connector.openSerialPortDUT(dutPort, 115200)
+    try:
+        connector.SendSerialCON(EncodeSetpoint(0.3, 50))
+        connector.ReadSerialPortLineCON()
+        return [[None if frame is None else (frame.channel, frame.mean) for frame in connector.ReadReportDUT([None, None])]
+                for report in range(REPORTS)]
+    finally:
+        connector.CloseSerialPortCON()
+        connector.CloseSerialPortDUT()
+
+
+## Documentation for a function.
+#
+# Records a session against a simulator to filename and returns its reports
+def Record(simulators, filename):
+    [(dutPort, uCPort)] = StartSimulators(simulators, 1)
+    recorder = TrafficRecorder(filename, SerialConnecter._OpenSerial)
+    try:
+        return RunSession(SerialConnecter(verbose=False, openPort=recorder.OpenPort), dutPort, uCPort)
+    finally:
+        recorder.Close()
+
+
+def test_replay_returns_recorded_reports(simulators, tmp_path):
+    filename = str(tmp_path / 'session.trf')
+    recorded = Record(simulators, filename)
+    replay = TrafficReplay(filename)
+    connector = SerialConnecter(verbose=False, openPort=replay.OpenPort)
+    connector.clock = replay.Clock
+    try:
+        replayed = RunSession(connector, 'replay', 'replay')
+        #Nothing was recorded after the session
+        with pytest.raises(ReplayEnded):
+            replay.Received(1)
+    finally:
+        replay.Close()
+
+    assert replayed == recorded
+    assert replay.mismatches == 0
+
+
+def test_capture_cut_mid_event_drops_last_event(simulators, tmp_path):
+    filename = tmp_path / 'session.trf'
+    Record(simulators, str(filename))
+    events = list(IterEvents(str(filename)))
+    data = filename.read_bytes()
+    filename.write_bytes(data[:-1])
+
+    #Payloads are read one record at a time, the torn last one is left out
+    assert list(IterEvents(str(filename))) == events[:-1]
+    assert sum(EVENT.size + len(payload) for timestamp, port, kind, payload in events) == len(data) - HEADER.size
+    assert any(kind == RX for timestamp, port, kind, payload in events)
+
+
+def test_replay_rejects_other_files(tmp_path):
+    filename = tmp_path / 'session.trf'
+    filename.write_bytes(b'ADCRES01' + bytes(40))
+    with pytest.raises(ValueError):
+        TrafficReplay(str(filename))
+    with pytest.raises(ValueError):
+        list(IterEvents(str(filename)))
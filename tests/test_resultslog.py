@@ -0,0 +1,78 @@
+## @package test_resultslog
+#
+# Purpose: Tests of ResultsSink when records or batches fail, the test loop must never hang on the queue
+#
+# Version : V1.0
+
+import logging
+
+import pytest
+
+from ADC_ResultsLog import ResultsSink
+
+
+## Documentation for the BrokenFile class.
+#
+#  File whose writes fail, like a full disk
+class BrokenFile(object):
+
+    def write(self, data):
+        raise OSError(28, 'No space left on device')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+## Documentation for a function.
+#
+# Starts a sink on its own logger in tmp_path and returns it with the logger
+def StartSink(tmp_path, name, queueSize=10000):
+    sink = ResultsSink(str(tmp_path / 'SamplingEngine_Results.log'), 0.01, queueSize, logger=name).Start()
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    return sink, logger
+
+
+def test_sink_reports_record_it_cannot_format(tmp_path, capsys):
+    sink, logger = StartSink(tmp_path, 'test.format')
+    logger.info('Test %d,Passed', 'one')
+    logger.info('Test %d,Passed', 2)
+    sink.Stop()
+
+    assert sink.errors == 1
+    assert sink.records == 1
+    assert (tmp_path / 'SamplingEngine_Results.log').read_text().endswith('Test 2,Passed\n')
+    assert 'Logging error' in capsys.readouterr().err
+
+
+def test_sink_keeps_going_when_writes_fail(tmp_path, capsys):
+    sink, logger = StartSink(tmp_path, 'test.write', queueSize=4)
+    logFile, sink._file = sink._file, BrokenFile()
+    try:
+        for testCounter in range(50):
+            logger.info('Test %d,Passed', testCounter)
+        sink.Stop()
+    finally:
+        logFile.close()
+
+    assert sink.errors > 0
+    assert sink.records == 0
+    assert 'No space left on device' in capsys.readouterr().err
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_sink_stops_after_writer_died(tmp_path, capsys):
+    sink, logger = StartSink(tmp_path, 'test.died', queueSize=2)
+
+    def Die(record):
+        raise SystemExit
+    sink._Format = Die
+    for testCounter in range(4):
+        logger.info('Test %d,Passed', testCounter)
+    sink.Stop()
+
+    assert not sink.handler.writer.is_alive()
+    assert 'writer has stopped' in capsys.readouterr().err
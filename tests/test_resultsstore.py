@@ -0,0 +1,44 @@
+## @package test_resultsstore
+#
+# Purpose: Tests of ResultsStore on files left torn by a crash
+#
+# Version : V1.0
+
+import pytest
+
+from ADC_ResultsStore import HEADER, PASS_ALL, RECORD, LoadResults, ResultsStore
+
+
+## Documentation for a function.
+#
+# Appends the records of tests first to last, one channel each, to the store file
+def AppendTests(filename, first, last):
+    store = ResultsStore(filename)
+    for test in range(first, last+1):
+        store.Append(test, 1, 400 + test, 100, 700, 400, 100, 700, PASS_ALL, 0.0)
+    store.Close()
+    return store
+
+
+def test_store_cuts_torn_record_before_appending(tmp_path):
+    filename = str(tmp_path / 'results.bin')
+    AppendTests(filename, 1, 3)
+    #A crash in the middle of the fourth record
+    with open(filename, 'ab') as resultsFile:
+        resultsFile.write(RECORD.pack(4, 0.0, 1, PASS_ALL, 404, 100, 700, 400, 100, 700)[:RECORD.size//2])
+    store = AppendTests(filename, 5, 6)
+
+    assert store.truncated == RECORD.size//2
+    results = LoadResults(filename)
+    assert results['test'].tolist() == [1, 2, 3, 5, 6]
+    assert results['mean'].tolist() == [401, 402, 403, 405, 406]
+
+
+def test_store_rejects_short_file(tmp_path):
+    filename = tmp_path / 'results.bin'
+    filename.write_bytes(b'ADCRES')
+    with pytest.raises(ValueError):
+        LoadResults(str(filename))
+    with pytest.raises(ValueError):
+        ResultsStore(str(filename))
+    assert filename.stat().st_size < HEADER.size
@@ -0,0 +1,34 @@
+## @package test_simulator
+#
+# Purpose: Tests of DUTSimulator against a host that reads slower than the DUT reports
+#
+# Version : V1.0
+
+import time
+
+import serial
+
+from conftest import AMPLITUDE, FREQUENCY
+from ADC_FrameParser import FrameParser
+from ADC_Simulator import DUTSimulator
+
+
+def test_simulator_sends_whole_lines_to_slow_host():
+    sim = DUTSimulator(rate=50000, noise=1, seed=1)
+    sim.fAmp, sim.freq = AMPLITUDE, FREQUENCY
+    dutPort, uCPort = sim.Start()
+    try:
+        ser = serial.Serial(dutPort, 115200, timeout=0.1)
+        parser = FrameParser()
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            parser.ReadFrom(ser)
+            time.sleep(0.02)
+        ser.close()
+    finally:
+        sim.Stop()
+
+    #The port fills up, the reports due meanwhile are dropped whole instead of cut
+    assert sim.linesDropped > 0
+    assert parser.frames > 0
+    assert parser.malformed == 0